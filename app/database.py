@@ -1,14 +1,62 @@
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
 import os
 
-DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///./app/ecommerce.db")
+# A prebuilt snapshot (python -m app.snapshot) takes precedence over DATABASE_URL
+DB_SNAPSHOT_PATH = os.getenv("DB_SNAPSHOT_PATH")
 
+def get_database_url() -> str:
+    """URL of the serving database: the snapshot file if configured, else DATABASE_URL"""
+    if DB_SNAPSHOT_PATH:
+        return f"sqlite:///{DB_SNAPSHOT_PATH}"
+    return os.getenv("DATABASE_URL", "sqlite:///./app/ecommerce.db")
+
+DATABASE_URL = get_database_url()
+
+def get_database_path(url: str = DATABASE_URL):
+    """File path of a sqlite:/// URL, or None for in-memory and non-SQLite databases"""
+    prefix = "sqlite:///"
+    path = url[len(prefix):] if url.startswith(prefix) else ""
+    return path if path not in ("", ":memory:") else None
+
+# --- Writer engine: ingestion and startup checks ---
 engine = create_engine(DATABASE_URL, connect_args={"check_same_thread": False})
 
+@event.listens_for(engine, "connect")
+def _set_wal_mode(dbapi_connection, connection_record):
+    # WAL lets the read-only pool keep reading while the loader writes. It is a
+    # property of the file, so only a writer can set it; snapshots stay self-contained.
+    if not DB_SNAPSHOT_PATH:
+        dbapi_connection.execute("PRAGMA journal_mode = WAL")
+
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
+# --- Read-only serving pool: all generated SQL runs here ---
+READ_POOL_SIZE = int(os.getenv("DB_READ_POOL_SIZE", "8"))
+SQLITE_CACHE_SIZE_KIB = int(os.getenv("SQLITE_CACHE_SIZE_KIB", str(64 * 1024))) # Page cache per connection
+SQLITE_MMAP_SIZE = int(os.getenv("SQLITE_MMAP_SIZE", str(256 * 1024 * 1024))) # Bytes of the file to memory-map
+
+def get_readonly_url(url: str) -> str:
+    """Same SQLite file opened with mode=ro, so generated SQL can never write"""
+    path = get_database_path(url)
+    if path is None:
+        return url # In-memory databases cannot be reopened; query_only below still applies
+    return f"sqlite:///file:{path}?mode=ro&uri=true"
+
+READONLY_DATABASE_URL = get_readonly_url(DATABASE_URL)
+# Pool sizing only applies to file databases (in-memory ones use a per-thread pool)
+_read_pool_args = {"pool_size": READ_POOL_SIZE, "max_overflow": READ_POOL_SIZE} if READONLY_DATABASE_URL != DATABASE_URL else {}
+readonly_engine = create_engine(READONLY_DATABASE_URL, connect_args={"check_same_thread": False}, **_read_pool_args)
+
+@event.listens_for(readonly_engine, "connect")
+def _tune_read_connection(dbapi_connection, connection_record):
+    # Set once per pooled connection, not per request
+    dbapi_connection.execute(f"PRAGMA cache_size = -{SQLITE_CACHE_SIZE_KIB}")
+    dbapi_connection.execute(f"PRAGMA mmap_size = {SQLITE_MMAP_SIZE}")
+    dbapi_connection.execute("PRAGMA temp_store = MEMORY")
+    dbapi_connection.execute("PRAGMA query_only = ON")
+
 Base = declarative_base()
 
 # Dependency for FastAPI to get DB session
@@ -17,4 +65,4 @@ def get_db():
     try:
         yield db
     finally:
-        db.close()
\ No newline at end of file
+        db.close()
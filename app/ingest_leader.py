@@ -0,0 +1,76 @@
+# app/ingest_leader.py
+# Single-leader ingestion for multi-worker deployments (python run.py --prod):
+# the first worker to take an exclusive file lock ingests the CSVs and writes a
+# ready marker; the others wait for the marker and only read the database.
+# If the leader dies before writing the marker its lock is released and the
+# next waiting worker takes over.
+import json
+import logging
+import os
+import time
+from typing import Callable, Optional
+
+try:
+    import fcntl
+except ImportError: # Not available on Windows: every worker ingests, as in dev mode
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+INGEST_READY_TIMEOUT = float(os.getenv("INGEST_READY_TIMEOUT", "600"))
+_POLL_SECONDS = 0.2
+
+def lock_path_for(db_path: str) -> str:
+    return f"{db_path}.ingest.lock"
+
+def ready_marker_for(db_path: str) -> str:
+    return f"{db_path}.ready"
+
+def leader_election_enabled() -> bool:
+    return os.getenv("INGEST_LEADER_ELECTION", "0") == "1" and fcntl is not None
+
+def clear_ready_marker(db_path: str):
+    """Called by the launcher before starting workers, so a marker from an earlier run is never trusted"""
+    try:
+        os.remove(ready_marker_for(db_path))
+        logger.info(f"Removed stale ready marker for {db_path}")
+    except FileNotFoundError:
+        pass
+
+def _write_ready_marker(db_path: str):
+    marker = ready_marker_for(db_path)
+    with open(f"{marker}.tmp", "w", encoding="utf-8") as f:
+        json.dump({"pid": os.getpid(), "ready_at": time.time()}, f)
+    os.replace(f"{marker}.tmp", marker)
+
+def ingest_once(db_path: str, ingest: Callable[[], object], timeout: Optional[float] = None) -> bool:
+    """
+    Run `ingest` in exactly one process per launch. Returns True in the
+    process that ingested (the leader), False in followers once the
+    database is ready. Raises TimeoutError if it never becomes ready.
+    """
+    timeout = INGEST_READY_TIMEOUT if timeout is None else timeout
+    marker = ready_marker_for(db_path)
+    deadline = time.monotonic() + timeout
+    os.makedirs(os.path.dirname(os.path.abspath(db_path)), exist_ok=True)
+    with open(lock_path_for(db_path), "a") as lock_file:
+        while True:
+            if os.path.exists(marker):
+                logger.info(f"Worker {os.getpid()} following: database {db_path} is ready")
+                return False
+            try:
+                fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError: # Another worker is ingesting
+                if time.monotonic() > deadline:
+                    raise TimeoutError(f"Database {db_path} was not ready after {timeout:.0f}s")
+                time.sleep(_POLL_SECONDS)
+                continue
+            try:
+                if os.path.exists(marker): # The leader finished between our check and the lock
+                    continue
+                logger.info(f"Worker {os.getpid()} is the ingest leader for {db_path}")
+                ingest()
+                _write_ready_marker(db_path)
+                return True
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
@@ -1,23 +1,43 @@
 # app/main.py
+import time
+_import_start = time.perf_counter() # Startup breakdown: time spent importing the app
 
-from fastapi import FastAPI, Depends, HTTPException, BackgroundTasks
+from fastapi import FastAPI, HTTPException, Request
+from fastapi.responses import StreamingResponse, Response
+from starlette.concurrency import run_in_threadpool
 # Import sqlite3 module
 import sqlite3 # ADDED: Import sqlite3
 # Import CORS middleware
 from fastapi.middleware.cors import CORSMiddleware # <-- Added Import
 from sqlalchemy import text
-from sqlalchemy.orm import Session
-import time
-from typing import List, Dict, Any
+import os
+from typing import List, Dict, Any, AsyncIterator, Optional
 import logging
 # import io
 # import base64
 
-from app.database import get_db
-from app.schemas import QuestionRequest, SQLResponse, QueryResult
-from app.utils.data_loader import initialize_database, get_table_info
-from app.utils.text_to_sql import TextToSQLAgent
-from app.utils.visualizer import determine_chart_type_and_generate
+from app.database import readonly_engine, get_database_path, DB_SNAPSHOT_PATH
+from app.database import engine as serving_engine
+from app.snapshot import load_snapshot_schema
+from app.ingest_leader import leader_election_enabled, ingest_once
+from app.schemas import (
+    QuestionRequest, SQLResponse, QueryResult, StreamChunk, BatchQuestionRequest, BatchItemResult, BatchQueryResult,
+    JobRequest, JobStatus,
+)
+from app.utils.data_loader import initialize_database, get_table_info, explain_query_plans
+from app.utils.text_to_sql import TextToSQLAgent, LLMOverloadedError, EXAMPLE_QUERIES
+from app.utils.llm_client import LLMUnavailableError
+from app.utils.visualizer import generate_chart, determine_chart_type
+from app.utils.analytics_engine import analytics_engine, QueryExecutionError, QueryCancelledError
+from app.utils.rollup_router import rollup_router
+from app.utils.query_guard import query_guard, QueryRejectedError
+from app.utils.metrics import metrics, StageTimer
+from app.utils.result_cache import result_cache
+from app.utils.job_queue import job_queue, Job, JobQueueFullError, JobCancelledError
+from app.utils.chart_renderer import chart_renderer, ChartRenderError, ChartUnsupportedError, IMAGE_MEDIA_TYPES
+from app.utils.encoders import to_row_dicts, to_columnar, dumps_json, arrow_available, encode_arrow_ipc, ARROW_MEDIA_TYPE
+
+_import_seconds = time.perf_counter() - _import_start
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
@@ -38,31 +58,92 @@ app.add_middleware(
     allow_credentials=True, # Allow cookies/sessions if needed
     allow_methods=["*"], # Allow all HTTP methods (GET, POST, etc.)
     allow_headers=["*"], # Allow all headers (like Content-Type)
+    expose_headers=["Server-Timing"], # Let browser clients read the stage breakdown
 )
 
+@app.middleware("http")
+async def record_request_metrics(request: Request, call_next):
+    """Request count and latency per endpoint (route template, so /chart/{result_id} is one series)"""
+    start = time.perf_counter()
+    response = await call_next(request)
+    route = request.scope.get("route")
+    endpoint = getattr(route, "path", "unmatched")
+    metrics.observe("textsql_request_seconds", "Request latency until the response headers are sent",
+                    time.perf_counter() - start, endpoint=endpoint)
+    metrics.inc("textsql_requests_total", "Requests by endpoint and status code",
+                endpoint=endpoint, status=str(response.status_code))
+    return response
+
 
 # Global variables
 text_to_sql_agent = None
 table_info = None
+query_plan_report = None
+startup_timings: Dict[str, float] = {}
+# Retry-After for 503s while the LLM backend is unavailable (about the circuit breaker's reset time)
+LLM_RETRY_AFTER_SECONDS = int(float(os.getenv("LLM_BREAKER_RESET_SECONDS", "30")))
 
 @app.on_event("startup")
 async def startup_event():
     """Initialize database and AI agent on startup"""
-    global text_to_sql_agent, table_info
+    global text_to_sql_agent, table_info, query_plan_report
     logger.info("Initializing application...")
+    startup_timings.clear()
+    startup_timings["imports"] = _import_seconds
 
     try:
-        # Initialize database with CSV files
-        engine = initialize_database()
+        # Initialize database: attach a prebuilt snapshot, or ingest the CSV files
+        # (with several workers, only the elected leader ingests; the rest read)
+        stage_start = time.perf_counter()
+        snapshot_schema = None
+        database_path = get_database_path()
+        if analytics_engine.name == "duckdb": # Columnar engine: load the source files into DuckDB instead
+            if leader_election_enabled(): # One writer per file: followers wait, then open it read-only
+                await run_in_threadpool(ingest_once, analytics_engine.path, analytics_engine.ingest)
+            else:
+                await run_in_threadpool(analytics_engine.ingest)
+            engine = None
+        elif DB_SNAPSHOT_PATH:
+            engine = serving_engine
+            snapshot_schema = load_snapshot_schema(DB_SNAPSHOT_PATH)
+            logger.info(f"Using database snapshot: {DB_SNAPSHOT_PATH}")
+        elif leader_election_enabled() and database_path:
+            is_leader = await run_in_threadpool(ingest_once, database_path, initialize_database)
+            engine = serving_engine if is_leader else readonly_engine
+        else:
+            engine = initialize_database()
         logger.info("Database initialized.")
+        startup_timings["database"] = time.perf_counter() - stage_start
 
-        # Get table information
-        table_info = get_table_info(engine)
+        # Get table information (cached alongside the snapshot, else reflected)
+        stage_start = time.perf_counter()
+        if snapshot_schema:
+            table_info = snapshot_schema["table_info"]
+        elif engine is None:
+            table_info = analytics_engine.table_info()
+        else:
+            table_info = get_table_info(engine)
         logger.info(f"Schema loaded: {list(table_info.keys())}")
+        startup_timings["schema"] = time.perf_counter() - stage_start
+
+        # Check that the prompt's example query shapes are served by indexes (SQLite only: DuckDB scans columns)
+        if engine is not None:
+            stage_start = time.perf_counter()
+            query_plan_report = explain_query_plans(engine, [sql for _, sql in EXAMPLE_QUERIES])
+            startup_timings["query_plans"] = time.perf_counter() - stage_start
 
         # Initialize AI agent
-        text_to_sql_agent = TextToSQLAgent(table_info)
-        logger.info("AI Agent (Gemini) initialized.")
+        stage_start = time.perf_counter()
+        text_to_sql_agent = TextToSQLAgent(table_info, dialect=analytics_engine.dialect)
+        logger.info(f"AI Agent (Gemini) initialized for {analytics_engine.dialect} SQL.")
+        startup_timings["agent"] = time.perf_counter() - stage_start
+
+        # Workers for /jobs, and the chart image processes (warmed up in the background)
+        job_queue.start(_run_job)
+        chart_renderer.start()
+
+        breakdown = ", ".join(f"{stage}={seconds * 1000:.0f}ms" for stage, seconds in startup_timings.items())
+        logger.info(f"Startup breakdown: {breakdown} (total {sum(startup_timings.values()) * 1000:.0f}ms)")
     except Exception as e:
         logger.error(f"Error during startup: {e}")
         # Depending on requirements, you might want to exit or handle gracefully
@@ -77,56 +158,134 @@ async def get_schema():
     """Get database schema information"""
     return {"tables": table_info}
 
+@app.get("/query-plans")
+async def get_query_plans():
+    """EXPLAIN QUERY PLAN report for the prompt's example queries"""
+    return {"plans": query_plan_report}
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    """Cancel queued and running jobs, stop the chart processes, then release the analytics engine"""
+    await job_queue.stop()
+    chart_renderer.stop()
+    if text_to_sql_agent:
+        text_to_sql_agent.sql_cache.flush()
+    if analytics_engine.name == "duckdb":
+        analytics_engine.close()
+
 @app.post("/generate-sql", response_model=SQLResponse)
-async def generate_sql(request: QuestionRequest):
+async def generate_sql(request: QuestionRequest, response: Response):
     """Generate SQL from natural language question"""
     if not text_to_sql_agent:
         raise HTTPException(status_code=500, detail="AI Agent not initialized")
 
+    timer = StageTimer("/generate-sql")
     try:
-        sql_query = text_to_sql_agent.generate_sql_query(request.question)
-        return SQLResponse(sql_query=sql_query, question=request.question)
+        sql_query, sql_params, sql_source = await text_to_sql_agent.resolve_sql_query(request.question, timer)
+        metrics.inc("textsql_sql_source_total", "Questions answered per SQL source", source=sql_source)
+        response.headers["Server-Timing"] = timer.server_timing()
+        return SQLResponse(sql_query=sql_query, question=request.question, sql_source=sql_source, sql_params=sql_params)
+    except LLMOverloadedError as oe:
+        logger.warning(f"Rejected /generate-sql for '{request.question}': {oe}")
+        raise HTTPException(status_code=503, detail=str(oe))
+    except LLMUnavailableError as ue: # Circuit open, or no answer within the deadline and nothing cached
+        logger.warning(f"LLM unavailable for /generate-sql '{request.question}': {ue}")
+        raise HTTPException(status_code=503, detail=str(ue), headers={"Retry-After": str(LLM_RETRY_AFTER_SECONDS)})
     except Exception as e:
          logger.error(f"Error in /generate-sql: {e}")
          raise HTTPException(status_code=500, detail=f"Failed to generate SQL: {str(e)}")
 
+def _execute_routed(sql_query: str, sql_params: Dict[str, Any], timer: StageTimer):
+    """
+    Route and run SQL on a pooled connection (call off the event loop). The
+    connection is only taken once the SQL exists, never across an LLM wait.
+    """
+    with analytics_engine.connect() as conn:
+        with timer.stage("sql_rewrite"):
+            routed = rollup_router.route(conn, sql_query)
+        logger.info(f"Executing query: {routed.sql_query} with params {sql_params} (served by {routed.served_by})")
+        with timer.stage("sql_execute"):
+            output = analytics_engine.execute(conn, routed.sql_query, sql_params)
+    return output, routed
+
 @app.post("/ask", response_model=QueryResult) # Changed endpoint name to be more intuitive
-async def ask_question(request: QuestionRequest, db: Session = Depends(get_db)):
+async def ask_question(request: QuestionRequest):
     """Generate SQL, execute it, and return results"""
     if not text_to_sql_agent:
         raise HTTPException(status_code=500, detail="AI Agent not initialized")
+    if request.response_format == "arrow" and not arrow_available():
+        raise HTTPException(status_code=400, detail="Arrow output requires the 'pyarrow' package on the server.")
 
     start_time = time.time()
+    timer = StageTimer("/ask")
     sql_query = "" # Initialize sql_query for error handling
     try:
-        # 1. Generate SQL
-        sql_query = text_to_sql_agent.generate_sql_query(request.question)
+        # 1. Generate SQL (rule fast path, caches, or the LLM off the event loop)
+        sql_query, sql_params, sql_source = await text_to_sql_agent.resolve_sql_query(request.question, timer)
+        metrics.inc("textsql_sql_source_total", "Questions answered per SQL source", source=sql_source)
 
-        # 2. Execute Query
-        logger.info(f"Executing query: {sql_query}")
-        result = db.execute(text(sql_query))
-        rows = result.fetchall()
+        # 2. Execute Query (guarded and read-only; served from the result cache when the data is unchanged)
+        # Aggregates a rollup table answers exactly are rewritten to read it instead of the base table
+        (columns, rows, truncated), routed = await run_in_threadpool(_execute_routed, sql_query, sql_params, timer)
         execution_time = time.time() - start_time
 
-        # 3. Process Results
-        columns = result.keys()
-        results = [dict(zip(columns, row)) for row in rows]
-        
-        # 4. Generate Chart Data (Bonus)
-        chart_data, chart_type = determine_chart_type_and_generate(request.question, results)
+        # Binary output for programmatic clients: no chart, metadata in the Arrow schema
+        if request.response_format == "arrow":
+            with timer.stage("response_encode"):
+                body = encode_arrow_ipc(columns, rows, {
+                    "question": request.question, "sql_query": sql_query, "execution_time": execution_time,
+                    "sql_source": sql_source, "sql_params": dumps_json(sql_params).decode("utf-8"), "truncated": truncated,
+                    "served_by": routed.served_by,
+                    "timings": dumps_json(timer.timings).decode("utf-8"),
+                })
+            return Response(content=body, media_type=ARROW_MEDIA_TYPE, headers={"Server-Timing": timer.server_timing()})
 
-        # 5. Prepare Response (Bonus: Add chart data if applicable)
+        # 3. Generate Chart Data (Bonus), straight from the column arrays, unless deferred
+        chart_data, chart_type = None, None
+        if not request.defer_chart:
+            with timer.stage("chart_build"):
+                chart_data, chart_type = generate_chart(request.question, columns, rows)
+
+        # 4. Prepare Response (Bonus: Add chart data if applicable)
         response_data = {
             "question": request.question,
             "sql_query": sql_query,
-            "results": results,
             "execution_time": execution_time,
              "chart_data": chart_data, # From visualizer
-            "chart_type": chart_type
+            "chart_type": chart_type,
+            "result_id": result_cache.make_key(routed.sql_query, params=sql_params),
+            "sql_source": sql_source,
+            "sql_params": sql_params,
+            "truncated": truncated,
+            "served_by": routed.served_by,
+            "timings": timer.timings,
         }
 
-        return QueryResult(**response_data)
+        # Columnar layout goes straight to the fast encoder (no per-row model validation)
+        if request.response_format == "columnar":
+            with timer.stage("row_conversion"):
+                response_data.update(to_columnar(columns, rows))
+            with timer.stage("response_encode"):
+                body = dumps_json(response_data)
+        else:
+            with timer.stage("row_conversion"):
+                response_data["results"] = to_row_dicts(columns, rows)
+            with timer.stage("response_encode"):
+                body = QueryResult(**response_data).model_dump_json()
+        return Response(content=body, media_type="application/json", headers={"Server-Timing": timer.server_timing()})
     
+    except LLMOverloadedError as oe: # Backpressure: too many LLM calls queued
+        logger.warning(f"Rejected /ask for '{request.question}': {oe}")
+        raise HTTPException(status_code=503, detail=str(oe))
+    except LLMUnavailableError as ue: # Circuit open, or no answer within the deadline and nothing cached
+        logger.warning(f"LLM unavailable for /ask '{request.question}': {ue}")
+        raise HTTPException(status_code=503, detail=str(ue), headers={"Retry-After": str(LLM_RETRY_AFTER_SECONDS)})
+    except QueryRejectedError as qe: # Failed the query guard, or ran past the time limit
+        logger.warning(f"Query guard stopped '{sql_query}' (question: {request.question}): {qe}")
+        raise HTTPException(status_code=400, detail=f"Query rejected: {str(qe)}")
+    except QueryExecutionError as ee: # The analytics engine could not run the generated SQL
+        logger.error(f"Database Execution Error for query '{sql_query}' (question: {request.question}): {ee}")
+        raise HTTPException(status_code=400, detail=f"Database error executing query: {str(ee)}")
     except ValueError as ve: # Catch specific errors from the LLM agent (like invalid SQL start)
         logger.error(f"LLM Generation Error for question '{request.question}': {ve}")
         raise HTTPException(status_code=400, detail=f"Failed to generate a valid SQL query: {str(ve)}")
@@ -137,14 +296,421 @@ async def ask_question(request: QuestionRequest, db: Session = Depends(get_db)):
         logger.error(f"Unexpected Error in /ask for question '{request.question}': {e}", exc_info=True) # Log full traceback
         raise HTTPException(status_code=500, detail=f"An internal error occurred: {str(e)}") # Generic 500 for unexpected issues
 
+# --- Batch endpoint ---
+BATCH_MAX_QUESTIONS = int(os.getenv("BATCH_MAX_QUESTIONS", "500"))
+
+def _execute_batch(resolutions: List[Any]) -> Dict[str, Any]:
+    """
+    Run every distinct (SQL, params) of a batch over one connection.
+    Returns result_id -> ((columns, rows, truncated), seconds, RoutedQuery) or the exception.
+    """
+    outcomes: Dict[str, Any] = {}
+    with analytics_engine.connect() as conn:
+        for resolution in resolutions:
+            if isinstance(resolution, Exception):
+                continue
+            result_id = result_cache.make_key(resolution.sql_query, params=resolution.params)
+            if result_id in outcomes:
+                continue
+            start = time.perf_counter()
+            try:
+                routed = rollup_router.route(conn, resolution.sql_query)
+                outcomes[result_id] = (analytics_engine.execute(conn, routed.sql_query, resolution.params),
+                                       time.perf_counter() - start, routed)
+            except Exception as e:
+                logger.error(f"Batch query failed '{resolution.sql_query}' with params {resolution.params}: {e}")
+                analytics_engine.recover(conn) # Keep the connection usable for the remaining queries
+                outcomes[result_id] = e
+    return outcomes
+
+@app.post("/ask-batch", response_model=BatchQueryResult)
+async def ask_batch(request: BatchQuestionRequest, response: Response):
+    """Answer many questions in one request: shared LLM calls, one DB connection, per-question errors"""
+    if not text_to_sql_agent:
+        raise HTTPException(status_code=500, detail="AI Agent not initialized")
+    if len(request.questions) > BATCH_MAX_QUESTIONS:
+        raise HTTPException(status_code=400, detail=f"At most {BATCH_MAX_QUESTIONS} questions per batch.")
+
+    timer = StageTimer("/ask-batch")
+    questions = [item.question for item in request.questions]
+
+    # 1. SQL for every distinct question (rules/caches first, then packed LLM calls)
+    with timer.stage("sql_generation"):
+        resolutions = await text_to_sql_agent.resolve_sql_batch(questions)
+
+    # 2. Execute each distinct query once, over a single connection, off the event loop
+    with timer.stage("sql_execute"):
+        outcomes = await run_in_threadpool(_execute_batch, resolutions)
+
+    # 3. Per-question charts and rows
+    items = []
+    for item, resolution in zip(request.questions, resolutions):
+        if isinstance(resolution, Exception):
+            items.append(BatchItemResult(question=item.question, error=f"Failed to generate SQL: {resolution}"))
+            continue
+        result_id = result_cache.make_key(resolution.sql_query, params=resolution.params)
+        outcome = outcomes[result_id]
+        fields = {"question": item.question, "sql_query": resolution.sql_query,
+                  "sql_params": resolution.params, "sql_source": resolution.source}
+        if isinstance(outcome, QueryRejectedError):
+            items.append(BatchItemResult(**fields, error=f"Query rejected: {outcome}"))
+            continue
+        if isinstance(outcome, Exception):
+            items.append(BatchItemResult(**fields, error=f"Database error executing query: {getattr(outcome, 'orig', outcome)}"))
+            continue
+        (columns, rows, truncated), execution_time, routed = outcome
+        result_id = result_cache.make_key(routed.sql_query, params=resolution.params) # The key the result was cached under
+        if not item.defer_chart:
+            with timer.stage("chart_build"):
+                fields["chart_data"], fields["chart_type"] = generate_chart(item.question, columns, rows)
+        with timer.stage("row_conversion"):
+            fields["results"] = to_row_dicts(columns, rows)
+        items.append(BatchItemResult(**fields, execution_time=execution_time, result_id=result_id, truncated=truncated,
+                                     served_by=routed.served_by))
+
+    total_time = timer.elapsed()
+    unique_questions = len({text_to_sql_agent.cache_key(q) for q in questions})
+    logger.info(f"/ask-batch answered {len(questions)} questions ({unique_questions} unique) in {total_time:.3f}s: {timer.timings}")
+    response.headers["Server-Timing"] = timer.server_timing()
+    return BatchQueryResult(results=items, unique_questions=unique_questions, total_time=total_time, timings=timer.timings)
+
+async def _chart_result(result_id: str, question: str):
+    """
+    (columns, rows) behind a chart: the cached result, or the question answered
+    again when this worker does not have it (expired, or issued by another
+    worker under run.py --prod, whose result cache is its own).
+    """
+    cached = result_cache.get(result_id)
+    if cached is not None:
+        return cached
+    if not question or not text_to_sql_agent:
+        raise HTTPException(status_code=404, detail="Result not found or expired; pass question to re-run it, or ask again.")
+    logger.info(f"Result {result_id} not cached in this worker, answering '{question}' again for its chart")
+    try:
+        sql_query, sql_params, _ = await text_to_sql_agent.resolve_sql_query(question)
+        (columns, rows, _), routed = await run_in_threadpool(_execute_routed, sql_query, sql_params, StageTimer("/chart"))
+    except LLMOverloadedError as oe:
+        raise HTTPException(status_code=503, detail=str(oe))
+    except LLMUnavailableError as ue:
+        raise HTTPException(status_code=503, detail=str(ue), headers={"Retry-After": str(LLM_RETRY_AFTER_SECONDS)})
+    except QueryRejectedError as qe:
+        raise HTTPException(status_code=400, detail=f"Query rejected: {str(qe)}")
+    except Exception as e:
+        logger.error(f"Could not re-run '{question}' for chart {result_id}: {e}")
+        raise HTTPException(status_code=400, detail=f"Could not re-run the question: {str(e)}")
+    # The data version prefix is per worker, but the digest names the SQL and params:
+    # a different question, or the same one now answered with other SQL, is not this result
+    rerun_id = result_cache.make_key(routed.sql_query, params=sql_params)
+    if rerun_id.split(":", 1)[-1] != result_id.split(":", 1)[-1]:
+        logger.warning(f"Re-running '{question}' gave result {rerun_id}, not {result_id}")
+        raise HTTPException(status_code=409, detail="question does not produce this result; ask again for a fresh result_id.")
+    return columns, rows
+
+@app.get("/chart/{result_id}")
+async def get_chart(result_id: str, question: str = "", chart_type: Optional[str] = None):
+    """Build the chart for a cached /ask result (used with defer_chart=true)"""
+    columns, rows = await _chart_result(result_id, question)
+    chart_data, chart_type = generate_chart(question, columns, rows, chart_type)
+    return {"result_id": result_id, "chart_data": chart_data, "chart_type": chart_type}
+
+@app.get("/chart/{result_id}/image")
+async def get_chart_image(result_id: str, request: Request, question: str = "", chart_type: Optional[str] = None,
+                          format: str = "png"):
+    """PNG or SVG image of the chart for a cached result (e.g. for email reports), rendered off the event loop"""
+    if format not in IMAGE_MEDIA_TYPES:
+        raise HTTPException(status_code=400, detail=f"format must be one of: {', '.join(IMAGE_MEDIA_TYPES)}")
+    if not chart_renderer.enabled:
+        raise HTTPException(status_code=503, detail="Chart image rendering is disabled (CHART_RENDER_WORKERS=0).")
+    columns, rows = await _chart_result(result_id, question)
+    chart_type = chart_type or determine_chart_type(question, len(rows), len(columns))
+    if not rows or not chart_type:
+        raise HTTPException(status_code=400, detail="No chart type fits these results; pass chart_type.")
+    try:
+        image, image_key, from_cache = await chart_renderer.render(columns, rows, chart_type, f"Visualization for: {question}", format)
+    except ChartUnsupportedError as ue:
+        raise HTTPException(status_code=400, detail=str(ue))
+    except ChartRenderError as ce:
+        logger.error(f"Chart image for {result_id} failed: {ce}")
+        raise HTTPException(status_code=503, detail=str(ce))
+    headers = {"ETag": f'"{image_key}"', "Cache-Control": "private, max-age=3600",
+               "X-Chart-Cache": "hit" if from_cache else "miss"}
+    if request.headers.get("If-None-Match") == headers["ETag"]:
+        return Response(status_code=304, headers=headers)
+    return Response(content=image, media_type=IMAGE_MEDIA_TYPES[format], headers=headers)
+
 @app.get("/health")
 async def health_check():
     """Health check endpoint"""
     return {"status": "healthy", "ai_agent_ready": text_to_sql_agent is not None}
 
-# Optional: Streaming endpoint (more complex)
-# @app.post("/ask-stream")
-# async def ask_question_streamed(request: QuestionRequest, background_tasks: BackgroundTasks):
-#     # Implementation for streaming chunks (SQL, results, final)
-#     # Would use yield and Server-Sent Events (SSE) or WebSockets
-#     pass
\ No newline at end of file
+@app.get("/stats")
+async def get_stats():
+    """Cache statistics"""
+    if not text_to_sql_agent:
+        raise HTTPException(status_code=500, detail="AI Agent not initialized")
+    return {
+        "sql_cache": text_to_sql_agent.sql_cache.stats(),
+        "template_cache": text_to_sql_agent.template_cache.stats(),
+        "llm": text_to_sql_agent.llm_stats(),
+        "llm_client": text_to_sql_agent.llm_client.stats(),
+        "rules": text_to_sql_agent.rule_compiler.stats() if text_to_sql_agent.rule_compiler else None,
+        "result_cache": result_cache.stats(),
+        "query_guard": query_guard.stats(),
+        "analytics_engine": analytics_engine.name,
+        "rollups": rollup_router.stats(),
+        "jobs": job_queue.stats(),
+        "chart_images": chart_renderer.stats(),
+        "startup_timings": startup_timings,
+    }
+
+@app.get("/metrics")
+async def get_metrics():
+    """Prometheus text format: stage/request histograms, request counters, LLM tokens and cache hit rates"""
+    collected = {}
+    def add(name: str, metric_type: str, help_text: str, value: float, **labels: str):
+        collected.setdefault(name, (metric_type, help_text, {}))[2][tuple(sorted(labels.items()))] = value
+
+    chart_images = chart_renderer.stats()
+    caches = {"result": result_cache.stats(), "chart_image": chart_images}
+    add("textsql_chart_renders_total", "counter", "Chart images rendered by the process pool", chart_images["renders"])
+    add("textsql_chart_render_errors_total", "counter", "Chart image renders that failed or timed out", chart_images["render_errors"])
+    add("textsql_chart_renders_per_second", "gauge", "Chart images rendered per second over the last minute", chart_images["renders_per_second"])
+    if text_to_sql_agent:
+        caches["sql"] = text_to_sql_agent.sql_cache.stats()
+        caches["template"] = text_to_sql_agent.template_cache.stats()
+        llm = text_to_sql_agent.llm_stats()
+        add("textsql_llm_calls_total", "counter", "Gemini calls (packed calls count once)", llm["llm_calls"])
+        add("textsql_llm_errors_total", "counter", "Gemini calls that raised", llm["llm_errors"])
+        add("textsql_llm_tokens_total", "counter", "LLM tokens sent and received", llm["prompt_tokens_total"], direction="prompt")
+        add("textsql_llm_tokens_total", "counter", "LLM tokens sent and received", llm["completion_tokens_total"], direction="completion")
+        add("textsql_llm_in_flight", "gauge", "Distinct LLM calls in progress", llm["in_flight"])
+        add("textsql_llm_coalesced_total", "counter", "Requests that joined an in-flight LLM call", llm["coalesced"])
+        add("textsql_llm_rejected_total", "counter", "Requests rejected by LLM backpressure", llm["rejected"])
+        add("textsql_llm_stale_served_total", "counter", "Expired cached SQL served while the LLM was unavailable", llm["stale_served"])
+        client = text_to_sql_agent.llm_client.stats()
+        for event in ("attempts", "retries", "hedges", "hedge_wins", "timeouts", "failures", "short_circuited"):
+            add("textsql_llm_client_events_total", "counter", "LLM client attempts, retries, hedges and failures", client[event], event=event)
+        add("textsql_llm_circuit_open", "gauge", "1 while the LLM circuit breaker is open or half-open", int(client["circuit_state"] != "closed"))
+        add("textsql_llm_hedge_delay_seconds", "gauge", "Current delay before a hedged LLM request", client["hedge_delay_seconds"])
+        if text_to_sql_agent.rule_compiler:
+            rules = text_to_sql_agent.rule_compiler.stats()
+            add("textsql_rule_attempts_total", "counter", "Questions tried against the rule compiler", rules["attempts"])
+            add("textsql_rule_hits_total", "counter", "Questions answered by the rule compiler", rules["hits"])
+    for cache_name, stats in caches.items():
+        add("textsql_cache_hits_total", "counter", "Cache hits", stats["hits"], cache=cache_name)
+        add("textsql_cache_misses_total", "counter", "Cache misses", stats["misses"], cache=cache_name)
+        add("textsql_cache_hit_ratio", "gauge", "Cache hits / lookups since start", stats["hit_rate"], cache=cache_name)
+    jobs = job_queue.stats()
+    for priority in jobs["queued"]:
+        add("textsql_jobs_queued", "gauge", "Jobs waiting for a worker", jobs["queued"][priority], priority=priority)
+        add("textsql_jobs_running", "gauge", "Jobs being answered", jobs["running"][priority], priority=priority)
+    for status, count in jobs["finished"].items():
+        add("textsql_jobs_finished_total", "counter", "Finished jobs by outcome", count, status=status)
+    add("textsql_jobs_rejected_total", "counter", "Jobs refused because the queue was full", jobs["rejected"])
+    guard = query_guard.stats()
+    add("textsql_query_guard_rejected_total", "counter", "Queries rejected before execution", guard["rejected"])
+    add("textsql_query_guard_aborted_total", "counter", "Queries aborted at the time limit", guard["aborted"])
+    return Response(content=metrics.render(collected), media_type="text/plain; version=0.0.4; charset=utf-8")
+
+# --- Job endpoints ---
+# Longest a GET /jobs/{job_id}?wait= long poll is held open
+JOB_MAX_WAIT_SECONDS = float(os.getenv("JOB_MAX_WAIT_SECONDS", "60"))
+
+def _execute_job_query(job: Job, sql_query: str, sql_params: Dict[str, Any], timer: StageTimer):
+    """Route and run a job's SQL on its own connection; cancelling the job interrupts the statement"""
+    with analytics_engine.connect() as conn, job.interruptible(lambda: analytics_engine.interrupt(conn)):
+        with timer.stage("sql_rewrite"):
+            routed = rollup_router.route(conn, sql_query)
+        with timer.stage("sql_execute"):
+            output = analytics_engine.execute(conn, routed.sql_query, sql_params)
+    return output, routed
+
+async def _run_job(job: Job) -> Dict[str, Any]:
+    """Answer a queued question like /ask (rows format); errors become the job's error message"""
+    start_time = time.time()
+    timer = StageTimer("/jobs")
+    try:
+        sql_query, sql_params, sql_source = await text_to_sql_agent.resolve_sql_query(job.question, timer)
+    except Exception as e:
+        raise RuntimeError(f"Failed to generate SQL: {e}") from e
+    metrics.inc("textsql_sql_source_total", "Questions answered per SQL source", source=sql_source)
+    try:
+        (columns, rows, truncated), routed = await run_in_threadpool(_execute_job_query, job, sql_query, sql_params, timer)
+    except (JobCancelledError, QueryCancelledError):
+        raise
+    except QueryRejectedError as qe:
+        raise RuntimeError(f"Query rejected: {qe}") from qe
+    except Exception as e:
+        raise RuntimeError(f"Database error executing query: {getattr(e, 'orig', e)}") from e
+    execution_time = time.time() - start_time
+
+    chart_data, chart_type = None, None
+    if not job.options.get("defer_chart"):
+        with timer.stage("chart_build"):
+            chart_data, chart_type = generate_chart(job.question, columns, rows)
+    with timer.stage("row_conversion"):
+        results = to_row_dicts(columns, rows)
+    return QueryResult(
+        question=job.question, sql_query=sql_query, results=results, execution_time=execution_time,
+        chart_data=chart_data, chart_type=chart_type, result_id=result_cache.make_key(routed.sql_query, params=sql_params),
+        truncated=truncated, timings=timer.timings, sql_source=sql_source, sql_params=sql_params,
+        served_by=routed.served_by,
+    ).model_dump()
+
+def _job_status(job: Job) -> JobStatus:
+    return JobStatus(
+        job_id=job.job_id, status=job.status, question=job.question, priority=job.priority, client_id=job.client_id,
+        submitted_at=job.submitted_at, started_at=job.started_at, finished_at=job.finished_at,
+        queue_position=job_queue.queue_position(job), result=job.result, error=job.error,
+    )
+
+def _get_job(job_id: str) -> Job:
+    job = job_queue.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found or its result expired.")
+    return job
+
+@app.post("/jobs", response_model=JobStatus, status_code=202)
+async def submit_job(request: JobRequest, http_request: Request):
+    """Queue a question; poll GET /jobs/{job_id} or subscribe to /jobs/{job_id}/events for the result"""
+    if not text_to_sql_agent:
+        raise HTTPException(status_code=500, detail="AI Agent not initialized")
+    # Per-client limits apply to X-Client-ID, or to the caller's address without one
+    client_id = http_request.headers.get("X-Client-ID") or (http_request.client.host if http_request.client else "anonymous")
+    try:
+        job = job_queue.submit(request.question, request.priority, client_id, {"defer_chart": request.defer_chart})
+    except JobQueueFullError as fe:
+        logger.warning(f"Rejected job for '{request.question}': {fe}")
+        raise HTTPException(status_code=503, detail=str(fe))
+    return _job_status(job)
+
+@app.get("/jobs/{job_id}", response_model=JobStatus)
+async def get_job(job_id: str, wait: float = 0):
+    """Job status, with the result once finished; wait > 0 holds the request until the job finishes (long poll)"""
+    job = _get_job(job_id)
+    deadline = time.monotonic() + min(wait, JOB_MAX_WAIT_SECONDS)
+    while not job.finished and time.monotonic() < deadline:
+        await job.wait_for_change(deadline - time.monotonic())
+    return _job_status(job)
+
+async def _job_events(job: Job) -> AsyncIterator[str]:
+    """A status event per change, until the job finishes (the last event carries the result or error)"""
+    while True:
+        yield _sse_event("status", _job_status(job).model_dump())
+        if job.finished:
+            break
+        await job.wait_for_change()
+
+@app.get("/jobs/{job_id}/events")
+async def subscribe_job(job_id: str):
+    """Stream the job's status changes as Server-Sent Events"""
+    job = _get_job(job_id)
+    return StreamingResponse(_job_events(job), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+@app.delete("/jobs/{job_id}", response_model=JobStatus)
+async def cancel_job(job_id: str):
+    """Cancel a queued or running job (a running SQL statement is interrupted)"""
+    job = _get_job(job_id)
+    job_queue.cancel(job_id)
+    if not job.finished: # Give the worker a moment to stop the running job
+        await job.wait_for_change(1.0)
+    return _job_status(job)
+
+# --- Streaming endpoint (Server-Sent Events) ---
+STREAM_BATCH_SIZE = int(os.getenv("STREAM_BATCH_SIZE", "500"))
+# The chart is built from at most this many leading rows so memory stays flat for huge results
+STREAM_CHART_MAX_ROWS = int(os.getenv("STREAM_CHART_MAX_ROWS", "1000"))
+
+def _sse_event(chunk_type: str, content: Any) -> str:
+    """Format one StreamChunk as a Server-Sent Event"""
+    return f"event: {chunk_type}\ndata: {StreamChunk(type=chunk_type, content=content).model_dump_json()}\n\n"
+
+def _open_stream(sql_query: str, sql_params: Dict[str, Any]):
+    """
+    Take a pooled connection, route the SQL and set up its batch iterator (call
+    off the event loop, once the SQL exists). Returns (conn, routed, batches).
+    """
+    conn = analytics_engine.connect()
+    try:
+        routed = rollup_router.route(conn, sql_query)
+        batches = analytics_engine.iter_batches(conn, routed.sql_query, STREAM_BATCH_SIZE, sql_params)
+    except Exception:
+        conn.close()
+        raise
+    return conn, routed, batches
+
+async def _stream_answer(question: str) -> AsyncIterator[str]:
+    """Yield the SQL as soon as it exists, then row batches, then the chart and a summary"""
+    start_time = time.time()
+    timer = StageTimer("/ask-stream")
+    sql_query = ""
+    db = batches = None
+    try:
+        # 1. Generate SQL and send it right away
+        sql_query, sql_params, sql_source = await text_to_sql_agent.resolve_sql_query(question, timer)
+        metrics.inc("textsql_sql_source_total", "Questions answered per SQL source", source=sql_source)
+        yield _sse_event("sql", sql_query)
+
+        # 2. Stream rows from the cursor in fetchmany batches (run off the event loop)
+        db, routed, batches = await run_in_threadpool(_open_stream, sql_query, sql_params)
+        columns: List[str] = []
+        chart_rows: List[tuple] = []
+        row_count = 0
+        execute_seconds = encode_seconds = 0.0 # Summed over batches, recorded once
+        while True:
+            stage_start = time.perf_counter()
+            batch = await run_in_threadpool(next, batches, None)
+            execute_seconds += time.perf_counter() - stage_start
+            if batch is None:
+                break
+            batch_columns, rows = batch
+            if not columns:
+                columns = batch_columns
+                yield _sse_event("columns", columns)
+            row_count += len(rows)
+            if len(chart_rows) < STREAM_CHART_MAX_ROWS:
+                chart_rows.extend(rows[:STREAM_CHART_MAX_ROWS - len(chart_rows)])
+            stage_start = time.perf_counter()
+            event = _sse_event("rows", [list(row) for row in rows])
+            encode_seconds += time.perf_counter() - stage_start
+            yield event
+        timer.record("sql_execute", execute_seconds)
+        timer.record("response_encode", encode_seconds)
+        execution_time = time.time() - start_time
+
+        # 3. Chart last, from the leading rows
+        with timer.stage("chart_build"):
+            chart_data, chart_type = generate_chart(question, columns, chart_rows)
+        yield _sse_event("chart", {"chart_data": chart_data, "chart_type": chart_type})
+
+        yield _sse_event("final", {
+            "question": question,
+            "sql_query": sql_query,
+            "sql_source": sql_source,
+            "sql_params": sql_params,
+            "served_by": routed.served_by,
+            "row_count": row_count,
+            "execution_time": execution_time,
+            "chart_truncated": row_count > len(chart_rows),
+            "timings": timer.timings,
+        })
+    except Exception as e:
+        logger.error(f"Error in /ask-stream for question '{question}' (query: '{sql_query}'): {e}", exc_info=True)
+        yield _sse_event("error", str(e))
+    finally:
+        if batches is not None: # Closes its cursor and time limit before the connection goes back to the pool
+            batches.close()
+        if db is not None:
+            db.close()
+
+@app.post("/ask-stream")
+async def ask_question_streamed(request: QuestionRequest):
+    """Generate SQL, execute it, and stream SQL, rows and chart as Server-Sent Events"""
+    if not text_to_sql_agent:
+        raise HTTPException(status_code=500, detail="AI Agent not initialized")
+    return StreamingResponse(
+        _stream_answer(request.question),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
\ No newline at end of file
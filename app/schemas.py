@@ -1,12 +1,20 @@
 from pydantic import BaseModel
-from typing import List, Dict, Any, Optional
+from typing import List, Dict, Any, Optional, Literal
 
 class QuestionRequest(BaseModel):
     question: str
+    # "rows": list of dicts (default), "columnar": column arrays, "arrow": Arrow IPC stream
+    response_format: Literal["rows", "columnar", "arrow"] = "rows"
+    # Skip chart generation here; fetch it later from /chart/{result_id}
+    defer_chart: bool = False
 
 class SQLResponse(BaseModel):
     sql_query: str
     question: str
+    # Which path produced the SQL: "rules", "cache", "template" or "llm"
+    sql_source: Optional[str] = None
+    # Values bound to the :pN placeholders in sql_query (empty if it has none)
+    sql_params: Dict[str, Any] = {}
 
 class QueryResult(BaseModel):
     question: str
@@ -16,6 +24,64 @@ class QueryResult(BaseModel):
     # Optional: for bonus chart data
     chart_data: Optional[Dict[str, Any]] = None
     chart_type: Optional[str] = None
+    # Handle for GET /chart/{result_id} (valid while the result stays cached)
+    result_id: Optional[str] = None
+    # True when results were cut off at the QUERY_MAX_ROWS row cap
+    truncated: bool = False
+    # Seconds per stage (prompt_build, llm_call, sql_rewrite, sql_execute, row_conversion, chart_build);
+    # response_encode is only known after this body is built, so it is in the Server-Timing header
+    timings: Dict[str, float] = {}
+    # Which path produced the SQL: "rules", "cache", "template" or "llm"
+    sql_source: Optional[str] = None
+    # Values bound to the :pN placeholders in sql_query (empty if it has none)
+    sql_params: Dict[str, Any] = {}
+    # Table the query was answered from: a rollup table when sql_query was routed to one, else the base table(s)
+    served_by: Optional[str] = None
+
+class BatchQuestionRequest(BaseModel):
+    # Answered in one round trip; response_format is ignored (results are always rows)
+    questions: List[QuestionRequest]
+
+class BatchItemResult(BaseModel):
+    question: str
+    sql_query: Optional[str] = None
+    sql_params: Dict[str, Any] = {}
+    sql_source: Optional[str] = None
+    results: Optional[List[Dict[str, Any]]] = None
+    execution_time: Optional[float] = None # SQL execution time for this question
+    chart_data: Optional[Dict[str, Any]] = None
+    chart_type: Optional[str] = None
+    result_id: Optional[str] = None
+    truncated: bool = False
+    served_by: Optional[str] = None
+    # Set instead of results when this question failed; the rest of the batch is unaffected
+    error: Optional[str] = None
+
+class BatchQueryResult(BaseModel):
+    results: List[BatchItemResult] # Same order as the request
+    unique_questions: int
+    total_time: float
+    # Wall time per stage: sql_generation, sql_execution, charts, row_conversion
+    timings: Dict[str, float]
+
+class JobRequest(BaseModel):
+    question: str
+    # "interactive" jobs are picked before "batch" ones; batch jobs never occupy every worker
+    priority: Literal["interactive", "batch"] = "interactive"
+    defer_chart: bool = False
+
+class JobStatus(BaseModel):
+    job_id: str
+    status: str # "queued", "running", "succeeded", "failed" or "cancelled"
+    question: str
+    priority: str
+    client_id: str
+    submitted_at: float # Unix timestamps
+    started_at: Optional[float] = None
+    finished_at: Optional[float] = None
+    queue_position: Optional[int] = None # 0 = next to be picked (while queued)
+    result: Optional[QueryResult] = None # Once succeeded, until the result expires
+    error: Optional[str] = None # Once failed
 
 class StreamChunk(BaseModel):
     # For potential streaming implementation
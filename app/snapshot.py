@@ -0,0 +1,64 @@
+# app/snapshot.py
+# Offline database snapshot builder, so the server does not ingest CSVs at boot:
+#
+#   python -m app.snapshot --data data --output app/ecommerce.snapshot.db
+#
+# Writes a compacted, ready-to-open SQLite file plus <output>.schema.json with
+# the reflected schema. Start the server with DB_SNAPSHOT_PATH=<output> to use it.
+import argparse
+import json
+import logging
+import os
+import time
+from typing import Any, Dict, Optional
+
+from app.utils.data_loader import initialize_database, get_table_info
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+def schema_path_for(db_path: str) -> str:
+    return f"{db_path}.schema.json"
+
+def build_snapshot(data_folder: str, output_path: str) -> Dict[str, Any]:
+    """Ingest the CSVs into a fresh SQLite file and atomically move it into place"""
+    start = time.perf_counter()
+    building_path = f"{output_path}.building"
+    if os.path.exists(building_path):
+        os.remove(building_path)
+
+    engine = initialize_database(data_folder, database_url=f"sqlite:///{building_path}")
+    table_info = get_table_info(engine)
+    # Single self-contained file, compacted for fast opening and mmap
+    with engine.connect() as conn:
+        conn = conn.execution_options(isolation_level="AUTOCOMMIT")
+        conn.exec_driver_sql("PRAGMA journal_mode=DELETE")
+        conn.exec_driver_sql("VACUUM")
+    engine.dispose()
+    os.replace(building_path, output_path)
+
+    schema = {"table_info": table_info, "built_at": time.time(), "data_folder": data_folder}
+    schema_path = schema_path_for(output_path)
+    with open(f"{schema_path}.tmp", "w", encoding="utf-8") as f:
+        json.dump(schema, f, indent=2)
+    os.replace(f"{schema_path}.tmp", schema_path)
+
+    logger.info(f"Snapshot written to {output_path} ({os.path.getsize(output_path) / 1024 / 1024:.1f} MiB) "
+                f"in {time.perf_counter() - start:.2f}s; schema cached in {schema_path}")
+    return schema
+
+def load_snapshot_schema(db_path: str) -> Optional[Dict[str, Any]]:
+    """Cached schema info for a snapshot, or None if it is missing/unreadable"""
+    try:
+        with open(schema_path_for(db_path), "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError) as e:
+        logger.warning(f"No usable cached schema for snapshot {db_path}: {e}")
+        return None
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build a prebuilt SQLite snapshot from the CSV data")
+    parser.add_argument("--data", default="data", help="Folder containing the CSV files")
+    parser.add_argument("--output", default="app/ecommerce.snapshot.db", help="Snapshot database path")
+    args = parser.parse_args()
+    build_snapshot(args.data, args.output)
@@ -0,0 +1,405 @@
+# app/utils/analytics_engine.py
+# Where generated SQL runs. The default engine is the SQLite database from
+# app/database.py; ANALYTICS_ENGINE=duckdb loads the same tables into an embedded
+# DuckDB file instead, straight from the CSV (or <table>.parquet) files, so
+# full-table aggregates are answered by a vectorized, column-wise scan.
+# Both engines expose connect()/execute()/iter_batches()/interrupt() to the
+# endpoints and a `dialect` that the LLM prompt names.
+import json
+import logging
+import os
+import re
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+from sqlalchemy.exc import OperationalError
+
+from app.database import readonly_engine
+from app.utils.data_loader import TABLE_SCHEMAS, SNAPSHOT_TABLES, MANIFEST_TABLE, file_fingerprint, schema_signature
+from app.utils.query_executor import QueryOutput, execute_query, iter_query_batches, cap_rows
+from app.utils.query_guard import TimeBudget, query_guard
+from app.utils.result_cache import result_cache, bump_data_version
+
+# duckdb is optional: only needed with ANALYTICS_ENGINE=duckdb (pip install duckdb, see req.txt)
+try:
+    import duckdb
+except ImportError:
+    duckdb = None
+
+logger = logging.getLogger(__name__)
+
+ANALYTICS_ENGINE = os.getenv("ANALYTICS_ENGINE", "sqlite").lower()
+DUCKDB_PATH = os.getenv("DUCKDB_PATH", "./app/ecommerce.duckdb")
+DUCKDB_THREADS = int(os.getenv("DUCKDB_THREADS", "0")) # 0: DuckDB's default (one per core)
+DUCKDB_MEMORY_LIMIT = os.getenv("DUCKDB_MEMORY_LIMIT", "") # e.g. "2GB"; empty: DuckDB's default
+# Timestamp layout of the CSVs' DATETIME columns (hours are not zero-padded in eligibility.csv)
+DUCKDB_TIMESTAMP_FORMAT = os.getenv("DUCKDB_TIMESTAMP_FORMAT", "%Y-%m-%d %-H:%M:%S")
+SOURCE_TABLES = ["ad_sales", "total_sales", "eligibility"]
+
+class QueryExecutionError(RuntimeError):
+    """Raised when the engine fails to run a query that passed the guard (unknown column, bad cast, ...)."""
+
+class QueryCancelledError(RuntimeError):
+    """Raised by execute() when interrupt() stopped the running statement."""
+
+# TABLE_SCHEMAS column types -> DuckDB types
+_DUCKDB_TYPES = {"DATE": "DATE", "DATETIME": "TIMESTAMP", "INTEGER": "BIGINT", "REAL": "DOUBLE",
+                 "BOOLEAN": "BOOLEAN", "TEXT": "VARCHAR"}
+# Plan operators that compare every row pair (no hash join): the runaway-join shapes
+_LOOP_JOIN_OPERATORS = {"CROSS_PRODUCT", "NESTED_LOOP_JOIN", "BLOCKWISE_NL_JOIN"}
+# :name placeholders (not "::" casts); rewritten to DuckDB's $name
+_PLACEHOLDER_RE = re.compile(r"(?<![:\w]):([A-Za-z_]\w*)")
+
+
+class SQLiteEngine:
+    """The pooled read-only SQLite connections, with the guard and result cache of query_executor"""
+
+    name = "sqlite"
+    dialect = "SQLite"
+
+    def connect(self):
+        """A read-only connection; use as a context manager or close() it"""
+        return readonly_engine.connect()
+
+    def execute(self, conn, sql_query: str, params: Optional[Dict[str, Any]] = None) -> QueryOutput:
+        try:
+            return execute_query(conn, sql_query, params)
+        except OperationalError as e: # Interrupts at the time limit are already QueryTimeoutError
+            if "interrupted" in str(e.orig):
+                raise QueryCancelledError("Query was cancelled.") from e
+            raise
+
+    def iter_batches(self, conn, sql_query: str, batch_size: int = 500,
+                     params: Optional[Dict[str, Any]] = None) -> Iterator[Tuple[List[str], List[tuple]]]:
+        return iter_query_batches(conn, sql_query, batch_size, params)
+
+    def recover(self, conn):
+        """Make the connection usable again after a failed statement"""
+        conn.rollback()
+
+    def interrupt(self, conn):
+        """Stop the statement running on `conn`; safe to call from another thread"""
+        conn.connection.driver_connection.interrupt()
+
+
+class DuckDBEngine:
+    """
+    An embedded DuckDB file loaded from the source files. Serving uses one
+    read-only connection with a cursor per request; the same guard checks,
+    row cap, time limit and result cache apply as on SQLite.
+    """
+
+    name = "duckdb"
+    dialect = "DuckDB"
+
+    def __init__(self, path: str = DUCKDB_PATH, threads: int = DUCKDB_THREADS, memory_limit: str = DUCKDB_MEMORY_LIMIT):
+        if duckdb is None:
+            raise RuntimeError("ANALYTICS_ENGINE=duckdb requires the 'duckdb' package (pip install duckdb).")
+        self.path = path
+        self.threads = threads
+        self.memory_limit = memory_limit
+        self._conn = None
+        self._lock = threading.Lock()
+
+    def _config(self) -> Dict[str, Any]:
+        config: Dict[str, Any] = {}
+        if self.threads:
+            config["threads"] = self.threads
+        if self.memory_limit:
+            config["memory_limit"] = self.memory_limit
+        return config
+
+    # --- Ingestion ---
+    def ingest(self, data_folder: str = "data") -> int:
+        """
+        (Re)load every source table whose file changed since the last load,
+        reading data/<table>.parquet if present, else data/<table>.csv.
+        Returns the number of tables loaded or unchanged.
+        """
+        self.close() # A read-only serving connection would block the writer
+        con = duckdb.connect(self.path, config=self._config())
+        loaded = 0
+        changed = False
+        try:
+            con.execute(f"CREATE TABLE IF NOT EXISTS {MANIFEST_TABLE} (table_name VARCHAR PRIMARY KEY, "
+                        "source_path VARCHAR, sha256 VARCHAR, row_count BIGINT, schema_signature VARCHAR, "
+                        "size BIGINT, mtime DOUBLE)")
+            # Manifests written before the size/mtime short-circuit lack those columns
+            con.execute(f"ALTER TABLE {MANIFEST_TABLE} ADD COLUMN IF NOT EXISTS size BIGINT")
+            con.execute(f"ALTER TABLE {MANIFEST_TABLE} ADD COLUMN IF NOT EXISTS mtime DOUBLE")
+            existing = {row[0] for row in con.execute(
+                "SELECT table_name FROM information_schema.tables WHERE table_schema = 'main'").fetchall()}
+            for table_name in SOURCE_TABLES:
+                parquet_path = os.path.join(data_folder, f"{table_name}.parquet")
+                source_path = parquet_path if os.path.exists(parquet_path) else os.path.join(data_folder, f"{table_name}.csv")
+                if not os.path.exists(source_path):
+                    logger.error(f"Source file not found for {table_name}: {source_path}")
+                    continue
+                try:
+                    table_changed = self._load_table(con, table_name, source_path, table_name in existing)
+                    for snapshot, spec in SNAPSHOT_TABLES.items():
+                        if spec["source"] == table_name and (table_changed or snapshot not in existing):
+                            self._build_snapshot(con, snapshot)
+                    changed = changed or table_changed
+                    loaded += 1
+                except duckdb.Error as e:
+                    logger.error(f"Error loading {source_path} into DuckDB table {table_name}: {e}")
+        finally:
+            con.close()
+        if changed:
+            bump_data_version() # Invalidate cached query results
+        if loaded == len(SOURCE_TABLES):
+            logger.info(f"All data loaded into DuckDB ({self.path})")
+        else:
+            logger.warning(f"Only {loaded}/{len(SOURCE_TABLES)} tables loaded into DuckDB.")
+        return loaded
+
+    def _load_table(self, con, table_name: str, source_path: str, table_exists: bool) -> bool:
+        """Load one table with CREATE OR REPLACE ... AS SELECT; False when the source is unchanged"""
+        signature = schema_signature(table_name)
+        stat = os.stat(source_path)
+        previous = con.execute(f"SELECT source_path, schema_signature, size, mtime, sha256 FROM {MANIFEST_TABLE} "
+                               "WHERE table_name = ?", [table_name]).fetchone()
+        sha256 = None
+        if table_exists and previous and previous[:2] == (source_path, signature):
+            # Same size and mtime as last load: unchanged, without reading the file
+            unchanged = previous[2:4] == (stat.st_size, stat.st_mtime)
+            if not unchanged:
+                sha256 = file_fingerprint(source_path)[2]
+                unchanged = sha256 == previous[4]
+                if unchanged: # Touched but not modified
+                    con.execute(f"UPDATE {MANIFEST_TABLE} SET size = ?, mtime = ? WHERE table_name = ?",
+                                [stat.st_size, stat.st_mtime, table_name])
+            if unchanged:
+                logger.info(f"{source_path} unchanged since last load, skipping DuckDB table: {table_name}")
+                return False
+        sha256 = sha256 or file_fingerprint(source_path)[2]
+
+        start = time.perf_counter()
+        con.execute(f'CREATE OR REPLACE TABLE "{table_name}" AS SELECT * FROM {self._reader(table_name, source_path)}')
+        row_count = con.execute(f'SELECT COUNT(*) FROM "{table_name}"').fetchone()[0]
+        con.execute(f"INSERT OR REPLACE INTO {MANIFEST_TABLE} "
+                    "(table_name, source_path, sha256, row_count, schema_signature, size, mtime) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    [table_name, source_path, sha256, row_count, signature, stat.st_size, stat.st_mtime])
+        elapsed = time.perf_counter() - start
+        logger.info(f"Loaded {row_count} rows from {source_path} into DuckDB table {table_name} in {elapsed:.2f}s: "
+                    f"{row_count / elapsed if elapsed else 0:.0f} rows/s")
+        return True
+
+    def _build_snapshot(self, con, snapshot: str):
+        """Rebuild a data_loader.SNAPSHOT_TABLES table: the newest source row per key"""
+        spec = SNAPSHOT_TABLES[snapshot]
+        con.execute(f'CREATE OR REPLACE TABLE "{snapshot}" AS SELECT * FROM "{spec["source"]}" '
+                    f'QUALIFY row_number() OVER (PARTITION BY "{spec["key"]}" ORDER BY "{spec["order_by"]}" DESC) = 1')
+        logger.info(f"Snapshot {snapshot} rebuilt in DuckDB")
+
+    def _reader(self, table_name: str, source_path: str) -> str:
+        """FROM-clause reading the source file with the table's declared column types"""
+        quoted_path = "'" + source_path.replace("'", "''") + "'"
+        schema = TABLE_SCHEMAS.get(table_name)
+        if source_path.endswith(".parquet"):
+            if schema is None:
+                return f"read_parquet({quoted_path})"
+            casts = ", ".join(f'CAST("{name}" AS {_DUCKDB_TYPES[ddl.split()[0]]}) AS "{name}"' for name, ddl in schema["columns"])
+            return f"(SELECT {casts} FROM read_parquet({quoted_path}))"
+        if schema is None:
+            return f"read_csv({quoted_path}, header = true)"
+        columns = ", ".join(f"'{name}': '{_DUCKDB_TYPES[ddl.split()[0]]}'" for name, ddl in schema["columns"])
+        return (f"read_csv({quoted_path}, header = true, columns = {{{columns}}}, "
+                f"timestampformat = '{DUCKDB_TIMESTAMP_FORMAT}')")
+
+    def table_info(self) -> Dict[str, List[Tuple[str, str]]]:
+        """Same shape as data_loader.get_table_info: table -> [(column, type)]"""
+        with self.connect() as cursor:
+            rows = cursor.execute(
+                "SELECT table_name, column_name, data_type FROM information_schema.columns "
+                "WHERE table_schema = 'main' AND table_name NOT LIKE '\\_%' ESCAPE '\\' "
+                "ORDER BY table_name, ordinal_position").fetchall()
+        table_info: Dict[str, List[Tuple[str, str]]] = {}
+        for table_name, column_name, data_type in rows:
+            table_info.setdefault(table_name, []).append((column_name, data_type))
+        return table_info
+
+    # --- Serving ---
+    def connect(self):
+        """A cursor on the shared read-only connection; use as a context manager or close() it"""
+        with self._lock:
+            if self._conn is None:
+                self._conn = duckdb.connect(self.path, read_only=True, config=self._config())
+            return self._conn.cursor()
+
+    def close(self):
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+    def recover(self, conn):
+        """Nothing to roll back: statements run in autocommit mode"""
+
+    def interrupt(self, cursor):
+        """Stop the statement running on `cursor`; safe to call from another thread"""
+        cursor.interrupt()
+
+    def execute(self, cursor, sql_query: str, params: Optional[Dict[str, Any]] = None) -> QueryOutput:
+        """DuckDB counterpart of query_executor.execute_query (same cache, guard and row cap)"""
+        key = result_cache.make_key(sql_query, params=params)
+        cached = result_cache.get(key)
+        if cached is not None:
+            logger.info(f"Result cache hit for query: {sql_query}")
+            return cap_rows(*cached)
+
+        guarded_sql, plan_description = self._prepare(cursor, sql_query, params)
+        with self._time_limit(cursor, sql_query, plan_description):
+            cursor.execute(_placeholders(guarded_sql, params), params or None)
+            if cursor.description is None:
+                return QueryOutput([], [], False)
+            columns = [column[0] for column in cursor.description]
+            # One row past the cap is kept so truncation can be reported
+            limit = query_guard.max_rows + 1 if query_guard.max_rows else None
+            rows = _python_values(cursor.description, cursor.fetchmany(limit) if limit else cursor.fetchall())
+
+        result_cache.set(key, columns, rows)
+        return cap_rows(columns, rows)
+
+    def iter_batches(self, cursor, sql_query: str, batch_size: int = 500,
+                     params: Optional[Dict[str, Any]] = None) -> Iterator[Tuple[List[str], List[tuple]]]:
+        """DuckDB counterpart of query_executor.iter_query_batches (no cache, no row cap)"""
+        guarded_sql, plan_description = self._prepare(cursor, sql_query, params, add_limit=False)
+        with self._time_limit(cursor, sql_query, plan_description) as budget:
+            cursor.execute(_placeholders(guarded_sql, params), params or None)
+            if cursor.description is None:
+                return
+            columns = [column[0] for column in cursor.description]
+            while True:
+                rows = cursor.fetchmany(batch_size)
+                if not rows:
+                    break
+                with budget.paused():
+                    yield columns, _python_values(cursor.description, rows)
+
+    def _prepare(self, cursor, sql_query: str, params: Optional[Dict[str, Any]],
+                 add_limit: bool = True) -> Tuple[str, str]:
+        """query_guard.prepare for DuckDB: returns (SQL to execute, plan summary for logs)"""
+        sql_query, plain = query_guard.check_statement(sql_query)
+        try:
+            explained = cursor.execute(f"EXPLAIN (FORMAT json) {_placeholders(sql_query, params)}", params or None).fetchall()
+        except duckdb.Error as e:
+            raise QueryExecutionError(str(e)) from e
+        plan = json.loads(explained[0][1])
+        query_guard.check_join_rows(sql_query, _loop_join_rows(plan), _plan_summary(plan))
+        if add_limit:
+            sql_query = query_guard.add_row_limit(sql_query, plain)
+        return sql_query, _plan_summary(plan)
+
+    @contextmanager
+    def _time_limit(self, cursor, sql_query: str, plan_description: str) -> Iterator[TimeBudget]:
+        """Interrupt the cursor once QUERY_TIMEOUT_SECONDS have passed; yields the budget"""
+        expired = threading.Event() # Tells the time limit apart from interrupt()
+        def expire():
+            expired.set()
+            cursor.interrupt()
+        budget = _TimerBudget(query_guard.timeout_seconds, expire) if query_guard.timeout_seconds else TimeBudget(float("inf"))
+        try:
+            yield budget
+        except duckdb.InterruptException as e:
+            if not expired.is_set():
+                raise QueryCancelledError("Query was cancelled.") from e
+            raise query_guard.timed_out(sql_query, plan_description) from e
+        except duckdb.Error as e:
+            raise QueryExecutionError(str(e)) from e
+        finally:
+            budget.pause()
+
+
+class _TimerBudget(TimeBudget):
+    """TimeBudget that calls `expire` from a timer thread when it runs out; the timer stops while paused"""
+
+    def __init__(self, seconds: float, expire: Callable[[], None]):
+        super().__init__(seconds)
+        self._expire = expire
+        self._timer: Optional[threading.Timer] = None
+        self._start_timer()
+
+    def _start_timer(self):
+        self._timer = threading.Timer(max(self.remaining(), 0.0), self._expire)
+        self._timer.daemon = True
+        self._timer.start()
+
+    def pause(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        super().pause()
+
+    def resume(self):
+        super().resume()
+        if self._timer is None:
+            self._start_timer()
+
+
+def _placeholders(sql_query: str, params: Optional[Dict[str, Any]]) -> str:
+    """Rewrite the :name placeholders of bound params to DuckDB's $name"""
+    if not params:
+        return sql_query
+    return _PLACEHOLDER_RE.sub(lambda m: f"${m.group(1)}" if m.group(1) in params else m.group(0), sql_query)
+
+def _cardinality(node: Dict[str, Any]) -> int:
+    value = str(node.get("extra_info", {}).get("Estimated Cardinality", "0")).lstrip("~")
+    return int(value) if value.isdigit() else 0
+
+def _loop_join_rows(nodes: List[Dict[str, Any]]) -> int:
+    """Largest row-pair count of a cross product / nested-loop join in the plan (0 when every join is hashed)"""
+    worst = 0
+    for node in nodes:
+        children = node.get("children", [])
+        if node.get("name") in _LOOP_JOIN_OPERATORS and len(children) >= 2:
+            combinations = 1
+            for child in children:
+                combinations *= _cardinality(child)
+            worst = max(worst, combinations)
+        worst = max(worst, _loop_join_rows(children))
+    return worst
+
+def _plan_summary(nodes: List[Dict[str, Any]]) -> str:
+    """Operator names in plan order, for the guard's log lines"""
+    names = []
+    stack = list(reversed(nodes))
+    while stack:
+        node = stack.pop()
+        names.append(node.get("name", "?"))
+        stack.extend(reversed(node.get("children", [])))
+    return "; ".join(names)
+
+def _python_values(description, rows: List[tuple]) -> List[tuple]:
+    """
+    Values as the SQLite engine returns them: dates/timestamps as ISO text,
+    booleans as 0/1 and DECIMALs as floats, so caches, charts and JSON
+    encoding behave the same on both engines.
+    """
+    converters = {}
+    for i, column in enumerate(description):
+        type_name = str(column[1]).upper()
+        if type_name in ("DATE", "TIMESTAMP"):
+            converters[i] = str
+        elif type_name == "BOOLEAN":
+            converters[i] = int
+        elif type_name.startswith("DECIMAL"):
+            converters[i] = float
+    if not converters:
+        return rows
+    return [tuple(converters[i](value) if i in converters and value is not None else value
+                  for i, value in enumerate(row)) for row in rows]
+
+
+def create_analytics_engine(name: str = ANALYTICS_ENGINE):
+    if name == "duckdb":
+        return DuckDBEngine()
+    if name != "sqlite":
+        logger.warning(f"Unknown ANALYTICS_ENGINE '{name}', using sqlite")
+    return SQLiteEngine()
+
+# Shared by every endpoint that executes generated SQL
+analytics_engine = create_analytics_engine()
@@ -0,0 +1,212 @@
+# app/utils/chart_renderer.py
+# PNG/SVG chart images for reports, rendered in a pool of worker processes so
+# neither kaleido's slow export nor pyplot's process-global state touches the
+# request path. Each worker imports its renderer once at start (and, for
+# Plotly, warms kaleido with a throwaway export), renders one chart at a time,
+# and identical charts are served from a byte-bounded LRU keyed by a hash of
+# (result data, chart type, title, format, renderer).
+import asyncio
+import hashlib
+import json
+import logging
+import multiprocessing
+import os
+import threading
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import Future, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Any, Deque, Dict, List, Optional, Tuple
+
+from app.utils.visualizer import IMAGE_RENDERERS, render_chart_image
+
+logger = logging.getLogger(__name__)
+
+CHART_RENDER_WORKERS = int(os.getenv("CHART_RENDER_WORKERS", "2")) # 0 disables image rendering
+# "matplotlib" (fast, default) or "plotly" (needs kaleido)
+CHART_RENDERER = os.getenv("CHART_RENDERER", "matplotlib").lower()
+CHART_RENDER_TIMEOUT_SECONDS = float(os.getenv("CHART_RENDER_TIMEOUT_SECONDS", "30"))
+CHART_IMAGE_CACHE_MAX_BYTES = int(os.getenv("CHART_IMAGE_CACHE_MAX_BYTES", str(32 * 1024 * 1024)))
+# Workers are started with "spawn": forking a server that already runs LLM and DB threads is unsafe
+CHART_RENDER_START_METHOD = os.getenv("CHART_RENDER_START_METHOD", "spawn")
+IMAGE_MEDIA_TYPES = {"png": "image/png", "svg": "image/svg+xml"}
+# renders_per_second is measured over this trailing window
+_RATE_WINDOW_SECONDS = 60.0
+
+class ChartRenderError(RuntimeError):
+    """Raised when the pool is disabled, or a render fails or times out."""
+
+class ChartUnsupportedError(ChartRenderError):
+    """Raised when the results cannot be drawn as the requested chart type."""
+
+# --- Worker process side ---
+def _warm_worker(renderer: str):
+    """Pool initializer: import the renderer (and start kaleido) before the first real chart"""
+    logging.basicConfig(level=logging.WARNING)
+    render_chart_image(["x", "y"], [(1, 1), (2, 2)], "bar", "warm-up", "png", renderer)
+
+def _ping() -> int:
+    return os.getpid()
+
+def _render(columns: List[str], rows: List[tuple], chart_type: str, title: str,
+            image_format: str, renderer: str) -> Tuple[Optional[bytes], float]:
+    """(image bytes or None, render seconds) for one chart"""
+    start = time.perf_counter()
+    image = render_chart_image(columns, rows, chart_type, title, image_format, renderer)
+    return image, time.perf_counter() - start
+
+
+class ChartRenderer:
+    """Process pool plus image cache; keeps render and cache counters."""
+
+    def __init__(self, workers: int = CHART_RENDER_WORKERS, renderer: str = CHART_RENDERER,
+                 max_bytes: int = CHART_IMAGE_CACHE_MAX_BYTES, timeout_seconds: float = CHART_RENDER_TIMEOUT_SECONDS):
+        self.workers = workers
+        self.renderer = renderer if renderer in IMAGE_RENDERERS else "matplotlib"
+        self.max_bytes = max_bytes
+        self.timeout_seconds = timeout_seconds
+        self._pool: Optional[ProcessPoolExecutor] = None
+        self._lock = threading.Lock()
+        self._images: "OrderedDict[str, bytes]" = OrderedDict()
+        self._in_flight: Dict[str, "asyncio.Future"] = {}
+        self._completed_at: Deque[float] = deque()
+        self.total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.evictions = 0
+        self.renders = 0
+        self.render_errors = 0
+        self.render_seconds_total = 0.0
+
+    @property
+    def enabled(self) -> bool:
+        return self.workers > 0
+
+    # --- Lifecycle ---
+    def start(self):
+        """Start the worker processes and warm them up in the background"""
+        if not self.enabled or self._pool is not None:
+            return
+        context = multiprocessing.get_context(CHART_RENDER_START_METHOD)
+        self._pool = ProcessPoolExecutor(max_workers=self.workers, mp_context=context,
+                                         initializer=_warm_worker, initargs=(self.renderer,))
+        for _ in range(self.workers): # Submitting spawns a process per task while none is idle
+            self._pool.submit(_ping)
+        logger.info(f"Chart render pool started: {self.workers} {self.renderer} worker processes")
+
+    def stop(self):
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
+
+    # --- Rendering ---
+    def make_key(self, columns: List[str], rows: List[tuple], chart_type: str, title: str, image_format: str) -> str:
+        material = json.dumps([list(columns), rows, chart_type, title, image_format, self.renderer], default=str)
+        return hashlib.sha256(material.encode("utf-8")).hexdigest()
+
+    async def render(self, columns: List[str], rows: List[tuple], chart_type: str, title: str,
+                     image_format: str = "png") -> Tuple[bytes, str, bool]:
+        """
+        (image bytes, cache key, served from cache) for a chart. Concurrent
+        requests for the same chart share one render.
+        """
+        if not self.enabled:
+            raise ChartRenderError("Chart image rendering is disabled (CHART_RENDER_WORKERS=0).")
+        key = self.make_key(columns, rows, chart_type, title, image_format)
+        owner = False
+        with self._lock:
+            image = self._images.get(key)
+            if image is not None:
+                self._images.move_to_end(key)
+                self.hits += 1
+                return image, key, True
+            self.misses += 1
+            shared = self._in_flight.get(key)
+            if shared is not None:
+                self.coalesced += 1
+            else:
+                shared = self._in_flight[key] = asyncio.get_running_loop().create_future()
+                shared.add_done_callback(lambda f: f.cancelled() or f.exception()) # Failures without waiters are not "never retrieved"
+                owner = True
+        if not owner:
+            return await asyncio.shield(shared), key, False
+
+        self.start()
+        try:
+            image = await self._render_in_pool(columns, rows, chart_type, title, image_format)
+            shared.set_result(image)
+        except asyncio.CancelledError:
+            shared.cancel()
+            raise
+        except Exception as e:
+            shared.set_exception(e)
+            raise
+        finally:
+            self._in_flight.pop(key, None)
+        self._store(key, image)
+        return image, key, False
+
+    async def _render_in_pool(self, columns, rows, chart_type, title, image_format) -> bytes:
+        future: Future = self._pool.submit(_render, list(columns), list(rows), chart_type, title, image_format, self.renderer)
+        try:
+            image, seconds = await asyncio.wait_for(asyncio.wrap_future(future), self.timeout_seconds)
+        except asyncio.TimeoutError:
+            future.cancel()
+            with self._lock:
+                self.render_errors += 1
+            raise ChartRenderError(f"Chart render exceeded {self.timeout_seconds:g}s.")
+        except Exception as e:
+            with self._lock:
+                self.render_errors += 1
+            if isinstance(e, BrokenProcessPool): # A worker died; the next render starts a new pool
+                logger.error(f"Chart render pool is broken, restarting it: {e}")
+                self.stop()
+            raise ChartRenderError(f"Chart render failed: {e}") from e
+        if image is None:
+            raise ChartUnsupportedError(f"Results cannot be drawn as a '{chart_type}' chart with {self.renderer}.")
+        with self._lock:
+            self.renders += 1
+            self.render_seconds_total += seconds
+            self._completed_at.append(time.monotonic())
+        return image
+
+    def _store(self, key: str, image: bytes):
+        if len(image) > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._images:
+                return
+            self._images[key] = image
+            self.total_bytes += len(image)
+            while self.total_bytes > self.max_bytes:
+                _, evicted = self._images.popitem(last=False)
+                self.total_bytes -= len(evicted)
+                self.evictions += 1
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            cutoff = time.monotonic() - _RATE_WINDOW_SECONDS
+            while self._completed_at and self._completed_at[0] < cutoff:
+                self._completed_at.popleft()
+            lookups = self.hits + self.misses
+            return {
+                "workers": self.workers,
+                "renderer": self.renderer,
+                "renders": self.renders,
+                "render_errors": self.render_errors,
+                "mean_render_seconds": self.render_seconds_total / self.renders if self.renders else 0.0,
+                "renders_per_second": len(self._completed_at) / _RATE_WINDOW_SECONDS,
+                "entries": len(self._images),
+                "total_bytes": self.total_bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "coalesced": self.coalesced,
+                "evictions": self.evictions,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+            }
+
+
+# Shared by the chart image endpoint; started with the app
+chart_renderer = ChartRenderer()
@@ -1,32 +1,417 @@
-import pandas as pd
-from sqlalchemy import create_engine, MetaData
+from sqlalchemy import create_engine, MetaData, inspect
 import os
+import hashlib
 import logging
+import time
+import tracemalloc
+from typing import Dict, List, Optional, Tuple, TYPE_CHECKING
+
+from app.database import engine as writer_engine
+from app.utils.result_cache import bump_data_version
+
+# pandas is imported lazily, only when a CSV actually has to be (re)loaded
+if TYPE_CHECKING:
+    import pandas as pd
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Ingestion bookkeeping lives in the same database; tables starting with "_" are internal
+MANIFEST_TABLE = "_ingest_manifest"
+CHUNK_ROWS = int(os.getenv("INGEST_CHUNK_ROWS", "50000"))
+_HASH_BLOCK_SIZE = 1024 * 1024
+
+# Explicit DDL for the known tables (tables not listed here fall back to pandas' inferred types).
+# Indexes cover the (item_id, date) access paths used by almost every generated query; the
+# item_id-leading ones carry the metric columns so per-item aggregates never touch the table.
+TABLE_SCHEMAS = {
+    "ad_sales": {
+        "columns": [
+            ("date", "DATE NOT NULL"),
+            ("item_id", "INTEGER NOT NULL"),
+            ("ad_sales", "REAL"),
+            ("impressions", "INTEGER"),
+            ("ad_spend", "REAL"),
+            ("clicks", "INTEGER"),
+            ("units_sold", "INTEGER"),
+        ],
+        "indexes": {
+            "idx_ad_sales_item_date": ["item_id", "date", "ad_sales", "ad_spend", "clicks", "impressions", "units_sold"],
+            "idx_ad_sales_date_item": ["date", "item_id"],
+        },
+    },
+    "total_sales": {
+        "columns": [
+            ("date", "DATE NOT NULL"),
+            ("item_id", "INTEGER NOT NULL"),
+            ("total_sales", "REAL"),
+            ("total_units_ordered", "INTEGER"),
+        ],
+        "indexes": {
+            "idx_total_sales_item_date": ["item_id", "date", "total_sales", "total_units_ordered"],
+            "idx_total_sales_date_item": ["date", "item_id"],
+        },
+    },
+    "eligibility": {
+        "columns": [
+            ("eligibility_datetime_utc", "DATETIME NOT NULL"),
+            ("item_id", "INTEGER NOT NULL"),
+            ("eligibility", "BOOLEAN NOT NULL"),
+            ("message", "TEXT"),
+        ],
+        "indexes": {
+            "idx_eligibility_item_datetime": ["item_id", "eligibility_datetime_utc", "eligibility"],
+        },
+    },
+}
+
+# Rollups of the sales tables, kept up to date by the loader and read by utils/rollup_router.py.
+# Each grain lists (key column, expression over the base row); item_month's date is the month's first day.
+ROLLUPS_ENABLED = os.getenv("ROLLUPS", "1") != "0"
+ROLLUP_TABLES = ("ad_sales", "total_sales")
+ROLLUP_GRAINS = {
+    "item_day": [("item_id", "item_id"), ("date", "date")],
+    "item_month": [("item_id", "item_id"), ("date", "strftime('%Y-%m-01', date)")],
+    "day": [("date", "date")],
+}
+
+# Latest-state snapshots, kept up to date by the loader: one row per key holding the source
+# table's newest record for that key (by `order_by`), so "current status" questions are a point lookup
+SNAPSHOT_TABLES = {
+    "eligibility_current": {"source": "eligibility", "key": "item_id", "order_by": "eligibility_datetime_utc"},
+}
+
+def schema_signature(table_name: str) -> str:
+    """Hash of the table definition; a changed definition forces a full reload."""
+    schema = TABLE_SCHEMAS.get(table_name)
+    return hashlib.sha256(repr(schema).encode("utf-8")).hexdigest()[:16] if schema else ""
+
+def _create_table(conn, table_name: str, sample: "pd.DataFrame"):
+    """(Re)create a table from its explicit schema, or from pandas' inferred types."""
+    conn.exec_driver_sql(f'DROP TABLE IF EXISTS "{table_name}"')
+    schema = TABLE_SCHEMAS.get(table_name)
+    if schema is None:
+        sample.head(0).to_sql(table_name, conn, index=False)
+        return
+    columns = ", ".join(f'"{name}" {sql_type}' for name, sql_type in schema["columns"])
+    conn.exec_driver_sql(f'CREATE TABLE "{table_name}" ({columns})')
+
+def _create_indexes(conn, table_name: str):
+    for index_name, columns in TABLE_SCHEMAS.get(table_name, {}).get("indexes", {}).items():
+        column_list = ", ".join(f'"{c}"' for c in columns)
+        conn.exec_driver_sql(f'CREATE INDEX IF NOT EXISTS "{index_name}" ON "{table_name}" ({column_list})')
+
+def rollup_table_name(table_name: str, grain: str) -> str:
+    return f"_rollup_{table_name}_{grain}"
+
+def rollup_metrics(table_name: str) -> List[str]:
+    """Numeric columns of a base table that the rollups sum"""
+    return [name for name, sql_type in TABLE_SCHEMAS[table_name]["columns"]
+            if name != "item_id" and sql_type.split()[0] in ("INTEGER", "REAL")]
+
+def snapshot_tables(table_name: str) -> List[str]:
+    """Snapshot tables maintained from a source table"""
+    return [name for name, spec in SNAPSHOT_TABLES.items() if spec["source"] == table_name]
+
+def _derived_tables(table_name: str) -> List[str]:
+    """Every table the loader maintains from a base table's rows (rollups and snapshots)"""
+    names = snapshot_tables(table_name)
+    if ROLLUPS_ENABLED and table_name in ROLLUP_TABLES:
+        names += [rollup_table_name(table_name, grain) for grain in ROLLUP_GRAINS]
+    return names
+
+def _tables_exist(conn, names: List[str]) -> bool:
+    found = conn.exec_driver_sql(
+        f"SELECT COUNT(*) FROM sqlite_master WHERE type = 'table' AND name IN ({', '.join('?' for _ in names)})", tuple(names)
+    ).scalar()
+    return found == len(names)
+
+def _update_rollups(conn, table_name: str, after_rowid: int = 0):
+    """
+    Fold the base rows with rowid > after_rowid into every rollup with an
+    upsert, so appended rows cost only their own aggregation.
+    after_rowid 0 rebuilds the rollups from the whole table.
+    """
+    start = time.perf_counter()
+    metrics = rollup_metrics(table_name)
+    column_types = {name: sql_type.split()[0] for name, sql_type in TABLE_SCHEMAS[table_name]["columns"]}
+    for grain, keys in ROLLUP_GRAINS.items():
+        rollup = rollup_table_name(table_name, grain)
+        key_names = ", ".join(f'"{name}"' for name, _ in keys)
+        if after_rowid == 0:
+            conn.exec_driver_sql(f'DROP TABLE IF EXISTS "{rollup}"')
+            column_defs = ([f'"{name}" {column_types[name]} NOT NULL' for name, _ in keys]
+                           + [f'"{name}" {column_types[name]}' for name in metrics]
+                           + ["row_count INTEGER NOT NULL", f"PRIMARY KEY ({key_names})"])
+            conn.exec_driver_sql(f'CREATE TABLE "{rollup}" ({", ".join(column_defs)})')
+        key_exprs = ", ".join(expr for _, expr in keys)
+        metric_names = ", ".join(f'"{name}"' for name in metrics)
+        sums = ", ".join(f'SUM("{name}")' for name in metrics)
+        # SUM of only NULLs is NULL, so a NULL side must not turn the other side into NULL (or 0)
+        updates = ", ".join(
+            f'"{name}" = CASE WHEN excluded."{name}" IS NULL THEN "{name}" WHEN "{name}" IS NULL THEN excluded."{name}" '
+            f'ELSE "{name}" + excluded."{name}" END' for name in metrics)
+        conn.exec_driver_sql(
+            f'INSERT INTO "{rollup}" ({key_names}, {metric_names}, row_count) '
+            f'SELECT {key_exprs}, {sums}, COUNT(*) FROM "{table_name}" WHERE rowid > ? GROUP BY {key_exprs} '
+            f"ON CONFLICT ({key_names}) DO UPDATE SET {updates}, row_count = row_count + excluded.row_count",
+            (after_rowid,),
+        )
+        conn.exec_driver_sql(f'ANALYZE "{rollup}"')
+    logger.info(f"Rollups of {table_name} {'updated' if after_rowid else 'rebuilt'} in {time.perf_counter() - start:.2f}s")
+
+def _update_snapshot(conn, snapshot: str, after_rowid: int = 0):
+    """
+    Upsert the newest record per key among the source rows with
+    rowid > after_rowid; an existing row is only replaced by a record that
+    is at least as new. after_rowid 0 rebuilds the snapshot from the whole table.
+    """
+    spec = SNAPSHOT_TABLES[snapshot]
+    source, key, order_by = spec["source"], spec["key"], spec["order_by"]
+    columns = TABLE_SCHEMAS[source]["columns"]
+    if after_rowid == 0:
+        conn.exec_driver_sql(f'DROP TABLE IF EXISTS "{snapshot}"')
+        column_defs = [f'"{name}" {sql_type}' + (" PRIMARY KEY" if name == key else "") for name, sql_type in columns]
+        conn.exec_driver_sql(f'CREATE TABLE "{snapshot}" ({", ".join(column_defs)})')
+    column_names = ", ".join(f'"{name}"' for name, _ in columns)
+    # With a single MAX() aggregate, SQLite takes the other (bare) columns from the row holding the maximum
+    select_list = ", ".join(f'MAX("{name}")' if name == order_by else f'"{name}"' for name, _ in columns)
+    updates = ", ".join(f'"{name}" = excluded."{name}"' for name, _ in columns if name != key)
+    conn.exec_driver_sql(
+        f'INSERT INTO "{snapshot}" ({column_names}) '
+        f'SELECT {select_list} FROM "{source}" WHERE rowid > ? GROUP BY "{key}" '
+        f'ON CONFLICT ("{key}") DO UPDATE SET {updates} WHERE excluded."{order_by}" >= "{snapshot}"."{order_by}"',
+        (after_rowid,),
+    )
+    conn.exec_driver_sql(f'ANALYZE "{snapshot}"')
+
+def _update_derived(conn, table_name: str, after_rowid: int = 0):
+    """Fold base rows with rowid > after_rowid into the table's rollups and snapshots (0: rebuild them)"""
+    if ROLLUPS_ENABLED and table_name in ROLLUP_TABLES:
+        _update_rollups(conn, table_name, after_rowid)
+    for snapshot in snapshot_tables(table_name):
+        start = time.perf_counter()
+        _update_snapshot(conn, snapshot, after_rowid)
+        logger.info(f"Snapshot {snapshot} {'updated' if after_rowid else 'rebuilt'} in {time.perf_counter() - start:.2f}s")
+
+def _parse_boolean(value):
+    if isinstance(value, str):
+        return value.strip().lower() in ("true", "1", "yes", "t")
+    return bool(value)
+
+def _coerce_chunk(table_name: str, chunk: "pd.DataFrame") -> "pd.DataFrame":
+    """Convert raw CSV values to the declared column types (ISO dates, ints, real booleans)."""
+    import pandas as pd
+    schema = TABLE_SCHEMAS.get(table_name)
+    if schema is None:
+        return chunk
+    chunk = chunk.copy()
+    for name, sql_type in schema["columns"]:
+        if name not in chunk.columns:
+            continue
+        base_type = sql_type.split()[0]
+        if base_type == "DATE":
+            chunk[name] = pd.to_datetime(chunk[name]).dt.strftime("%Y-%m-%d")
+        elif base_type == "DATETIME":
+            chunk[name] = pd.to_datetime(chunk[name], format="mixed").dt.strftime("%Y-%m-%d %H:%M:%S")
+        elif base_type == "INTEGER":
+            chunk[name] = pd.to_numeric(chunk[name]).astype("Int64")
+        elif base_type == "REAL":
+            chunk[name] = pd.to_numeric(chunk[name]).astype("float64")
+        elif base_type == "BOOLEAN":
+            chunk[name] = chunk[name].map(_parse_boolean).astype(int)
+    return chunk
+
+def _ensure_manifest(engine):
+    with engine.begin() as conn:
+        conn.exec_driver_sql(f"""
+            CREATE TABLE IF NOT EXISTS {MANIFEST_TABLE} (
+                table_name TEXT PRIMARY KEY,
+                csv_path TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                mtime REAL NOT NULL,
+                sha256 TEXT NOT NULL,
+                row_count INTEGER NOT NULL,
+                schema_signature TEXT NOT NULL DEFAULT ''
+            )
+        """)
+        # Manifests written before typed schemas existed lack the signature column
+        existing = {row[1] for row in conn.exec_driver_sql(f"PRAGMA table_info({MANIFEST_TABLE})")}
+        if "schema_signature" not in existing:
+            conn.exec_driver_sql(f"ALTER TABLE {MANIFEST_TABLE} ADD COLUMN schema_signature TEXT NOT NULL DEFAULT ''")
+
+def _read_manifest(engine, table_name: str) -> Optional[dict]:
+    with engine.connect() as conn:
+        row = conn.exec_driver_sql(
+            f"SELECT csv_path, size, mtime, sha256, row_count, schema_signature FROM {MANIFEST_TABLE} WHERE table_name = ?",
+            (table_name,),
+        ).fetchone()
+    if row is None:
+        return None
+    return dict(zip(("csv_path", "size", "mtime", "sha256", "row_count", "schema_signature"), row))
+
+def file_fingerprint(csv_path: str, prefix_size: int = 0) -> Tuple[int, float, str, Optional[str], bytes]:
+    """
+    Fingerprint a source file in one streaming pass.
+    Returns (size, mtime, sha256 of the whole file, sha256 of the first
+    `prefix_size` bytes or None, the bytes on either side of `prefix_size`).
+    The prefix hash is what lets us recognise an append-only change.
+    """
+    stat = os.stat(csv_path)
+    full_hash = hashlib.sha256()
+    prefix_hash = None
+    boundary = b""
+    read = 0
+    with open(csv_path, "rb") as f:
+        while True:
+            block = f.read(_HASH_BLOCK_SIZE)
+            if not block:
+                break
+            if prefix_hash is None and 0 < prefix_size <= read + len(block):
+                cut = prefix_size - read
+                prefix_hash = full_hash.copy()
+                prefix_hash.update(block[:cut])
+                boundary = block[cut - 1:cut + 1]
+                if cut == len(block): # The byte after the prefix starts the next block
+                    boundary += f.peek(1)[:1] if hasattr(f, "peek") else b""
+            full_hash.update(block)
+            read += len(block)
+    return (stat.st_size, stat.st_mtime, full_hash.hexdigest(),
+            prefix_hash.hexdigest() if prefix_hash else None, boundary)
+
+def _read_header(csv_path: str) -> List[str]:
+    with open(csv_path, "r", encoding="utf-8-sig") as f:
+        return f.readline().strip().split(",")
+
+def _iter_csv_chunks(csv_path: str, offset: int = 0):
+    """Stream a CSV in bounded-memory chunks, optionally starting at a byte offset (tail load)."""
+    import pandas as pd
+    header = _read_header(csv_path)
+    with open(csv_path, "rb") as f:
+        if offset:
+            f.seek(offset)
+        else:
+            f.readline() # Skip the header line
+        if not f.peek(1):
+            return
+        for chunk in pd.read_csv(f, header=None, names=header, chunksize=CHUNK_ROWS):
+            yield chunk
+
+def _insert_chunk(conn, table_name: str, chunk: "pd.DataFrame") -> int:
+    """Bulk insert one chunk with executemany (native Python values, NaN -> NULL)."""
+    import pandas as pd
+    if chunk.empty:
+        return 0
+    chunk = _coerce_chunk(table_name, chunk)
+    chunk = chunk.astype(object).where(pd.notna(chunk), None)
+    columns = ", ".join(f'"{c}"' for c in chunk.columns)
+    placeholders = ", ".join("?" for _ in chunk.columns)
+    rows = list(chunk.itertuples(index=False, name=None))
+    conn.exec_driver_sql(f'INSERT INTO "{table_name}" ({columns}) VALUES ({placeholders})', rows)
+    return len(rows)
+
 def load_csv_to_db(csv_path: str, table_name: str, engine):
-    """Load CSV data into SQLite database"""
+    """
+    Load CSV data into SQLite database.
+    Unchanged files (same size and mtime, or same hash, as last load) are
+    skipped, appended files only load their new tail, anything else is
+    fully reloaded.
+    """
     try:
         if not os.path.exists(csv_path):
             logger.error(f"CSV file not found: {csv_path}")
             return False
-        df = pd.read_csv(csv_path)
-        logger.info(f"Loaded {len(df)} rows from {csv_path}")
-        # Handle potential data type issues automatically
-        df.to_sql(table_name, engine, if_exists='replace', index=False, method='multi')
-        logger.info(f"Data loaded to table: {table_name}")
+
+        _ensure_manifest(engine)
+        previous = _read_manifest(engine, table_name)
+        if previous and previous["schema_signature"] != schema_signature(table_name):
+            logger.info(f"Table definition for {table_name} changed, forcing a full reload")
+            previous = None
+        table_exists = inspect(engine).has_table(table_name)
+        unchanged = False
+        if previous and table_exists:
+            # Same size and mtime as last load: unchanged, without reading the file
+            stat = os.stat(csv_path)
+            unchanged = stat.st_size == previous["size"] and stat.st_mtime == previous["mtime"]
+        if not unchanged:
+            prefix_size = previous["size"] if previous else 0
+            size, mtime, sha256, prefix_sha256, boundary = file_fingerprint(csv_path, prefix_size)
+            unchanged = bool(previous and table_exists and previous["sha256"] == sha256)
+            if unchanged and previous["mtime"] != mtime: # Touched but not modified
+                with engine.begin() as conn:
+                    conn.exec_driver_sql(f"UPDATE {MANIFEST_TABLE} SET mtime = ? WHERE table_name = ?", (mtime, table_name))
+
+        # --- Decide what to do ---
+        offset = 0
+        if unchanged:
+            derived = _derived_tables(table_name)
+            if derived:
+                with engine.begin() as conn:
+                    if not _tables_exist(conn, derived): # Rollups/snapshots added after the last load
+                        _update_derived(conn, table_name)
+            logger.info(f"{csv_path} unchanged since last load, skipping table: {table_name}")
+            return True
+        if (previous and table_exists and size > previous["size"]
+                and prefix_sha256 == previous["sha256"] and b"\n" in boundary):
+            offset = previous["size"]
+            logger.info(f"{csv_path} grew by {size - offset} bytes, loading appended rows into: {table_name}")
+
+        # --- Stream chunks into the table inside a single transaction ---
+        tracing = not tracemalloc.is_tracing()
+        if tracing:
+            tracemalloc.start()
+        tracemalloc.reset_peak()
+        start = time.perf_counter()
+        rows_loaded = 0
+        try:
+            with engine.begin() as conn:
+                # Rollups and snapshots only need the appended rows folded in (rowids of new rows are above the current maximum)
+                derived = _derived_tables(table_name)
+                after_rowid = 0
+                if derived and offset and _tables_exist(conn, derived):
+                    after_rowid = conn.exec_driver_sql(f'SELECT COALESCE(MAX(rowid), 0) FROM "{table_name}"').scalar()
+                for i, chunk in enumerate(_iter_csv_chunks(csv_path, offset)):
+                    if offset == 0 and i == 0:
+                        _create_table(conn, table_name, chunk)
+                    rows_loaded += _insert_chunk(conn, table_name, chunk)
+                if offset == 0 and rows_loaded == 0: # Header-only file: empty table
+                    import pandas as pd
+                    _create_table(conn, table_name, pd.DataFrame(columns=_read_header(csv_path)))
+                # Build indexes after a bulk load (cheaper than maintaining them row by row)
+                _create_indexes(conn, table_name)
+                total_rows = rows_loaded + (previous["row_count"] if offset else 0)
+                conn.exec_driver_sql(
+                    f"INSERT OR REPLACE INTO {MANIFEST_TABLE} "
+                    "(table_name, csv_path, size, mtime, sha256, row_count, schema_signature) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    (table_name, csv_path, size, mtime, sha256, total_rows, schema_signature(table_name)),
+                )
+                # Refresh planner statistics for the new data
+                conn.exec_driver_sql(f'ANALYZE "{table_name}"')
+                if derived:
+                    _update_derived(conn, table_name, after_rowid)
+            peak_bytes = tracemalloc.get_traced_memory()[1]
+        finally:
+            if tracing:
+                tracemalloc.stop()
+        elapsed = time.perf_counter() - start
+
+        bump_data_version() # Invalidate cached query results
+        logger.info(
+            f"Loaded {rows_loaded} rows from {csv_path} into {table_name} "
+            f"({'append' if offset else 'full'}) in {elapsed:.2f}s: "
+            f"{rows_loaded / elapsed if elapsed else 0:.0f} rows/s, peak memory {peak_bytes / 1024 / 1024:.1f} MiB"
+        )
         return True
     except Exception as e:
         logger.error(f"Error loading {csv_path} into {table_name}: {str(e)}")
         return False
 
-def initialize_database(data_folder: str = "data"):
+def initialize_database(data_folder: str = "data", database_url: Optional[str] = None):
     """Initialize database with CSV data"""
-    DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///./app/ecommerce.db")
-    engine = create_engine(DATABASE_URL)
+    # The app's writer engine unless another database is given (e.g. a snapshot being built)
+    engine = create_engine(database_url) if database_url else writer_engine
 
     # Define your CSV files and corresponding table names
     csv_files_and_tables = [
@@ -48,6 +433,25 @@ def initialize_database(data_folder: str = "data"):
 
     return engine
 
+def explain_query_plans(engine, queries: List[str]) -> List[Dict]:
+    """
+    Run EXPLAIN QUERY PLAN over the given queries and report whether each
+    one is answered through an index or needs a full table scan.
+    """
+    report = []
+    with engine.connect() as conn:
+        for sql in queries:
+            try:
+                plan = [row[-1] for row in conn.exec_driver_sql(f"EXPLAIN QUERY PLAN {sql.rstrip().rstrip(';')}")]
+            except Exception as e:
+                report.append({"sql": sql, "plan": [], "uses_index": False, "error": str(e)})
+                continue
+            full_scans = [step for step in plan if step.startswith("SCAN") and "INDEX" not in step]
+            uses_index = any("INDEX" in step for step in plan)
+            report.append({"sql": sql, "plan": plan, "uses_index": uses_index, "full_scans": full_scans})
+            logger.info(f"Query plan ({'index' if uses_index else 'NO index'}): {sql} -> {plan}")
+    return report
+
 def get_table_info(engine):
     """Get information about tables in database"""
     metadata = MetaData()
@@ -55,9 +459,11 @@ def get_table_info(engine):
 
     table_info = {}
     for table_name in metadata.tables:
+        if table_name.startswith("_"): # Internal bookkeeping tables are not part of the schema
+            continue
         table = metadata.tables[table_name]
         # Get column names and types as strings
         columns = [(col.name, str(col.type)) for col in table.columns]
         table_info[table_name] = columns
 
-    return table_info
\ No newline at end of file
+    return table_info
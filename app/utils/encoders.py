@@ -0,0 +1,58 @@
+# app/utils/encoders.py
+# Response encoders for query results:
+#   "rows"     - the original list-of-dicts layout
+#   "columnar" - column names once plus one array per column
+#   "arrow"    - Apache Arrow IPC stream for programmatic clients
+# The JSON encoders write bytes directly, skipping per-row Pydantic validation.
+import json
+import logging
+from typing import Any, Dict, List
+
+logger = logging.getLogger(__name__)
+
+try:
+    import orjson # Optional: several times faster than the stdlib encoder
+except ImportError:
+    orjson = None
+
+ARROW_MEDIA_TYPE = "application/vnd.apache.arrow.stream"
+
+
+def to_row_dicts(columns: List[str], rows: List[tuple]) -> List[Dict[str, Any]]:
+    """Original layout: one dict per row, column names repeated on every row."""
+    return [dict(zip(columns, row)) for row in rows]
+
+
+def to_columnar(columns: List[str], rows: List[tuple]) -> Dict[str, Any]:
+    """Columnar layout: {"columns": [...], "data": [[col0 values], [col1 values], ...]}."""
+    data = [list(values) for values in zip(*rows)] if rows else [[] for _ in columns]
+    return {"columns": list(columns), "data": data}
+
+
+def dumps_json(payload: Any) -> bytes:
+    """Encode to JSON bytes with orjson when available, falling back to the stdlib."""
+    if orjson is not None:
+        return orjson.dumps(payload, option=orjson.OPT_SERIALIZE_NUMPY)
+    return json.dumps(payload, default=str, separators=(",", ":")).encode("utf-8")
+
+
+def arrow_available() -> bool:
+    try:
+        import pyarrow # noqa: F401
+        return True
+    except ImportError:
+        return False
+
+
+def encode_arrow_ipc(columns: List[str], rows: List[tuple], metadata: Dict[str, str] = None) -> bytes:
+    """Encode a result as an Arrow IPC stream (schema inferred from the values)."""
+    import pyarrow as pa # Lazy: optional dependency, only needed for this format
+
+    arrays = [pa.array(list(values)) for values in zip(*rows)] if rows else [pa.array([], pa.null()) for _ in columns]
+    table = pa.Table.from_arrays(arrays, names=list(columns))
+    if metadata:
+        table = table.replace_schema_metadata({k: str(v) for k, v in metadata.items()})
+    sink = pa.BufferOutputStream()
+    with pa.ipc.new_stream(sink, table.schema) as writer:
+        writer.write_table(table)
+    return sink.getvalue().to_pybytes()
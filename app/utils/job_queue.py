@@ -0,0 +1,292 @@
+# app/utils/job_queue.py
+# Background jobs for questions that should not hold an HTTP request open:
+# POST /jobs queues a question and returns a job id, a fixed pool of worker
+# tasks answers queued jobs (interactive before batch, at most
+# JOB_MAX_PER_CLIENT running per client, batch never on every worker), and the
+# finished result is kept for JOB_RESULT_TTL_SECONDS to be polled or streamed.
+# Cancelling a running job interrupts its SQL statement through the analytics engine.
+import asyncio
+import logging
+import os
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from typing import Any, Awaitable, Callable, Dict, Iterator, List, Optional
+
+logger = logging.getLogger(__name__)
+
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "4"))
+# Batch jobs leave at least one worker to interactive jobs (when there is more than one)
+JOB_BATCH_WORKERS = int(os.getenv("JOB_BATCH_WORKERS", str(max(1, JOB_WORKERS - 1))))
+JOB_MAX_PER_CLIENT = int(os.getenv("JOB_MAX_PER_CLIENT", "2")) # Running jobs per client; 0 = no limit
+JOB_MAX_QUEUED = int(os.getenv("JOB_MAX_QUEUED", "1000"))
+JOB_RESULT_TTL_SECONDS = float(os.getenv("JOB_RESULT_TTL_SECONDS", "900"))
+
+# Picked in this order
+PRIORITIES = ("interactive", "batch")
+FINISHED_STATUSES = ("succeeded", "failed", "cancelled")
+
+class JobQueueFullError(RuntimeError):
+    """Raised by submit() when JOB_MAX_QUEUED jobs are already waiting."""
+
+class JobCancelledError(RuntimeError):
+    """Raised in a job's runner when the job was cancelled before its statement started."""
+
+
+class Job:
+    """One queued question and, once finished, its result or error."""
+
+    def __init__(self, question: str, priority: str, client_id: str, options: Optional[Dict[str, Any]] = None):
+        self.job_id = uuid.uuid4().hex
+        self.question = question
+        self.priority = priority
+        self.client_id = client_id
+        self.options = options or {}
+        self.status = "queued"
+        self.submitted_at = time.time()
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+        self.result: Optional[Dict[str, Any]] = None
+        self.error: Optional[str] = None
+        self.cancel_requested = False
+        self._lock = threading.Lock() # cancel() on the event loop vs. the thread running the statement
+        self._interrupt: Optional[Callable[[], None]] = None
+        self._task: Optional[asyncio.Task] = None
+        self._changed = asyncio.Event()
+
+    @property
+    def finished(self) -> bool:
+        return self.status in FINISHED_STATUSES
+
+    @contextmanager
+    def interruptible(self, interrupt: Callable[[], None]) -> Iterator[None]:
+        """
+        Make cancel() call `interrupt` while the block runs (the block runs the
+        job's SQL in a worker thread). Raises JobCancelledError if the job was
+        cancelled before the block was entered.
+        """
+        with self._lock:
+            if self.cancel_requested:
+                raise JobCancelledError("Job was cancelled.")
+            self._interrupt = interrupt
+        try:
+            yield
+        finally:
+            with self._lock:
+                self._interrupt = None
+
+    def _request_cancel(self):
+        with self._lock:
+            self.cancel_requested = True
+            if self._interrupt is not None:
+                self._interrupt()
+        if self._task is not None:
+            self._task.cancel()
+
+    def _set_status(self, status: str):
+        self.status = status
+        if status == "running":
+            self.started_at = time.time()
+        elif status in FINISHED_STATUSES:
+            self.finished_at = time.time()
+        # Wake subscribers; the next wait() gets a fresh event
+        changed, self._changed = self._changed, asyncio.Event()
+        changed.set()
+
+    async def wait_for_change(self, timeout: Optional[float] = None) -> bool:
+        """Wait until the status changes (or the job is finished); False on timeout"""
+        if self.finished:
+            return True
+        try:
+            await asyncio.wait_for(self._changed.wait(), timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+
+
+class JobQueue:
+    """Priority queue of jobs with a fixed pool of async workers; keeps per-status counters."""
+
+    def __init__(self, workers: int = JOB_WORKERS, batch_workers: int = JOB_BATCH_WORKERS,
+                 max_per_client: int = JOB_MAX_PER_CLIENT, max_queued: int = JOB_MAX_QUEUED,
+                 result_ttl: float = JOB_RESULT_TTL_SECONDS):
+        self.workers = max(1, workers)
+        self.batch_workers = max(1, min(batch_workers, self.workers))
+        self.max_per_client = max_per_client
+        self.max_queued = max_queued
+        self.result_ttl = result_ttl
+        self._jobs: Dict[str, Job] = {}
+        self._pending: Dict[str, List[Job]] = {priority: [] for priority in PRIORITIES}
+        self._running_by_client: Dict[str, int] = {}
+        self._running_by_priority: Dict[str, int] = {priority: 0 for priority in PRIORITIES}
+        self._runner: Optional[Callable[[Job], Awaitable[Dict[str, Any]]]] = None
+        self._worker_tasks: List[asyncio.Task] = []
+        self._wakeup: Optional[asyncio.Condition] = None
+        self._stopping = False
+        self.submitted = 0
+        self.started = 0
+        self.rejected = 0
+        self.finished_by_status: Dict[str, int] = {status: 0 for status in FINISHED_STATUSES}
+        self.wait_seconds_total = 0.0
+
+    # --- Lifecycle ---
+    def start(self, runner: Callable[[Job], Awaitable[Dict[str, Any]]]):
+        """Start the workers on the running event loop; `runner` answers one job and returns its result"""
+        self._runner = runner
+        self._stopping = False
+        self._wakeup = asyncio.Condition()
+        self._worker_tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+        logger.info(f"Job queue started: {self.workers} workers ({self.batch_workers} for batch), "
+                    f"{self.max_per_client or 'unlimited'} running jobs per client")
+
+    async def stop(self):
+        """Cancel queued and running jobs and stop the workers"""
+        self._stopping = True
+        for job in list(self._jobs.values()):
+            if not job.finished:
+                self.cancel(job.job_id)
+        for task in self._worker_tasks:
+            task.cancel()
+        await asyncio.gather(*self._worker_tasks, return_exceptions=True)
+        self._worker_tasks = []
+
+    # --- Client API ---
+    def submit(self, question: str, priority: str = "interactive", client_id: str = "anonymous",
+               options: Optional[Dict[str, Any]] = None) -> Job:
+        if self._runner is None:
+            raise RuntimeError("Job queue is not started")
+        self._expire()
+        if sum(len(jobs) for jobs in self._pending.values()) >= self.max_queued:
+            self.rejected += 1
+            raise JobQueueFullError(f"{self.max_queued} jobs are already queued; try again later.")
+        job = Job(question, priority if priority in PRIORITIES else PRIORITIES[-1], client_id, options)
+        self._jobs[job.job_id] = job
+        self._pending[job.priority].append(job)
+        self.submitted += 1
+        logger.info(f"Queued {job.priority} job {job.job_id} for client {client_id}: {question}")
+        self._notify()
+        return job
+
+    def get(self, job_id: str) -> Optional[Job]:
+        self._expire()
+        return self._jobs.get(job_id)
+
+    def cancel(self, job_id: str) -> Optional[Job]:
+        """Cancel a queued or running job; finished jobs are returned unchanged"""
+        job = self._jobs.get(job_id)
+        if job is None or job.finished:
+            return job
+        if job.status == "queued":
+            self._pending[job.priority].remove(job)
+            job.cancel_requested = True
+            self._finish(job, "cancelled")
+        else: # The worker records the cancellation once the runner stops
+            job._request_cancel()
+        logger.info(f"Cancel requested for job {job_id} ({job.status})")
+        return job
+
+    def queue_position(self, job: Job) -> Optional[int]:
+        """0-based place among the queued jobs in pick order (ignoring per-client limits)"""
+        if job.status != "queued":
+            return None
+        position = 0
+        for priority in PRIORITIES:
+            if priority == job.priority:
+                return position + self._pending[priority].index(job)
+            position += len(self._pending[priority])
+        return None
+
+    # --- Workers ---
+    def _notify(self):
+        async def notify():
+            async with self._wakeup:
+                self._wakeup.notify_all()
+        asyncio.ensure_future(notify())
+
+    def _pick(self) -> Optional[Job]:
+        """Oldest job of the highest priority whose client (and priority class) has a free slot"""
+        for priority in PRIORITIES:
+            if priority == "batch" and self._running_by_priority[priority] >= self.batch_workers:
+                continue
+            for job in self._pending[priority]:
+                if self.max_per_client and self._running_by_client.get(job.client_id, 0) >= self.max_per_client:
+                    continue
+                self._pending[priority].remove(job)
+                return job
+        return None
+
+    async def _next_job(self) -> Job:
+        async with self._wakeup:
+            while True:
+                job = self._pick()
+                if job is not None:
+                    return job
+                await self._wakeup.wait()
+
+    async def _worker(self):
+        while True:
+            job = await self._next_job()
+            self._running_by_client[job.client_id] = self._running_by_client.get(job.client_id, 0) + 1
+            self._running_by_priority[job.priority] += 1
+            self.started += 1
+            self.wait_seconds_total += time.time() - job.submitted_at
+            job._set_status("running")
+            job._task = asyncio.create_task(self._runner(job))
+            try:
+                job.result = await job._task
+                status = "succeeded"
+            except asyncio.CancelledError:
+                if self._stopping: # The worker itself is being stopped
+                    job._task.cancel()
+                    self._release(job)
+                    if not job.finished:
+                        self._finish(job, "cancelled")
+                    raise
+                status = "cancelled"
+            except Exception as e:
+                status = "cancelled" if job.cancel_requested else "failed"
+                if status == "failed":
+                    job.error = str(e)
+                    logger.warning(f"Job {job.job_id} failed: {e}")
+            self._release(job)
+            self._finish(job, status)
+            self._notify() # A client/priority slot is free again
+
+    def _release(self, job: Job):
+        self._running_by_client[job.client_id] -= 1
+        if not self._running_by_client[job.client_id]:
+            del self._running_by_client[job.client_id]
+        self._running_by_priority[job.priority] -= 1
+
+    def _finish(self, job: Job, status: str):
+        job._set_status(status)
+        job._task = None
+        self.finished_by_status[status] += 1
+        logger.info(f"Job {job.job_id} {status} after {job.finished_at - job.submitted_at:.3f}s")
+
+    def _expire(self):
+        """Forget finished jobs older than the result TTL"""
+        cutoff = time.time() - self.result_ttl
+        for job_id in [j.job_id for j in self._jobs.values() if j.finished and j.finished_at < cutoff]:
+            del self._jobs[job_id]
+
+    def stats(self) -> Dict[str, Any]:
+        self._expire()
+        return {
+            "workers": self.workers,
+            "batch_workers": self.batch_workers,
+            "max_per_client": self.max_per_client,
+            "queued": {priority: len(jobs) for priority, jobs in self._pending.items()},
+            "running": dict(self._running_by_priority),
+            "submitted": self.submitted,
+            "rejected": self.rejected,
+            "finished": dict(self.finished_by_status),
+            "retained": sum(1 for job in self._jobs.values() if job.finished),
+            "mean_wait_seconds": self.wait_seconds_total / self.started if self.started else 0.0,
+            "result_ttl_seconds": self.result_ttl,
+        }
+
+
+# Shared by the /jobs endpoints; started with the app
+job_queue = JobQueue()
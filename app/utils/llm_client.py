@@ -0,0 +1,316 @@
+# app/utils/llm_client.py
+# Resilient calls to the SQL-generating LLM. Every call gets an overall
+# deadline; failed attempts are retried with jittered exponential backoff,
+# a hedged second request is sent when the first is slower than the recent
+# p95, and a circuit breaker fails fast while the backend is unhealthy.
+# Backends are pluggable: Gemini (default), a plain HTTP endpoint (used with
+# benchmarks/fake_llm_server.py) or any object with generate_content().
+import json
+import logging
+import os
+import random
+import threading
+import time
+import urllib.error
+import urllib.request
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Any, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+class LLMUnavailableError(RuntimeError):
+    """The LLM backend could not answer: circuit open, retries exhausted or deadline passed."""
+
+class LLMTimeoutError(LLMUnavailableError):
+    """The call's deadline passed before any attempt answered."""
+
+class LLMBackendError(RuntimeError):
+    """Error response from a backend; `retryable` for 429/5xx-style failures."""
+
+    def __init__(self, message: str, retryable: bool = True):
+        super().__init__(message)
+        self.retryable = retryable
+
+# Google API errors that mean the request itself is bad, not that the service is unhealthy
+_NON_RETRYABLE_ERRORS = {"InvalidArgument", "PermissionDenied", "Unauthenticated", "NotFound", "FailedPrecondition"}
+
+def _is_retryable(error: Exception) -> bool:
+    if isinstance(error, LLMBackendError):
+        return error.retryable
+    if isinstance(error, (ValueError, TypeError)) or type(error).__name__ in _NON_RETRYABLE_ERRORS:
+        return False
+    return True # Timeouts, connection errors, 5xx, rate limits
+
+
+# --- Backends: generate(prompt, timeout) -> completion text ---
+class GeminiBackend:
+    name = "gemini"
+
+    def __init__(self, model_name: str, api_key: Optional[str]):
+        if not api_key:
+            raise ValueError("GOOGLE_API_KEY not found in environment variables.")
+        self.model_name = model_name
+        self.api_key = api_key
+        self._model = None
+
+    @property
+    def model(self):
+        """Gemini model, created on first use so google.generativeai is not imported at startup"""
+        if self._model is None:
+            import google.generativeai as genai
+            genai.configure(api_key=self.api_key)
+            self._model = genai.GenerativeModel(self.model_name)
+        return self._model
+
+    def generate(self, prompt: str, timeout: float) -> str:
+        response = self.model.generate_content(prompt, request_options={"timeout": timeout})
+        return response.text or ""
+
+class ModelBackend:
+    """Any object with generate_content(prompt) returning something with .text (e.g. a stand-in model)"""
+    name = "model"
+
+    def __init__(self, model: Any):
+        self.model = model
+
+    def generate(self, prompt: str, timeout: float) -> str:
+        response = self.model.generate_content(prompt) # No per-call timeout; the client's deadline still applies
+        return response.text or ""
+
+class HTTPBackend:
+    """POSTs {"prompt": ...} as JSON and expects {"text": ...} back"""
+    name = "http"
+
+    def __init__(self, url: str):
+        self.url = url
+
+    def generate(self, prompt: str, timeout: float) -> str:
+        request = urllib.request.Request(self.url, data=json.dumps({"prompt": prompt}).encode("utf-8"),
+                                         headers={"Content-Type": "application/json"}, method="POST")
+        try:
+            with urllib.request.urlopen(request, timeout=timeout) as response:
+                return json.loads(response.read().decode("utf-8")).get("text") or ""
+        except urllib.error.HTTPError as e:
+            raise LLMBackendError(f"HTTP {e.code} from {self.url}", retryable=e.code == 429 or e.code >= 500)
+
+
+class CircuitBreaker:
+    """
+    Opens after `failure_threshold` consecutive failures; after `reset_seconds`
+    one probe call is let through (half-open) and its outcome closes or
+    re-opens the circuit.
+    """
+
+    def __init__(self, failure_threshold: int = 5, reset_seconds: float = 30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self.state = "closed"
+        self.consecutive_failures = 0
+        self.opened_count = 0
+        self._opened_at = 0.0
+        self._probe_in_flight = False
+        self._lock = threading.Lock()
+
+    def allow(self) -> bool:
+        with self._lock:
+            if self.state == "closed":
+                return True
+            if self.state == "open" and time.monotonic() - self._opened_at >= self.reset_seconds:
+                self.state = "half_open"
+                self._probe_in_flight = False
+            if self.state == "half_open" and not self._probe_in_flight:
+                self._probe_in_flight = True
+                return True
+            return False
+
+    def is_open(self) -> bool:
+        """True while calls would be refused (open and not yet due for a probe); does not change state"""
+        with self._lock:
+            return self.state == "open" and time.monotonic() - self._opened_at < self.reset_seconds
+
+    def record_success(self):
+        with self._lock:
+            if self.state != "closed":
+                logger.info("LLM circuit closed: backend answered again")
+            self.state = "closed"
+            self.consecutive_failures = 0
+            self._probe_in_flight = False
+
+    def record_failure(self):
+        with self._lock:
+            self.consecutive_failures += 1
+            if self.state == "half_open" or (self.state == "closed" and self.consecutive_failures >= self.failure_threshold):
+                logger.warning(f"LLM circuit opened after {self.consecutive_failures} consecutive failures")
+                self.state = "open"
+                self.opened_count += 1
+                self._opened_at = time.monotonic()
+                self._probe_in_flight = False
+
+
+class LLMClient:
+    """
+    generate(prompt) with an overall deadline, retries, hedging and a circuit
+    breaker around a pluggable backend. Blocking; call it off the event loop.
+    """
+
+    def __init__(self, backend, deadline_seconds: float = 30.0, attempt_timeout: float = 15.0,
+                 max_retries: int = 2, backoff_base: float = 0.25, backoff_max: float = 4.0,
+                 hedge: bool = True, hedge_quantile: float = 0.95, hedge_min_delay: float = 0.2,
+                 hedge_initial_delay: float = 2.0, breaker: Optional[CircuitBreaker] = None, max_threads: int = 32):
+        self.backend = backend
+        self.deadline_seconds = deadline_seconds
+        self.attempt_timeout = attempt_timeout
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.hedge = hedge
+        self.hedge_quantile = hedge_quantile
+        self.hedge_min_delay = hedge_min_delay
+        self.hedge_initial_delay = hedge_initial_delay # Until enough latencies are recorded for the quantile
+        self.breaker = breaker or CircuitBreaker()
+        # Attempts and hedges run here; a timed-out attempt keeps its thread until the backend gives up
+        self._pool = ThreadPoolExecutor(max_workers=max_threads, thread_name_prefix="llm-client")
+        self._latencies = deque(maxlen=200) # Recent successful attempt latencies (seconds)
+        self._lock = threading.Lock()
+        self.calls = 0
+        self.attempts = 0
+        self.retries = 0
+        self.hedges = 0
+        self.hedge_wins = 0
+        self.timeouts = 0
+        self.failures = 0
+        self.short_circuited = 0
+
+    def hedge_delay(self) -> float:
+        """Send the hedged request once the first has taken longer than the recent p95 (or the configured quantile)"""
+        with self._lock:
+            latencies = sorted(self._latencies)
+        if len(latencies) < 20:
+            return self.hedge_initial_delay
+        return max(self.hedge_min_delay, latencies[min(len(latencies) - 1, int(len(latencies) * self.hedge_quantile))])
+
+    def _call_backend(self, prompt: str, timeout: float) -> str:
+        start = time.monotonic()
+        text = self.backend.generate(prompt, timeout)
+        with self._lock:
+            self._latencies.append(time.monotonic() - start)
+        return text
+
+    def _attempt(self, prompt: str, timeout: float) -> str:
+        """One attempt, plus a hedged duplicate if it is slow; the first success wins"""
+        start = time.monotonic()
+        deadline = start + timeout
+        primary = self._pool.submit(self._call_backend, prompt, timeout)
+        pending = {primary}
+        hedge_at = start + self.hedge_delay() if self.hedge and self.breaker.state == "closed" else None
+        error: Optional[BaseException] = None
+        while pending:
+            now = time.monotonic()
+            if now >= deadline:
+                break
+            wake_at = min(deadline, hedge_at) if hedge_at else deadline
+            done, pending = wait(pending, timeout=max(0.0, wake_at - now), return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is None:
+                    if future is not primary:
+                        with self._lock:
+                            self.hedge_wins += 1
+                    return future.result()
+                error = future.exception()
+            if hedge_at and time.monotonic() >= hedge_at and pending:
+                hedge_at = None
+                with self._lock:
+                    self.hedges += 1
+                logger.info(f"LLM attempt slower than {self.hedge_delay():.2f}s, sending a hedged request")
+                pending.add(self._pool.submit(self._call_backend, prompt, max(0.0, deadline - time.monotonic())))
+        if pending or error is None:
+            raise LLMTimeoutError(f"No LLM answer within {timeout:.1f}s")
+        raise error
+
+    def generate(self, prompt: str) -> str:
+        deadline = time.monotonic() + self.deadline_seconds
+        with self._lock:
+            self.calls += 1
+        last_error: Optional[Exception] = None
+        for attempt in range(self.max_retries + 1):
+            if not self.breaker.allow():
+                with self._lock:
+                    self.short_circuited += 1
+                raise LLMUnavailableError("LLM backend is unhealthy (circuit open); failing fast")
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            with self._lock:
+                self.attempts += 1
+                self.retries += attempt > 0
+            try:
+                text = self._attempt(prompt, min(remaining, self.attempt_timeout))
+                self.breaker.record_success()
+                return text
+            except Exception as e:
+                last_error = e
+                if not _is_retryable(e):
+                    self.breaker.record_success() # The backend answered; the request was bad
+                    with self._lock:
+                        self.failures += 1
+                    raise
+                self.breaker.record_failure()
+                with self._lock:
+                    self.timeouts += isinstance(e, LLMTimeoutError)
+                logger.warning(f"LLM attempt {attempt + 1}/{self.max_retries + 1} failed: {e}")
+            if attempt < self.max_retries:
+                # Full jitter, so clients that failed together do not retry together
+                backoff = random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** attempt))
+                time.sleep(min(backoff, max(0.0, deadline - time.monotonic())))
+
+        with self._lock:
+            self.failures += 1
+        if last_error is None or isinstance(last_error, LLMTimeoutError) or time.monotonic() >= deadline:
+            raise LLMTimeoutError(f"No LLM answer within the {self.deadline_seconds:.0f}s deadline") from last_error
+        raise LLMUnavailableError(f"LLM backend failed after {self.max_retries + 1} attempts: {last_error}") from last_error
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            stats = {
+                "backend": self.backend.name,
+                "calls": self.calls,
+                "attempts": self.attempts,
+                "retries": self.retries,
+                "hedges": self.hedges,
+                "hedge_wins": self.hedge_wins,
+                "timeouts": self.timeouts,
+                "failures": self.failures,
+                "short_circuited": self.short_circuited,
+            }
+        stats.update({"hedge_delay_seconds": round(self.hedge_delay(), 3), "circuit_state": self.breaker.state,
+                      "circuit_opened": self.breaker.opened_count})
+        return stats
+
+
+def _env_flag(name: str, default: str) -> bool:
+    return os.getenv(name, default) not in ("0", "false", "False", "")
+
+def build_llm_client(model_name: str) -> LLMClient:
+    """Client configured from the environment (LLM_BACKEND=gemini|http and the LLM_* settings)"""
+    backend_name = os.getenv("LLM_BACKEND", "gemini")
+    if backend_name == "http":
+        backend = HTTPBackend(os.getenv("LLM_HTTP_URL", "http://127.0.0.1:8765/generate"))
+    elif backend_name == "gemini":
+        backend = GeminiBackend(model_name, os.getenv("GOOGLE_API_KEY"))
+    else:
+        raise ValueError(f"Unknown LLM_BACKEND '{backend_name}' (expected 'gemini' or 'http')")
+    return LLMClient(
+        backend,
+        deadline_seconds=float(os.getenv("LLM_DEADLINE_SECONDS", "30")),
+        attempt_timeout=float(os.getenv("LLM_ATTEMPT_TIMEOUT", "15")),
+        max_retries=int(os.getenv("LLM_MAX_RETRIES", "2")),
+        backoff_base=float(os.getenv("LLM_RETRY_BACKOFF", "0.25")),
+        backoff_max=float(os.getenv("LLM_RETRY_BACKOFF_MAX", "4")),
+        hedge=_env_flag("LLM_HEDGE", "1"),
+        hedge_quantile=float(os.getenv("LLM_HEDGE_QUANTILE", "0.95")),
+        hedge_min_delay=float(os.getenv("LLM_HEDGE_MIN_DELAY", "0.2")),
+        hedge_initial_delay=float(os.getenv("LLM_HEDGE_INITIAL_DELAY", "2")),
+        breaker=CircuitBreaker(failure_threshold=int(os.getenv("LLM_BREAKER_FAILURES", "5")),
+                               reset_seconds=float(os.getenv("LLM_BREAKER_RESET_SECONDS", "30"))),
+    )
@@ -0,0 +1,118 @@
+# app/utils/metrics.py
+# Per-request stage timers (returned in responses and as a Server-Timing header)
+# and a small in-process registry rendered in the Prometheus text format at /metrics.
+import bisect
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Optional, Tuple
+
+# Latency buckets in seconds, from rule/cache hits up to slow LLM calls
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+LabelSet = Tuple[Tuple[str, str], ...]
+
+def _labels(labels: Dict[str, str]) -> LabelSet:
+    return tuple(sorted(labels.items()))
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+def _format_labels(labels: LabelSet, extra: Optional[Tuple[str, str]] = None) -> str:
+    pairs = list(labels) + ([extra] if extra else [])
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in pairs) + "}"
+
+def _format_value(value: float) -> str:
+    return repr(float(value)) if value != int(value) else str(int(value))
+
+
+class MetricsRegistry:
+    """Thread-safe counters and histograms keyed by metric name and label set."""
+
+    def __init__(self, buckets: Tuple[float, ...] = DEFAULT_BUCKETS):
+        self.buckets = buckets
+        self._lock = threading.Lock()
+        self._help: Dict[str, Tuple[str, str]] = {} # name -> (type, help text)
+        self._counters: Dict[str, Dict[LabelSet, float]] = {}
+        # name -> labels -> (per-bucket counts, sum, count)
+        self._histograms: Dict[str, Dict[LabelSet, Tuple[List[int], float, int]]] = {}
+
+    def inc(self, name: str, help_text: str, value: float = 1.0, **labels: str):
+        key = _labels(labels)
+        with self._lock:
+            self._help.setdefault(name, ("counter", help_text))
+            series = self._counters.setdefault(name, {})
+            series[key] = series.get(key, 0.0) + value
+
+    def observe(self, name: str, help_text: str, value: float, **labels: str):
+        key = _labels(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            self._help.setdefault(name, ("histogram", help_text))
+            series = self._histograms.setdefault(name, {})
+            counts, total, count = series.get(key) or ([0] * (len(self.buckets) + 1), 0.0, 0)
+            counts[index] += 1
+            series[key] = (counts, total + value, count + 1)
+
+    def render(self, collected: Optional[Dict[str, Tuple[str, str, Dict[LabelSet, float]]]] = None) -> str:
+        """
+        Prometheus text exposition format. `collected` holds values read at
+        scrape time from other components: name -> (type, help text, series).
+        """
+        lines = []
+        with self._lock:
+            for name, series in self._counters.items():
+                lines += [f"# HELP {name} {self._help[name][1]}", f"# TYPE {name} counter"]
+                lines += [f"{name}{_format_labels(labels)} {_format_value(value)}" for labels, value in series.items()]
+            for name, series in self._histograms.items():
+                lines += [f"# HELP {name} {self._help[name][1]}", f"# TYPE {name} histogram"]
+                for labels, (counts, total, count) in series.items():
+                    cumulative = 0
+                    for bound, bucket_count in zip(self.buckets, counts):
+                        cumulative += bucket_count
+                        lines.append(f"{name}_bucket{_format_labels(labels, ('le', repr(bound)))} {cumulative}")
+                    lines.append(f"{name}_bucket{_format_labels(labels, ('le', '+Inf'))} {count}")
+                    lines.append(f"{name}_sum{_format_labels(labels)} {_format_value(total)}")
+                    lines.append(f"{name}_count{_format_labels(labels)} {count}")
+        for name, (metric_type, help_text, series) in (collected or {}).items():
+            lines += [f"# HELP {name} {help_text}", f"# TYPE {name} {metric_type}"]
+            lines += [f"{name}{_format_labels(labels)} {_format_value(value)}" for labels, value in series.items()]
+        return "\n".join(lines) + "\n"
+
+
+# Shared by every endpoint; exposed at /metrics
+metrics = MetricsRegistry()
+
+
+class StageTimer:
+    """
+    Wall time per stage of one request. Stages that run more than once add up.
+    Each stage is also observed in the textsql_stage_seconds histogram.
+    """
+
+    def __init__(self, endpoint: str):
+        self.endpoint = endpoint
+        self.timings: Dict[str, float] = {}
+        self._start = time.perf_counter()
+
+    @contextmanager
+    def stage(self, name: str) -> Iterator[None]:
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, time.perf_counter() - start)
+
+    def record(self, name: str, seconds: float):
+        self.timings[name] = self.timings.get(name, 0.0) + seconds
+        metrics.observe("textsql_stage_seconds", "Wall time per request stage", seconds,
+                        endpoint=self.endpoint, stage=name)
+
+    def elapsed(self) -> float:
+        return time.perf_counter() - self._start
+
+    def server_timing(self) -> str:
+        """Server-Timing header value (durations in milliseconds)"""
+        return ", ".join(f"{name};dur={seconds * 1000:.2f}" for name, seconds in self.timings.items())
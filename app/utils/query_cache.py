@@ -0,0 +1,156 @@
+# app/utils/query_cache.py
+import hashlib
+import json
+import logging
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+# Sentence punctuation that is not glued between two word characters (keeps "2025-06-01",
+# "1.5"). Operators and signs ("<", ">=", "!=", "-5") change the meaning and are kept.
+_PUNCTUATION_RE = re.compile(r"(?<!\w)[?!.,;:\"'`()]+(?!=)|[?!.,;:\"'`()]+(?![\w=])")
+# Comparison operators are spaced out, so "sales>100" and "sales > 100" share a key
+_OPERATOR_RE = re.compile(r"\s*(<=|>=|!=|<>|==|<|>|=)\s*")
+_WHITESPACE_RE = re.compile(r"\s+")
+
+
+def normalize_question(question: str) -> str:
+    """Normalize a question so trivially different phrasings share one cache key."""
+    normalized = _PUNCTUATION_RE.sub(" ", question.lower())
+    normalized = _OPERATOR_RE.sub(r" \1 ", normalized)
+    return _WHITESPACE_RE.sub(" ", normalized).strip()
+
+
+def hash_table_info(table_info: Dict) -> str:
+    """Stable short hash of the schema, so a schema change invalidates cached SQL."""
+    payload = json.dumps(table_info, sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()[:16]
+
+
+class QueryCache:
+    """
+    Thread-safe LRU cache with optional TTL and optional JSON persistence.
+    Entries are stored with wall-clock timestamps so the TTL still holds
+    after the cache is reloaded from disk. Changes are written behind, at
+    most once per save_interval_seconds, and flush() writes what is left.
+    """
+
+    def __init__(self, max_size: int = 1024, ttl_seconds: Optional[float] = None,
+                 persist_path: Optional[str] = None, save_interval_seconds: float = 5.0):
+        self.max_size = max_size
+        self.ttl_seconds = ttl_seconds
+        self.persist_path = persist_path
+        self.save_interval_seconds = save_interval_seconds
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()  # key -> (value, stored_at)
+        self._lock = threading.Lock()
+        self._save_timer: Optional[threading.Timer] = None
+        self.saves = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.stale_hits = 0
+        if self.persist_path:
+            self._load()
+
+    def _is_expired(self, stored_at: float, now: float) -> bool:
+        return self.ttl_seconds is not None and now - stored_at > self.ttl_seconds
+
+    def get(self, key: str, allow_stale: bool = False) -> Optional[Any]:
+        """
+        Cached value, or None. Expired entries count as misses but stay until
+        LRU eviction, so allow_stale=True can still serve them (LLM outages).
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            value, stored_at = entry
+            if self._is_expired(stored_at, time.time()):
+                if not allow_stale:
+                    self.misses += 1
+                    return None
+                self.stale_hits += 1
+                return value
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key: str, value: Any):
+        with self._lock:
+            self._entries[key] = (value, time.time())
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+            self._schedule_save()
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._schedule_save()
+
+    def flush(self):
+        """Write pending changes now (called at shutdown)"""
+        with self._lock:
+            if self._save_timer is not None:
+                self._save_timer.cancel()
+                self._save_timer = None
+                self._save()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self._entries),
+                "max_size": self.max_size,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "stale_hits": self.stale_hits,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+            }
+
+    # --- Persistence (called with the lock held) ---
+    def _schedule_save(self):
+        """One write per interval however many entries change in it, instead of one per set()"""
+        if not self.persist_path or self._save_timer is not None:
+            return
+        self._save_timer = threading.Timer(self.save_interval_seconds, self._save_pending)
+        self._save_timer.daemon = True
+        self._save_timer.start()
+
+    def _save_pending(self):
+        with self._lock:
+            if self._save_timer is not None:
+                self._save_timer = None
+                self._save()
+
+    def _save(self):
+        try:
+            tmp_path = f"{self.persist_path}.tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump([[k, v, ts] for k, (v, ts) in self._entries.items()], f)
+            os.replace(tmp_path, self.persist_path)  # Atomic swap, never a half-written file
+            self.saves += 1
+        except (OSError, TypeError) as e:
+            logger.warning(f"Could not persist query cache to {self.persist_path}: {e}")
+
+    def _load(self):
+        if not os.path.exists(self.persist_path):
+            return
+        try:
+            with open(self.persist_path, "r", encoding="utf-8") as f:
+                entries = json.load(f)
+            now = time.time()
+            for key, value, stored_at in entries[-self.max_size:]:
+                if not self._is_expired(stored_at, now):
+                    self._entries[key] = (value, stored_at)
+            logger.info(f"Loaded {len(self._entries)} cached queries from {self.persist_path}")
+        except (OSError, ValueError) as e:
+            logger.warning(f"Ignoring unreadable query cache file {self.persist_path}: {e}")
@@ -0,0 +1,79 @@
+# app/utils/query_executor.py
+import logging
+from typing import Any, Dict, Iterator, List, NamedTuple, Optional, Tuple, Union
+
+from sqlalchemy import text
+from sqlalchemy.engine import Connection
+from sqlalchemy.orm import Session
+
+from app.utils.result_cache import result_cache
+from app.utils.query_guard import query_guard
+
+logger = logging.getLogger(__name__)
+
+class QueryOutput(NamedTuple):
+    columns: List[str]
+    rows: List[tuple]
+    truncated: bool # True when rows were cut off at the guard's row cap
+
+def execute_query(db: Union[Session, Connection], sql_query: str, params: Optional[Dict[str, Any]] = None) -> QueryOutput:
+    """
+    Execute a SQL query and return (columns, rows, truncated).
+    `params` are bound to the query's :name placeholders.
+    The query must pass the query guard (read-only, no runaway joins) and is
+    capped at QUERY_MAX_ROWS rows and QUERY_TIMEOUT_SECONDS of wall time.
+    Results are served from / stored in the shared result cache,
+    keyed by the canonical SQL text, the params and the current data version.
+    """
+    key = result_cache.make_key(sql_query, params=params)
+    cached = result_cache.get(key)
+    if cached is not None:
+        logger.info(f"Result cache hit for query: {sql_query}")
+        return cap_rows(*cached)
+
+    guarded_sql, plan = query_guard.prepare(db, sql_query, params)
+    with query_guard.time_limit(db, sql_query, plan):
+        result = db.execute(text(guarded_sql), params or {})
+        if not result.returns_rows:
+            return QueryOutput([], [], False)
+        columns = list(result.keys())
+        # One row past the cap is kept so truncation can be reported
+        limit = query_guard.max_rows + 1 if query_guard.max_rows else None
+        rows = [tuple(row) for row in (result.fetchmany(limit) if limit else result.fetchall())]
+        result.close()
+
+    result_cache.set(key, columns, rows)
+    return cap_rows(columns, rows)
+
+def cap_rows(columns: List[str], rows: List[tuple]) -> QueryOutput:
+    """Apply the guard's row cap to rows fetched with one row to spare"""
+    if query_guard.max_rows and len(rows) > query_guard.max_rows:
+        logger.warning(f"Result truncated to {query_guard.max_rows} rows")
+        return QueryOutput(columns, rows[:query_guard.max_rows], True)
+    return QueryOutput(columns, rows, False)
+
+def iter_query_batches(db: Union[Session, Connection], sql_query: str, batch_size: int = 500,
+                       params: Optional[Dict[str, Any]] = None) -> Iterator[Tuple[List[str], List[tuple]]]:
+    """
+    Execute a SQL query and yield (columns, rows) batches with fetchmany,
+    so arbitrarily large results never have to fit in memory at once.
+    Bypasses the result cache and the row cap on purpose, but not the
+    other query guard checks or the time limit. Only the time spent
+    executing and fetching counts toward the limit, not the time the
+    caller holds a batch. Close the generator before releasing `db`.
+    """
+    guarded_sql, plan = query_guard.prepare(db, sql_query, params, add_limit=False)
+    with query_guard.time_limit(db, sql_query, plan) as budget:
+        result = db.execute(text(guarded_sql).execution_options(stream_results=True), params or {})
+        if not result.returns_rows:
+            return
+        columns = list(result.keys())
+        try:
+            while True:
+                rows = result.fetchmany(batch_size)
+                if not rows:
+                    break
+                with budget.paused():
+                    yield columns, [tuple(row) for row in rows]
+        finally:
+            result.close()
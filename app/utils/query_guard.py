@@ -0,0 +1,253 @@
+# app/utils/query_guard.py
+# Pre-execution checks for generated SQL: read-only statements only, no runaway
+# nested-loop joins (judged from EXPLAIN QUERY PLAN), an automatic LIMIT, and a
+# wall-clock budget enforced with SQLite's progress handler.
+import logging
+import os
+import re
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List, Optional, Tuple, Union
+
+from sqlalchemy import text
+from sqlalchemy.engine import Connection
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.orm import Session
+
+from app.utils.result_cache import get_data_version
+
+logger = logging.getLogger(__name__)
+
+class QueryRejectedError(ValueError):
+    """Raised when a query fails a pre-execution check."""
+
+class QueryTimeoutError(QueryRejectedError):
+    """Raised when a query is aborted for exceeding its wall-clock budget."""
+
+class TimeBudget:
+    """
+    Seconds a statement may spend executing and fetching. A streaming caller
+    pauses it while a batch is with the client, so a slow reader does not
+    spend the budget of a query that has already finished its work.
+    """
+
+    def __init__(self, seconds: float):
+        self.seconds = seconds
+        self._spent = 0.0
+        self._running_since: Optional[float] = time.monotonic()
+
+    def pause(self):
+        if self._running_since is not None:
+            self._spent += time.monotonic() - self._running_since
+            self._running_since = None
+
+    def resume(self):
+        if self._running_since is None:
+            self._running_since = time.monotonic()
+
+    def remaining(self) -> float:
+        running = time.monotonic() - self._running_since if self._running_since is not None else 0.0
+        return self.seconds - self._spent - running
+
+    def expired(self) -> bool:
+        return self.remaining() < 0
+
+    @contextmanager
+    def paused(self) -> Iterator[None]:
+        self.pause()
+        try:
+            yield
+        finally:
+            self.resume()
+
+# Quoted strings/identifiers vs. everything else, so keywords inside literals are ignored
+_SQL_TOKEN_RE = re.compile(r"('(?:[^']|'')*'|\"(?:[^\"]|\"\")*\")|([^'\"]+)")
+_COMMENT_RE = re.compile(r"--[^\n]*|/\*.*?\*/", re.DOTALL)
+_WRITE_KEYWORD_RE = re.compile(r"\b(insert|update|delete|drop|alter|create|attach|detach|pragma|vacuum|reindex)\b")
+# A LIMIT clause that is not inside parentheses, i.e. applies to the whole statement
+_TOP_LEVEL_LIMIT_RE = re.compile(r"\blimit\b[^()]*$")
+_TABLE_ALIAS_RE = re.compile(r"\b(?:from|join|,)\s+(\w+)(?:\s+(?:as\s+)?(\w+))?")
+_PLAN_LOOP_RE = re.compile(r"^(SCAN|SEARCH) (\w+)")
+
+# How many rows a SEARCH (index lookup) is assumed to visit, as a fraction of the table
+_SEARCH_FRACTION = 0.1
+
+def _unquoted(sql: str) -> str:
+    """Lowercased SQL with comments removed and quoted text blanked out"""
+    parts = []
+    for quoted, plain in _SQL_TOKEN_RE.findall(_COMMENT_RE.sub(" ", sql)):
+        parts.append("''" if quoted else plain.lower())
+    return "".join(parts)
+
+def _plan_text(plan: Optional[List[tuple]]) -> str:
+    return "; ".join(row[3] for row in plan) if plan else "n/a"
+
+def _connection(db: Union[Session, Connection]) -> Connection:
+    return db.connection() if isinstance(db, Session) else db
+
+
+class QueryGuard:
+    """Validates, rewrites and time-boxes generated SQL; keeps rejection counters."""
+
+    def __init__(self, max_rows: int = 10000, timeout_seconds: Optional[float] = 10.0, max_join_rows: int = 1_000_000):
+        self.max_rows = max_rows
+        self.timeout_seconds = timeout_seconds
+        self.max_join_rows = max_join_rows
+        self._lock = threading.Lock()
+        self._table_rows: Dict[str, int] = {}
+        self._table_rows_version: Optional[int] = None
+        self.checked = 0
+        self.rejected = 0
+        self.aborted = 0
+        self.limited = 0
+        self.rejected_by_reason: Dict[str, int] = {}
+
+    # --- Checks ---
+    def prepare(self, db: Union[Session, Connection], sql_query: str, params: Optional[Dict[str, Any]] = None,
+                add_limit: bool = True) -> Tuple[str, List[tuple]]:
+        """
+        Return (SQL to execute, its query plan), with a LIMIT added when the
+        SQL has none, or raise QueryRejectedError for statements that must not run.
+        """
+        sql_query, plain = self.check_statement(sql_query)
+        conn = _connection(db)
+        plan = [tuple(row) for row in conn.execute(text(f"EXPLAIN QUERY PLAN {sql_query}"), params or {})]
+        self.check_join_rows(sql_query, self._estimate_join_rows(conn, plain, plan), _plan_text(plan))
+        if add_limit:
+            sql_query = self.add_row_limit(sql_query, plain)
+        return sql_query, plan
+
+    def check_statement(self, sql_query: str) -> Tuple[str, str]:
+        """
+        Engine-independent checks: a single read-only SELECT/WITH statement.
+        Returns the trimmed SQL and its lowercased, literal-free form.
+        """
+        with self._lock:
+            self.checked += 1
+        sql_query = sql_query.strip().rstrip(";").strip()
+        plain = _unquoted(sql_query)
+        if ";" in plain:
+            self._reject("multiple_statements", sql_query, "Only a single statement is allowed.")
+        if not plain.lstrip().startswith(("select", "with")) or _WRITE_KEYWORD_RE.search(plain):
+            self._reject("not_select", sql_query, "Only read-only SELECT queries are allowed.")
+        return sql_query, plain
+
+    def check_join_rows(self, sql_query: str, join_rows: int, plan_description: str):
+        """Reject when the engine's plan joins more row combinations than allowed without an index/hash join"""
+        if self.max_join_rows and join_rows > self.max_join_rows:
+            self._reject("expensive_join", sql_query,
+                         f"Query joins without an index over ~{join_rows:,} row combinations "
+                         f"(limit {self.max_join_rows:,}); add a join condition on item_id/date.", plan_description)
+
+    def add_row_limit(self, sql_query: str, plain: str) -> str:
+        if not self.max_rows or _TOP_LEVEL_LIMIT_RE.search(plain):
+            return sql_query
+        with self._lock:
+            self.limited += 1
+        # One extra row tells the caller the result was cut off
+        return f"{sql_query} LIMIT {self.max_rows + 1}"
+
+    def _estimate_join_rows(self, conn: Connection, plain: str, plan: List[tuple]) -> int:
+        """
+        Row combinations visited by nested-loop joins whose inner loop is a
+        full SCAN (the cartesian-product shape). Indexed joins count as 0.
+        """
+        table_rows = self.get_table_rows(conn)
+        aliases = {alias: table for table, alias in _TABLE_ALIAS_RE.findall(plain) if alias}
+        fallback_rows = max(table_rows.values(), default=0) # CTEs/subqueries: assume the biggest table
+
+        loops_by_parent: Dict[int, List[Tuple[str, int]]] = {}
+        for _, parent, _, detail in plan:
+            match = _PLAN_LOOP_RE.match(detail)
+            if not match:
+                continue
+            name = match.group(2).lower()
+            rows = table_rows.get(aliases.get(name, name), fallback_rows)
+            if match.group(1) == "SEARCH":
+                rows = max(1, int(rows * _SEARCH_FRACTION))
+            loops_by_parent.setdefault(parent, []).append((match.group(1), rows))
+
+        worst = 0
+        for loops in loops_by_parent.values():
+            if len(loops) < 2 or not any(kind == "SCAN" for kind, _ in loops[1:]):
+                continue
+            combinations = 1
+            for _, rows in loops:
+                combinations *= rows
+            worst = max(worst, combinations)
+        return worst
+
+    def get_table_rows(self, conn: Connection) -> Dict[str, int]:
+        """Row count per table from sqlite_stat1 (written by ANALYZE), refreshed when the data version changes"""
+        version = get_data_version()
+        if self._table_rows_version == version:
+            return self._table_rows
+        table_rows: Dict[str, int] = {}
+        try:
+            for table_name, stat in conn.execute(text("SELECT tbl, stat FROM sqlite_stat1")):
+                table_rows[table_name.lower()] = max(table_rows.get(table_name.lower(), 0), int(stat.split()[0]))
+        except OperationalError: # Never analyzed: count the rows instead
+            conn.rollback()
+            for (table_name,) in conn.execute(text("SELECT name FROM sqlite_master WHERE type = 'table' AND name NOT LIKE 'sqlite_%'")).fetchall():
+                table_rows[table_name.lower()] = conn.execute(text(f'SELECT COUNT(*) FROM "{table_name}"')).scalar()
+        self._table_rows, self._table_rows_version = table_rows, version
+        return table_rows
+
+    def _reject(self, reason: str, sql_query: str, message: str, plan_description: str = "n/a"):
+        with self._lock:
+            self.rejected += 1
+            self.rejected_by_reason[reason] = self.rejected_by_reason.get(reason, 0) + 1
+        logger.warning(f"Rejected query ({reason}): {sql_query} | plan: {plan_description}")
+        raise QueryRejectedError(message)
+
+    # --- Wall-clock budget ---
+    @contextmanager
+    def time_limit(self, db: Union[Session, Connection], sql_query: str, plan: Optional[List[tuple]] = None) -> Iterator[TimeBudget]:
+        """Abort the statement(s) run inside the block once the budget is spent; yields the budget"""
+        if not self.timeout_seconds:
+            yield TimeBudget(float("inf"))
+            return
+        driver_connection = _connection(db).connection.driver_connection
+        budget = TimeBudget(self.timeout_seconds)
+        # Called every N SQLite VM instructions; a non-zero return interrupts the statement
+        driver_connection.set_progress_handler(budget.expired, 10000)
+        try:
+            yield budget
+        except OperationalError as e:
+            if "interrupted" not in str(e.orig) or not budget.expired():
+                raise
+            raise self.timed_out(sql_query, _plan_text(plan)) from e
+        finally:
+            driver_connection.set_progress_handler(None, 10000)
+
+    def timed_out(self, sql_query: str, plan_description: str) -> QueryTimeoutError:
+        """Count and log an aborted query; returns the error for the caller to raise"""
+        with self._lock:
+            self.aborted += 1
+        logger.warning(f"Aborted query after {self.timeout_seconds}s: {sql_query} | plan: {plan_description}")
+        return QueryTimeoutError(f"Query exceeded the {self.timeout_seconds:g}s time limit and was aborted.")
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "checked": self.checked,
+                "rejected": self.rejected,
+                "aborted": self.aborted,
+                "limited": self.limited,
+                "rejected_by_reason": dict(self.rejected_by_reason),
+                "max_rows": self.max_rows,
+                "timeout_seconds": self.timeout_seconds,
+                "max_join_rows": self.max_join_rows,
+            }
+
+
+def _env_timeout() -> Optional[float]:
+    return float(os.getenv("QUERY_TIMEOUT_SECONDS", "10")) or None
+
+# Shared by every endpoint that executes generated SQL
+query_guard = QueryGuard(
+    max_rows=int(os.getenv("QUERY_MAX_ROWS", "10000")),
+    timeout_seconds=_env_timeout(),
+    max_join_rows=int(os.getenv("QUERY_MAX_JOIN_ROWS", "1000000")),
+)
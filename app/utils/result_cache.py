@@ -0,0 +1,133 @@
+# app/utils/result_cache.py
+import hashlib
+import json
+import logging
+import os
+import re
+import sys
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# --- Data version token ---
+# Bumped every time the loader writes a table, so cached results never outlive the data.
+_data_version = 0
+_data_version_lock = threading.Lock()
+
+def get_data_version() -> int:
+    return _data_version
+
+def bump_data_version() -> int:
+    global _data_version
+    with _data_version_lock:
+        _data_version += 1
+        return _data_version
+
+# --- SQL canonicalization ---
+# Quoted literals/identifiers are kept verbatim; everything else is case- and whitespace-folded.
+_SQL_TOKEN_RE = re.compile(r"('(?:[^']|'')*'|\"(?:[^\"]|\"\")*\")|([^'\"]+)")
+_WHITESPACE_RE = re.compile(r"\s+")
+_SPACE_AROUND_PUNCT_RE = re.compile(r"(\s*)([(),=<>+\-*/])(\s*)")
+_COMMENT_MARKERS = ("--", "/*", "*/")
+
+def _collapse_space_around_punct(match: "re.Match") -> str:
+    """Drop the spaces around an operator, unless that would glue two characters into a comment marker"""
+    text, punct = match.string, match.group(2)
+    before = text[match.start() - 1:match.start()] + punct
+    after = punct + text[match.end():match.end() + 1]
+    lead = " " if match.group(1) and before in _COMMENT_MARKERS else ""
+    trail = " " if match.group(3) and after in _COMMENT_MARKERS else ""
+    return lead + punct + trail
+
+def canonicalize_sql(sql: str) -> str:
+    """Canonical text for a SQL statement, used as the result cache key."""
+    parts = []
+    for quoted, plain in _SQL_TOKEN_RE.findall(sql.strip().rstrip(";").strip()):
+        if quoted:
+            parts.append(quoted)
+        else:
+            plain = _WHITESPACE_RE.sub(" ", plain.lower())
+            parts.append(_SPACE_AROUND_PUNCT_RE.sub(_collapse_space_around_punct, plain))
+    return "".join(parts).strip()
+
+def _estimate_size(columns: List[str], rows: List[tuple]) -> int:
+    """Approximate in-memory size of a result, extrapolated from a sample of rows."""
+    size = sys.getsizeof(rows) + sum(sys.getsizeof(c) for c in columns)
+    if not rows:
+        return size
+    sample = rows[:100]
+    sample_size = sum(sys.getsizeof(row) + sum(sys.getsizeof(v) for v in row) for row in sample)
+    return size + sample_size * len(rows) // len(sample)
+
+
+class ResultCache:
+    """LRU cache of query results, bounded by the total estimated size in bytes."""
+
+    def __init__(self, max_bytes: int = 64 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self._entries: "OrderedDict[str, Tuple[List[str], List[tuple], int]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @staticmethod
+    def make_key(sql: str, data_version: Optional[int] = None, params: Optional[Dict[str, Any]] = None) -> str:
+        version = get_data_version() if data_version is None else data_version
+        material = canonicalize_sql(sql)
+        if params: # Same template, different bound values -> different result
+            material += "\0" + json.dumps(params, sort_keys=True, default=str)
+        digest = hashlib.sha1(material.encode("utf-8")).hexdigest()
+        return f"{version}:{digest}"
+
+    def get(self, key: str) -> Optional[Tuple[List[str], List[tuple]]]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0], entry[1]
+
+    def set(self, key: str, columns: List[str], rows: List[tuple]) -> bool:
+        size = _estimate_size(columns, rows)
+        if size > self.max_bytes:
+            logger.info(f"Result of ~{size} bytes exceeds the result cache budget, not caching.")
+            return False
+        with self._lock:
+            if key in self._entries:
+                self.total_bytes -= self._entries.pop(key)[2]
+            self._entries[key] = (columns, rows, size)
+            self.total_bytes += size
+            while self.total_bytes > self.max_bytes:
+                _, (_, _, evicted_size) = self._entries.popitem(last=False)
+                self.total_bytes -= evicted_size
+                self.evictions += 1
+        return True
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.total_bytes = 0
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "total_bytes": self.total_bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "data_version": get_data_version(),
+            }
+
+
+# Shared by every endpoint that executes SQL
+result_cache = ResultCache(max_bytes=int(os.getenv("RESULT_CACHE_MAX_BYTES", str(64 * 1024 * 1024))))
@@ -0,0 +1,226 @@
+# app/utils/rollup_router.py
+# Rewrite stage between SQL generation and execution: an aggregate over ad_sales
+# or total_sales that one of the loader's rollup tables (data_loader.ROLLUP_GRAINS)
+# answers exactly is pointed at the smallest such rollup. Only SUM(metric),
+# COUNT(*) and MIN/MAX(item_id) over a single table are rewritten; anything the
+# router cannot prove exact runs unchanged on the base table (so does any query
+# naming a table or column in double quotes).
+import logging
+import os
+import re
+import threading
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+from app.utils.data_loader import TABLE_SCHEMAS, SNAPSHOT_TABLES, ROLLUP_TABLES, ROLLUPS_ENABLED, rollup_table_name, rollup_metrics
+from app.utils.query_guard import query_guard
+from app.utils.analytics_engine import ANALYTICS_ENGINE
+
+logger = logging.getLogger(__name__)
+
+# Rollups are maintained by the SQLite loader only; DuckDB scans the base tables column-wise
+ROLLUP_ROUTING = ROLLUPS_ENABLED and ANALYTICS_ENGINE == "sqlite" and os.getenv("ROLLUP_ROUTING", "1") != "0"
+
+class RoutedQuery(NamedTuple):
+    sql_query: str # The SQL to execute (rewritten or unchanged)
+    served_by: str # Table(s) the SQL reads: a rollup, or the base table(s)
+
+# Quoted strings/identifiers and comments; masked with spaces so positions still match the original SQL
+_MASK_RE = re.compile(r"('(?:[^']|'')*'|\"(?:[^\"]|\"\")*\")|(--[^\n]*|/\*.*?\*/)", re.DOTALL)
+_FROM_RE = re.compile(r"\bfrom\s+(\w+)(?:\s+(?:as\s+)?(?!where\b|group\b|order\b|limit\b|having\b)(\w+))?")
+_TABLES_RE = re.compile(r"\b(?:from|join)\s+(\w+)")
+_AGGREGATE_RE = re.compile(r"\b(sum|count|avg|min|max|total|group_concat)\s*\(")
+_IDENTIFIER_RE = re.compile(r"(?<![:\w$@])([a-z_]\w*)(?:\s*\.\s*([a-z_]\w*))?(\s*\()?")
+_ALIAS_RE = re.compile(r"\bas\s+(\w+)")
+_ORDER_BY_RE = re.compile(r"\border\s+by\b")
+_STAR_RE = re.compile(r"(?:^|\bselect|,)\s*(?:\w+\s*\.\s*)?\*")
+# strftime() of a date that only needs its year and/or month: answerable from a monthly rollup
+_MONTH_PART_RE = re.compile(r"strftime\(\s*'(?:%Y-%m|%Y|%m)'\s*,\s*(?:\w+\s*\.\s*)?date\s*\)", re.IGNORECASE)
+# Constructs the router never rewrites
+_UNSUPPORTED_RE = re.compile(r"\b(join|union|intersect|except|distinct|over|window|with|values)\b")
+_KEYWORDS = {
+    "select", "from", "where", "group", "by", "order", "having", "limit", "offset", "and", "or", "not", "as",
+    "asc", "desc", "between", "in", "is", "null", "like", "glob", "case", "when", "then", "else", "end", "cast",
+    "collate", "nocase", "escape", "true", "false", "nulls", "first", "last", "integer", "real", "text", "numeric",
+    "current_date", "current_time", "current_timestamp",
+}
+_KEY_COLUMNS = ("item_id", "date")
+_AS_BEFORE_RE = re.compile(r"\bas\s*$")
+
+def _mask(sql: str) -> str:
+    """Lowercased SQL with literals, quoted identifiers and comments blanked out, same length as the input"""
+    def blank(match):
+        text = match.group(0)
+        return text[0] + " " * (len(text) - 2) + text[-1] if match.group(1) else " " * len(text)
+    return _MASK_RE.sub(blank, sql).lower()
+
+def _hides_references(sql: str, masked: str, columns: set) -> bool:
+    """
+    True when a double-quoted identifier may be a table or column reference.
+    _mask blanks those, so the grain analysis could not see them. Quoted result
+    aliases (after AS), and later references to those aliases, are fine.
+    """
+    aliases, references = set(), []
+    for match in _MASK_RE.finditer(sql):
+        if match.group(1) and match.group(1).startswith('"'):
+            name = match.group(1)[1:-1].replace('""', '"').lower()
+            if _AS_BEFORE_RE.search(masked, 0, match.start()):
+                aliases.add(name)
+            else:
+                references.append(name)
+    return any(name not in aliases or name in columns for name in references)
+
+def _closing_paren(text: str, open_index: int) -> int:
+    depth = 0
+    for i in range(open_index, len(text)):
+        if text[i] == "(":
+            depth += 1
+        elif text[i] == ")":
+            depth -= 1
+            if depth == 0:
+                return i
+    return -1
+
+def _select_items(masked: str, start: int, end: int) -> List[Tuple[int, int]]:
+    """(start, end) of each top-level item of the SELECT list between start and end"""
+    items, depth, item_start = [], 0, start
+    for i in range(start, end):
+        if masked[i] == "(":
+            depth += 1
+        elif masked[i] == ")":
+            depth -= 1
+        elif masked[i] == "," and depth == 0:
+            items.append((item_start, i))
+            item_start = i + 1
+    items.append((item_start, end))
+    # Without the surrounding whitespace
+    return [(s + len(masked[s:e]) - len(masked[s:e].lstrip()), s + len(masked[s:e].rstrip())) for s, e in items]
+
+
+class RollupRouter:
+    """Routes exact aggregates to rollup tables; keeps per-table routing counters."""
+
+    def __init__(self, enabled: bool = ROLLUP_ROUTING):
+        self.enabled = enabled
+        self._lock = threading.Lock()
+        self.checked = 0
+        self.routed = 0
+        self.served_by: Dict[str, int] = {}
+
+    def route(self, conn, sql_query: str) -> RoutedQuery:
+        """The rewritten query and the rollup serving it, or the query unchanged and its base tables"""
+        routed = self._rewrite(conn, sql_query) if self.enabled else None
+        if routed is None:
+            masked = _mask(sql_query)
+            tables = [t for t in dict.fromkeys(_TABLES_RE.findall(masked)) if t in TABLE_SCHEMAS or t in SNAPSHOT_TABLES]
+            routed = RoutedQuery(sql_query, ", ".join(tables))
+        with self._lock:
+            self.checked += 1
+            if routed.sql_query != sql_query:
+                self.routed += 1
+            if routed.served_by:
+                self.served_by[routed.served_by] = self.served_by.get(routed.served_by, 0) + 1
+        return routed
+
+    def _rewrite(self, conn, sql_query: str) -> Optional[RoutedQuery]:
+        sql_query = sql_query.strip().rstrip(";").strip()
+        masked = _mask(sql_query)
+        if (masked.count("select") != 1 or not masked.lstrip().startswith("select")
+                or masked.count("from") != 1 or _UNSUPPORTED_RE.search(masked)):
+            return None
+        from_match = _FROM_RE.search(masked)
+        if not from_match or from_match.group(1) not in ROLLUP_TABLES:
+            return None
+        table_name = from_match.group(1)
+        alias = from_match.group(2)
+        metrics = set(rollup_metrics(table_name))
+        if _hides_references(sql_query, masked, {name for name, _ in TABLE_SCHEMAS[table_name]["columns"]} | {table_name}):
+            return None
+
+        # --- Aggregates: SUM(metric), COUNT(*) and MIN/MAX(item_id) only ---
+        count_spans: List[Tuple[int, int]] = []
+        outside = list(masked)
+        has_aggregate = False
+        for match in _AGGREGATE_RE.finditer(masked):
+            function = match.group(1)
+            close = _closing_paren(masked, match.end() - 1)
+            if close < 0:
+                return None
+            argument = masked[match.end():close].strip()
+            column = argument.split(".")[-1].strip()
+            if function == "sum" and column in metrics and re.fullmatch(r"(?:\w+\s*\.\s*)?\w+", argument):
+                pass
+            elif function == "count" and argument == "*":
+                count_spans.append((match.start(), close + 1))
+            elif function in ("min", "max") and column == "item_id" and re.fullmatch(r"(?:\w+\s*\.\s*)?\w+", argument):
+                continue # A plain item_id reference: checked with the other identifiers below
+            else:
+                return None
+            has_aggregate = True
+            outside[match.start():close + 1] = " " * (close + 1 - match.start())
+        outside_text = "".join(outside)
+        if not has_aggregate or _STAR_RE.search(outside_text):
+            return None
+
+        # --- Columns used outside the aggregates decide the grain ---
+        aliases = set(_ALIAS_RE.findall(outside_text))
+        outside_text = _ALIAS_RE.sub(lambda m: " " * len(m.group(0)), outside_text)
+        outside_text = outside_text[:from_match.start()] + " " * (from_match.end() - from_match.start()) + outside_text[from_match.end():]
+        order_match = _ORDER_BY_RE.search(outside_text)
+        order_by = order_match.start() if order_match else -1
+        uses_item = False
+        date_uses = 0
+        for match in _IDENTIFIER_RE.finditer(outside_text):
+            qualifier, name = (match.group(1), match.group(2)) if match.group(2) else (None, match.group(1))
+            if match.group(3) and not qualifier: # A function call
+                continue
+            if qualifier and qualifier not in (table_name, alias):
+                return None
+            if not qualifier and (name in _KEYWORDS or (name in aliases and name not in metrics and name not in _KEY_COLUMNS)):
+                continue
+            if not qualifier and name in aliases and 0 <= order_by < match.start(): # ORDER BY prefers result aliases
+                continue
+            if name == "item_id":
+                uses_item = True
+            elif name == "date":
+                date_uses += 1
+            else: # Metric outside an aggregate, or an unknown name
+                return None
+        month_parts = [m for m in _MONTH_PART_RE.finditer(sql_query) if masked.startswith("strftime", m.start())]
+        month_only = date_uses == len(month_parts)
+
+        # --- Smallest rollup that can answer it exactly ---
+        candidates = ["item_day"]
+        if not date_uses or month_only:
+            candidates.append("item_month")
+        if not uses_item:
+            candidates.append("day")
+        table_rows = query_guard.get_table_rows(conn)
+        available = [(table_rows[rollup_table_name(table_name, grain).lower()], rollup_table_name(table_name, grain))
+                     for grain in candidates if rollup_table_name(table_name, grain).lower() in table_rows]
+        if not available:
+            return None
+        rollup = min(available)[1]
+
+        # --- Rewrite: point FROM at the rollup, COUNT(*) becomes the summed row counts ---
+        replacements = [(from_match.start(1), from_match.end(1), rollup if alias else f"{rollup} AS {table_name}")]
+        replacements += [(start, end, "COALESCE(SUM(row_count), 0)") for start, end in count_spans]
+        if count_spans: # Keep the result column names of unaliased items as they were
+            select_end = from_match.start()
+            for start, end in _select_items(masked, masked.index("select") + len("select"), select_end):
+                if not _ALIAS_RE.search(masked[start:end]) and any(start <= s < end for s, _ in count_spans):
+                    label = sql_query[start:end].strip().replace('"', '""')
+                    replacements.append((end, end, f' AS "{label}"'))
+        rewritten = sql_query
+        for start, end, text in sorted(replacements, key=lambda r: (r[0], r[1]), reverse=True):
+            rewritten = rewritten[:start] + text + rewritten[end:]
+        logger.info(f"Routed query to {rollup}: {rewritten}")
+        return RoutedQuery(rewritten, rollup)
+
+    def stats(self) -> Dict[str, object]:
+        with self._lock:
+            return {"enabled": self.enabled, "checked": self.checked, "routed": self.routed,
+                    "served_by": dict(self.served_by)}
+
+
+# Shared by every endpoint that executes generated SQL
+rollup_router = RollupRouter()
@@ -0,0 +1,146 @@
+# app/utils/rule_compiler.py
+# Deterministic fast path: compiles the common question families from the
+# prompt's few-shot block (totals, RoAS, CPC, "which product had the highest X",
+# "top N products by X", optional date range / item filter) straight to SQL.
+# Anything not matched exactly falls through to the LLM.
+import calendar
+import logging
+import re
+import threading
+from typing import Any, Dict, List, Optional, Tuple
+
+from app.utils.query_cache import normalize_question
+
+logger = logging.getLogger(__name__)
+
+# metric phrase -> (table, SQL expression, alias or None for a bare aggregate)
+# Longer phrases are tried first, so "ad sales" wins over "sales".
+METRICS: Dict[str, Tuple[str, str, Optional[str]]] = {
+    "roas return on ad spend": ("ad_sales", "SUM(ad_sales) / NULLIF(SUM(ad_spend), 0)", "RoAS"),
+    "return on ad spend": ("ad_sales", "SUM(ad_sales) / NULLIF(SUM(ad_spend), 0)", "RoAS"),
+    "roas": ("ad_sales", "SUM(ad_sales) / NULLIF(SUM(ad_spend), 0)", "RoAS"),
+    "cpc cost per click": ("ad_sales", "SUM(ad_spend) / NULLIF(SUM(clicks), 0)", "CPC"),
+    "cost per click": ("ad_sales", "SUM(ad_spend) / NULLIF(SUM(clicks), 0)", "CPC"),
+    "cpc": ("ad_sales", "SUM(ad_spend) / NULLIF(SUM(clicks), 0)", "CPC"),
+    "total units ordered": ("total_sales", "SUM(total_units_ordered)", None),
+    "units ordered": ("total_sales", "SUM(total_units_ordered)", None),
+    "total sales": ("total_sales", "SUM(total_sales)", None),
+    "sales": ("total_sales", "SUM(total_sales)", None),
+    "revenue": ("total_sales", "SUM(total_sales)", None),
+    "ad sales": ("ad_sales", "SUM(ad_sales)", None),
+    "ad spend": ("ad_sales", "SUM(ad_spend)", None),
+    "spend": ("ad_sales", "SUM(ad_spend)", None),
+    "clicks": ("ad_sales", "SUM(clicks)", None),
+    "impressions": ("ad_sales", "SUM(impressions)", None),
+    "units sold": ("ad_sales", "SUM(units_sold)", None),
+}
+_METRIC_ALTERNATION = "|".join(re.escape(m) for m in sorted(METRICS, key=len, reverse=True))
+
+MONTHS = {name.lower(): i for i, name in enumerate(calendar.month_name) if name}
+
+# --- Parameter extraction (each match is removed from the question text) ---
+_ISO_DATE = r"\d{4}-\d{2}-\d{2}"
+_DATE_RANGE_RE = re.compile(rf"\b(?:between|from) ({_ISO_DATE}) (?:and|to) ({_ISO_DATE})\b")
+_ON_DATE_RE = re.compile(rf"\bon ({_ISO_DATE})\b")
+_MONTH_RE = re.compile(rf"\b(?:in|during|for) ({'|'.join(MONTHS)})(?: (\d{{4}}))?\b")
+_ITEM_RE = re.compile(r"\b(?:for |of )?(?:item|product)(?: id|_id)? (\d+)\b")
+
+# --- Intents (must match the whole remaining question) ---
+_LEAD = r"(?:what is|what's|whats|what was|show|show me|calculate|compute|get|give me|tell me)?\s*(?:my|the|our)?\s*"
+_TOTAL_RE = re.compile(rf"^{_LEAD}(?:total |overall )?(?P<metric>{_METRIC_ALTERNATION})$")
+_BEST_RE = re.compile(
+    rf"^(?:which|what) (?:product|item)s? (?:had|has|have|with|got)? ?(?:the )?"
+    rf"(?P<direction>highest|lowest|most|least|maximum|minimum|max|min|best|worst|top) (?:total )?(?P<metric>{_METRIC_ALTERNATION})$"
+)
+_TOP_N_RE = re.compile(
+    rf"^(?:show|show me|list|what are|get|give me)?\s*(?:the )?(?P<direction>top|bottom) (?P<n>\d+) (?:products|items)"
+    rf" (?:by|with the (?:highest|most)|with (?:highest|most)) (?:total )?(?P<metric>{_METRIC_ALTERNATION})$"
+)
+_ASCENDING = {"lowest", "least", "minimum", "min", "worst", "bottom"}
+
+
+def _extract_filters(text: str) -> Tuple[str, List[str]]:
+    """Pull date-range and item filters out of the question; returns (remaining text, WHERE conditions)."""
+    conditions = []
+    match = _DATE_RANGE_RE.search(text)
+    if match:
+        conditions.append(f"date BETWEEN '{match.group(1)}' AND '{match.group(2)}'")
+        text = text[:match.start()] + text[match.end():]
+    match = _ON_DATE_RE.search(text)
+    if match:
+        conditions.append(f"date = '{match.group(1)}'")
+        text = text[:match.start()] + text[match.end():]
+    match = _MONTH_RE.search(text)
+    if match:
+        month = MONTHS[match.group(1)]
+        if match.group(2):
+            year = int(match.group(2))
+            last_day = calendar.monthrange(year, month)[1]
+            conditions.append(f"date BETWEEN '{year:04d}-{month:02d}-01' AND '{year:04d}-{month:02d}-{last_day:02d}'")
+        else:
+            conditions.append(f"strftime('%m', date) = '{month:02d}'")
+        text = text[:match.start()] + text[match.end():]
+    match = _ITEM_RE.search(text)
+    if match:
+        conditions.append(f"item_id = {int(match.group(1))}")
+        text = text[:match.start()] + text[match.end():]
+    return re.sub(r"\s+", " ", text).strip(), conditions
+
+
+class RuleCompiler:
+    """Compiles recognised question families to SQL and keeps hit-rate counters."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.attempts = 0
+        self.hits = 0
+        self.hits_by_intent: Dict[str, int] = {}
+
+    def compile(self, question: str) -> Optional[str]:
+        """Return SQL for the question, or None when no rule matches."""
+        result = self._compile(question)
+        with self._lock:
+            self.attempts += 1
+            if result:
+                self.hits += 1
+                self.hits_by_intent[result[0]] = self.hits_by_intent.get(result[0], 0) + 1
+        if result:
+            logger.info(f"Rule '{result[0]}' answered '{question}': {result[1]}")
+            return result[1]
+        return None
+
+    def _compile(self, question: str) -> Optional[Tuple[str, str]]:
+        text, conditions = _extract_filters(normalize_question(question))
+        where = f" WHERE {' AND '.join(conditions)}" if conditions else ""
+
+        match = _TOTAL_RE.match(text)
+        if match:
+            table, expression, alias = METRICS[match.group("metric")]
+            select = f"{expression} AS {alias}" if alias else expression
+            return "total", f"SELECT {select} FROM {table}{where};"
+
+        # Ranking intents: per-item filters make no sense here
+        if any(c.startswith("item_id") for c in conditions):
+            return None
+        match = _BEST_RE.match(text) or _TOP_N_RE.match(text)
+        if match:
+            table, expression, alias = METRICS[match.group("metric")]
+            alias = alias or re.search(r"SUM\((\w+)\)", expression).group(1)
+            # Items without a value (e.g. RoAS with no spend) are not the lowest: SQLite sorts NULL first in ASC
+            order = "ASC NULLS LAST" if match.group("direction") in _ASCENDING else "DESC"
+            limit = int(match.groupdict().get("n") or 1)
+            if limit < 1:
+                return None
+            intent = "top_n" if "n" in match.groupdict() else "best"
+            return intent, (f"SELECT item_id, {expression} AS {alias} FROM {table}{where} "
+                            f"GROUP BY item_id ORDER BY {alias} {order} LIMIT {limit};")
+        return None
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "attempts": self.attempts,
+                "hits": self.hits,
+                "hit_rate": self.hits / self.attempts if self.attempts else 0.0,
+                "hits_by_intent": dict(self.hits_by_intent),
+            }
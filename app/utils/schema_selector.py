@@ -0,0 +1,129 @@
+# app/utils/schema_selector.py
+# Picks the tables/columns a question plausibly needs, so the prompt does not
+# carry the whole schema, and counts prompt tokens for budgeting.
+import logging
+import re
+from typing import Dict, List, Optional, Set, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Extra words that point at a column (beyond the words in its own name)
+COLUMN_SYNONYMS: Dict[str, List[str]] = {
+    "item_id": ["item", "product", "sku", "asin", "id"],
+    "date": ["date", "day", "daily", "week", "month", "when", "trend", "time", "period"],
+    "ad_sales": ["ad sales", "advertising", "attributed", "roas", "acos", "return"],
+    "ad_spend": ["spend", "spent", "cost", "budget", "cpc", "roas", "acos"],
+    "impressions": ["impression", "views", "ctr", "visibility"],
+    "clicks": ["click", "cpc", "ctr"],
+    "units_sold": ["units", "sold", "quantity"],
+    "total_sales": ["total sales", "revenue", "sales", "sold"],
+    "total_units_ordered": ["units", "ordered", "orders", "quantity"],
+    "eligibility": ["eligible", "ineligible", "eligibility", "advertise", "status"],
+    "eligibility_datetime_utc": ["eligible", "ineligible", "eligibility", "checked", "latest", "currently"],
+    "message": ["reason", "why", "message", "explanation"],
+}
+
+# Shown under the table's name in the prompt (data_loader.SNAPSHOT_TABLES are derived tables)
+TABLE_NOTES: Dict[str, str] = {
+    "eligibility_current": "Latest eligibility record of each item_id, one row per item. Use it for current "
+                           "status questions; query the eligibility history only for past or changing status.",
+}
+
+# Columns always kept for a selected table: they are the join/filter keys
+KEY_COLUMNS = {"item_id", "date", "eligibility_datetime_utc"}
+
+_WORD_RE = re.compile(r"[a-z0-9]+")
+
+def _stem(word: str) -> str:
+    return word[:-1] if len(word) > 3 and word.endswith("s") else word
+
+def _words(text: str) -> List[str]:
+    return [_stem(w) for w in _WORD_RE.findall(text.lower())]
+
+# --- Token counting ---
+_encoding = None
+
+def count_tokens(text: str) -> int:
+    """Prompt token count via tiktoken (cl100k_base); ~4 chars/token if it is not installed."""
+    global _encoding
+    if _encoding is None:
+        try:
+            import tiktoken
+            _encoding = tiktoken.get_encoding("cl100k_base")
+        except Exception: # ImportError, or the encoding file cannot be fetched
+            _encoding = False
+    if _encoding:
+        return len(_encoding.encode(text))
+    return max(1, len(text) // 4)
+
+
+class SchemaIndex:
+    """Lexical/synonym index over table and column names, built once per table_info."""
+
+    def __init__(self, table_info: Dict):
+        self.table_info = table_info
+        # column -> (single-word terms, multi-word phrases)
+        self._column_terms: Dict[Tuple[str, str], Tuple[Set[str], List[str]]] = {}
+        for table_name, columns in table_info.items():
+            for col_name, _ in columns:
+                terms = set(_words(col_name.replace("_", " ")))
+                phrases = []
+                for synonym in COLUMN_SYNONYMS.get(col_name, []):
+                    if " " in synonym:
+                        phrases.append(synonym)
+                    else:
+                        terms.add(_stem(synonym))
+                self._column_terms[(table_name, col_name)] = (terms, phrases)
+
+    def column_scores(self, question: str) -> Dict[Tuple[str, str], int]:
+        question_lower = question.lower()
+        question_words = set(_words(question))
+        scores = {}
+        for key, (terms, phrases) in self._column_terms.items():
+            score = len(terms & question_words) + sum(2 for p in phrases if p in question_lower)
+            if score:
+                scores[key] = score
+        return scores
+
+    def select_tables(self, question: str) -> List[str]:
+        """Tables scoring at least half the best table's score; every table if nothing matches."""
+        question_words = set(_words(question))
+        table_scores: Dict[str, int] = {}
+        for (table_name, col_name), score in self.column_scores(question).items():
+            if col_name in KEY_COLUMNS: # Keys are shared by all tables, they say nothing about relevance
+                continue
+            table_scores[table_name] = table_scores.get(table_name, 0) + score
+        for table_name in self.table_info:
+            name_score = len(set(_words(table_name.replace("_", " "))) & question_words)
+            if name_score:
+                table_scores[table_name] = table_scores.get(table_name, 0) + name_score
+        if not table_scores:
+            return list(self.table_info)
+        best = max(table_scores.values())
+        return [t for t in self.table_info if table_scores.get(t, 0) * 2 >= best]
+
+    def select_columns(self, question: str, tables: List[str]) -> Dict[str, List[Tuple[str, str]]]:
+        """Matching columns plus key columns for each table (all columns if none match)."""
+        scores = self.column_scores(question)
+        selected = {}
+        for table_name in tables:
+            columns = self.table_info[table_name]
+            matched = [c for c in columns if c[0] in KEY_COLUMNS or (table_name, c[0]) in scores]
+            if not any((table_name, c[0]) in scores and c[0] not in KEY_COLUMNS for c in columns):
+                matched = list(columns)
+            selected[table_name] = matched
+        return selected
+
+
+def describe_schema(table_info: Dict, tables: Optional[List[str]] = None) -> str:
+    """Schema text for the prompt, restricted to `tables` when given."""
+    schema_desc = "Database Schema:\n"
+    for table_name, columns in table_info.items():
+        if tables is not None and table_name not in tables:
+            continue
+        schema_desc += f"\nTable: {table_name}\n"
+        if table_name in TABLE_NOTES:
+            schema_desc += f"  ({TABLE_NOTES[table_name]})\n"
+        for col_name, col_type in columns:
+            schema_desc += f"  - {col_name} ({col_type})\n"
+    return schema_desc
@@ -0,0 +1,98 @@
+# app/utils/sql_templates.py
+# Literal extraction for parameterized SQL templates: "top 5 products by CPC in June"
+# and "top 10 products by CPC in July" share the shape "top {number} products by cpc
+# in {month}", so one LLM-generated template with :p0/:p1 placeholders serves both.
+import calendar
+import re
+from typing import Any, Dict, List, NamedTuple, Tuple
+
+from app.utils.query_cache import normalize_question
+
+MONTHS = {name.lower(): i for i, name in enumerate(calendar.month_name) if name}
+
+# A month name is only a literal in a date context ("in june", "since march", "3 june",
+# "june 2025"); elsewhere "may" and "march" are ordinary words ("may need", "march ahead")
+_MONTH_NAMES = "|".join(MONTHS)
+_MONTH_AFTER = r"(?:(?<=\bin )|(?<=\bduring )|(?<=\bfor )|(?<=\bsince )|(?<=\d ))"
+
+_LITERAL_RE = re.compile(
+    rf"(?P<date>\b\d{{4}}-\d{{2}}-\d{{2}}\b)"
+    rf"|(?P<month>{_MONTH_AFTER}(?:{_MONTH_NAMES})\b|\b(?:{_MONTH_NAMES})(?= \d))"
+    rf"|(?P<year>\b(?:19|20)\d{{2}}\b)"
+    rf"|(?P<number>\b\d{{1,3}}(?:,\d{{3}})+(?:\.\d+)?\b|\b\d+(?:\.\d+)?\b)"
+)
+_PLACEHOLDER_RE = re.compile(r":(p\d+)\b")
+
+# How each literal kind is described to the model, and how its value is bound
+_KIND_HINTS = {
+    "date": "an ISO date string 'YYYY-MM-DD' (compare with the date column)",
+    "month": "a two-digit month string 'MM' (compare with strftime('%m', date))",
+    "year": "a four-digit year string 'YYYY' (compare with strftime('%Y', date))",
+    "number": "a number (e.g. a LIMIT, an item_id or a threshold)",
+}
+
+
+class Literal(NamedTuple):
+    name: str # Placeholder name, e.g. "p0"
+    kind: str # "date", "month", "year" or "number"
+    text: str # As written in the question
+    value: Any # Value bound to the placeholder
+
+
+def _literal_value(kind: str, text: str) -> Any:
+    if kind == "month":
+        return f"{MONTHS[text]:02d}"
+    if kind == "number":
+        text = text.replace(",", "") # "1,000" is one thousand
+        return float(text) if "." in text else int(text)
+    return text # dates and years are compared as text
+
+
+def extract_literals(question: str) -> Tuple[str, List[Literal]]:
+    """Return (question shape with {kind} placeholders, literals in order of appearance)."""
+    normalized = normalize_question(question)
+    literals: List[Literal] = []
+
+    def replace(match: "re.Match") -> str:
+        kind = match.lastgroup
+        text = match.group(0)
+        literals.append(Literal(f"p{len(literals)}", kind, text, _literal_value(kind, text)))
+        return "{" + kind + "}"
+
+    shape = _LITERAL_RE.sub(replace, normalized)
+    return shape, literals
+
+
+def describe_placeholders(literals: List[Literal]) -> str:
+    """Prompt instructions telling the model which named placeholders to use."""
+    lines = [f"            *   :{lit.name} = {lit.value!r} — from \"{lit.text}\", {_KIND_HINTS[lit.kind]}"
+             for lit in literals]
+    return "\n".join(lines)
+
+
+def placeholders_in(sql: str) -> set:
+    return set(_PLACEHOLDER_RE.findall(sql))
+
+
+def is_reusable_template(sql: str, literals: List[Literal]) -> bool:
+    """A template is reusable only if it uses exactly the placeholders we asked for."""
+    return bool(literals) and placeholders_in(sql) == {lit.name for lit in literals}
+
+
+def bind_params(sql: str, literals: List[Literal]) -> Dict[str, Any]:
+    """Parameters for the placeholders the SQL actually uses."""
+    used = placeholders_in(sql)
+    return {lit.name: lit.value for lit in literals if lit.name in used}
+
+
+def render_sql(sql: str, params: Dict[str, Any]) -> str:
+    """SQL with parameters inlined as quoted literals, for display only (execution binds them)."""
+    def replace(match: "re.Match") -> str:
+        name = match.group(1)
+        if name not in params:
+            return match.group(0)
+        value = params[name]
+        if isinstance(value, (int, float)) and not isinstance(value, bool):
+            return repr(value)
+        return "'" + str(value).replace("'", "''") + "'"
+    return _PLACEHOLDER_RE.sub(replace, sql)
@@ -1,45 +1,360 @@
 
-import google.generativeai as genai
-from typing import Dict, List
+from typing import Any, Dict, List, NamedTuple, Optional, Tuple, Union
+import asyncio
+import contextlib
+import re
+from concurrent.futures import ThreadPoolExecutor
 import os
 from dotenv import load_dotenv
 import logging
 
+from app.utils.query_cache import QueryCache, normalize_question, hash_table_info
+from app.utils.schema_selector import SchemaIndex, describe_schema, count_tokens
+from app.utils.rule_compiler import RuleCompiler
+from app.utils.metrics import StageTimer
+from app.utils.llm_client import build_llm_client, ModelBackend, LLMUnavailableError
+from app.utils.sql_templates import (
+    Literal, extract_literals, describe_placeholders, is_reusable_template, bind_params, render_sql,
+)
+
 load_dotenv()
 logger = logging.getLogger(__name__)
 
+def _env_float(name: str, default: Optional[float]) -> Optional[float]:
+    """Read an optional float setting; 0 or empty disables it."""
+    value = os.getenv(name)
+    if value is None or value == "":
+        return default
+    return float(value) or None
+
+# Few-shot examples shown to the model; also used to check index usage (data_loader.explain_query_plans)
+EXAMPLE_QUERIES = [
+    ("What is my total sales?",
+     "SELECT SUM(total_sales) FROM total_sales;"),
+    ("Calculate the RoAS (Return on Ad Spend).",
+     "SELECT SUM(ad_sales) / NULLIF(SUM(ad_spend), 0) AS RoAS FROM ad_sales;"),
+    ("Which product had the highest CPC (Cost Per Click)?",
+     "SELECT item_id, SUM(ad_spend) / NULLIF(SUM(clicks), 0) AS CPC FROM ad_sales GROUP BY item_id ORDER BY CPC DESC LIMIT 1;"),
+    ("How many products are currently not eligible for advertising?",
+     "SELECT COUNT(*) FROM eligibility_current WHERE eligibility = 0;"),
+]
+
+# Rule 10 of the prompt: how values are stored, per SQL dialect of the analytics engine
+DIALECT_TYPE_NOTES = {
+    "SQLite": "DATE columns hold ISO 'YYYY-MM-DD' text, DATETIME columns hold 'YYYY-MM-DD HH:MM:SS', "
+              "and BOOLEAN columns hold 1 (true) or 0 (false).",
+    "DuckDB": "DATE and TIMESTAMP columns are real date/time types (compare them with 'YYYY-MM-DD' literals; "
+              "strftime(date, '%Y-%m') and date_trunc('month', date) work), and BOOLEAN columns hold true or false.",
+}
+
+class LLMOverloadedError(RuntimeError):
+    """Raised when too many distinct LLM calls are already queued (backpressure)."""
+
+# Packed (several questions per call) answers are split on "-- Q<n>" marker lines
+_BATCH_MARKER_RE = re.compile(r"^\s*--\s*Q(\d+)\s*$", re.MULTILINE)
+
+def _stage(timer: Optional[StageTimer], name: str):
+    """timer.stage(name), or a no-op when the caller is not timing stages"""
+    return timer.stage(name) if timer else contextlib.nullcontext()
+
+class SQLResolution(NamedTuple):
+    sql_query: str # May contain :pN placeholders
+    params: Dict[str, Any] # Values bound to the placeholders at execution time
+    source: str # "rules", "cache", "template", "llm" or "stale_cache" (LLM unavailable)
+
 class TextToSQLAgent:
-    def __init__(self, table_info: Dict, model_name: str = "gemini-2.0-flash"): # CHANGED: Use a more standard model name
+    def __init__(self, table_info: Dict, model_name: str = "gemini-2.0-flash", # CHANGED: Use a more standard model name
+                 sql_cache: Optional[QueryCache] = None, dialect: str = "SQLite"):
         self.table_info = table_info
-        self.api_key = os.getenv("GOOGLE_API_KEY")
-        if not self.api_key:
-            raise ValueError("GOOGLE_API_KEY not found in environment variables.")
-        genai.configure(api_key=self.api_key)
-        # Use the potentially more compatible model name
-        self.model = genai.GenerativeModel(model_name) # CHANGED: Removed specific version
+        self.dialect = dialect # SQL dialect named in the prompt (that of the analytics engine)
+        self.schema_hash = hash_table_info(table_info)
+        # Prompt schema: relevance index and per-table-set descriptions, built once per table_info
+        self.schema_index = SchemaIndex(table_info)
+        self._schema_desc_cache: Dict[tuple, str] = {}
+        self.prompt_token_budget = int(os.getenv("PROMPT_TOKEN_BUDGET", "2000"))
+        self.prompt_tokens_total = 0
+        # Deterministic fast path for the common question families (RULE_FAST_PATH=0 disables)
+        self.rule_compiler = RuleCompiler() if os.getenv("RULE_FAST_PATH", "1") != "0" else None
+        # Question -> SQL cache in front of the LLM call
+        self.sql_cache = sql_cache or QueryCache(
+            max_size=int(os.getenv("SQL_CACHE_SIZE", "1024")),
+            ttl_seconds=_env_float("SQL_CACHE_TTL", 3600.0),
+            persist_path=os.getenv("SQL_CACHE_PATH") or None,
+            save_interval_seconds=float(os.getenv("SQL_CACHE_SAVE_INTERVAL", "5")),
+        )
+        # Question shape (literals stripped) -> parameterized SQL template
+        self.template_cache = QueryCache(
+            max_size=int(os.getenv("SQL_TEMPLATE_CACHE_SIZE", "1024")),
+            ttl_seconds=_env_float("SQL_CACHE_TTL", 3600.0),
+        )
+        # Async path: bounded thread pool for the blocking Gemini client,
+        # plus a map of in-flight calls so identical questions share one call
+        self.max_concurrency = int(os.getenv("LLM_MAX_CONCURRENCY", "8"))
+        self.max_pending = int(os.getenv("LLM_MAX_PENDING", "64"))
+        self._executor = ThreadPoolExecutor(max_workers=self.max_concurrency, thread_name_prefix="llm")
+        self._inflight: Dict[str, asyncio.Future] = {}
+        self.coalesced_count = 0
+        self.rejected_count = 0
+        self.llm_calls = 0
+        self.llm_errors = 0
+        self.completion_tokens_total = 0
+        # Batch path: questions per packed Gemini call (1 disables packing)
+        self.batch_pack_size = int(os.getenv("LLM_BATCH_PACK_SIZE", "8"))
+        self.packed_calls = 0
+        self.packed_questions = 0
+        self.packed_fallbacks = 0
+        # Deadlines, retries, hedging and the circuit breaker around the LLM backend (LLM_BACKEND, default Gemini)
+        self.model_name = model_name # CHANGED: Removed specific version
+        self.llm_client = build_llm_client(model_name)
+        self.stale_served = 0
+
+    @property
+    def model(self):
+        """The backend's model object (Gemini by default), or None for backends without one"""
+        return getattr(self.llm_client.backend, "model", None)
+
+    @model.setter
+    def model(self, model):
+        """Swap in any object with generate_content(prompt), keeping the client's deadline, retries and breaker"""
+        self.llm_client.backend = ModelBackend(model)
 
     def generate_schema_description(self) -> str:
-        """Generate schema description for the AI model"""
-        schema_desc = "Database Schema:\n"
-        for table_name, columns in self.table_info.items():
-            schema_desc += f"\nTable: {table_name}\n"
-            for col_name, col_type in columns:
-                schema_desc += f"  - {col_name} ({col_type})\n"
-        return schema_desc
+        """Generate schema description for the AI model (full schema, precomputed)"""
+        return self._schema_description_for(tuple(self.table_info))
+
+    def cache_key(self, natural_language_query: str) -> str:
+        """Cache key: schema hash plus the normalized question"""
+        return f"{self.schema_hash}:{normalize_question(natural_language_query)}"
+
+    def _resolve_locally(self, natural_language_query: str, literals: List[Literal], template_key: str) -> Optional[SQLResolution]:
+        """Rules, then the exact-question cache, then the template cache; None means ask the LLM"""
+        if self.rule_compiler:
+            rule_sql = self.rule_compiler.compile(natural_language_query)
+            if rule_sql:
+                return SQLResolution(rule_sql, {}, "rules")
+
+        cached = self.sql_cache.get(self.cache_key(natural_language_query))
+        if cached is not None:
+            logger.info(f"SQL cache hit for '{natural_language_query}'")
+            if isinstance(cached, str): # Entry persisted before templates existed
+                return SQLResolution(cached, {}, "cache")
+            return SQLResolution(cached["sql"], cached["params"], "cache")
+
+        if literals:
+            template = self.template_cache.get(template_key)
+            if template is not None:
+                params = bind_params(template, literals)
+                logger.info(f"SQL template hit for '{natural_language_query}' with {params}")
+                self.sql_cache.set(self.cache_key(natural_language_query), {"sql": template, "params": params})
+                return SQLResolution(template, params, "template")
+        return None
+
+    def _store(self, key: str, template_key: str, literals: List[Literal], sql_query: str):
+        """Cache a freshly generated query by exact question, and by shape if it is a clean template"""
+        self.sql_cache.set(key, {"sql": sql_query, "params": bind_params(sql_query, literals)})
+        if is_reusable_template(sql_query, literals):
+            self.template_cache.set(template_key, sql_query)
+        elif literals:
+            logger.info(f"Generated SQL does not use every placeholder, not caching it as a template: {sql_query}")
 
     def generate_sql_query(self, natural_language_query: str) -> str:
-        """Convert natural language to SQL query using Gemini"""
-        schema_desc = self.generate_schema_description()
+        """
+        Convert natural language to SQL query via rules, the caches, or the LLM.
+        Parameters are inlined for display; execution paths should use
+        resolve_sql_query and bind the params instead.
+        """
+        shape, literals = extract_literals(natural_language_query)
+        template_key = f"{self.schema_hash}:{shape}"
+        resolution = self._resolve_locally(natural_language_query, literals, template_key)
+        if resolution is None:
+            try:
+                sql_query = self._generate_sql_with_llm(natural_language_query, literals)
+                self._store(self.cache_key(natural_language_query), template_key, literals, sql_query)
+                resolution = SQLResolution(sql_query, bind_params(sql_query, literals), "llm")
+            except LLMUnavailableError as e:
+                resolution = self._fallback_or_raise(natural_language_query, literals, template_key, e)
+        return render_sql(resolution.sql_query, resolution.params)
+
+    async def resolve_sql_query(self, natural_language_query: str, timer: Optional[StageTimer] = None) -> SQLResolution:
+        """
+        Returns the SQL, its bound parameters and which path answered:
+        "rules" (local compiler), "cache" (same question), "template"
+        (same question shape, new literals bound) or "llm".
+        The LLM call runs on the bounded thread pool; concurrent identical
+        questions await the same call instead of issuing their own.
+        Prompt build and LLM call times are recorded on `timer` if given
+        (a coalesced request records its wait as llm_call).
+        """
+        shape, literals = extract_literals(natural_language_query)
+        template_key = f"{self.schema_hash}:{shape}"
+        resolution = self._resolve_locally(natural_language_query, literals, template_key)
+        if resolution is not None:
+            return resolution
+
+        key = self.cache_key(natural_language_query)
+        future = self._inflight.get(key)
+        joined = future is not None
+        if not joined and self.llm_client.breaker.is_open(): # Fail fast instead of queueing behind the pool
+            return self._fallback_or_raise(natural_language_query, literals, template_key,
+                                           LLMUnavailableError("LLM backend is unhealthy (circuit open); failing fast"))
+        if joined:
+            self.coalesced_count += 1
+            logger.info(f"Coalescing with in-flight LLM call for '{natural_language_query}'")
+        else:
+            if len(self._inflight) >= self.max_pending:
+                self.rejected_count += 1
+                raise LLMOverloadedError(f"Too many pending LLM requests ({len(self._inflight)}), try again later.")
+            loop = asyncio.get_running_loop()
+            future = loop.run_in_executor(self._executor, self._generate_sql_with_llm, natural_language_query, literals, timer)
+            self._inflight[key] = future
+            future.add_done_callback(lambda f: self._finish_inflight(key, template_key, literals, f))
+
+        # Shield so one disconnecting client does not cancel the call the others are waiting on.
+        # The originating call times its own stages in the worker thread.
+        try:
+            with _stage(timer if joined else None, "llm_call"):
+                sql_query = await asyncio.shield(future)
+        except LLMUnavailableError as e:
+            return self._fallback_or_raise(natural_language_query, literals, template_key, e)
+        return SQLResolution(sql_query, bind_params(sql_query, literals), "llm")
+
+    def _fallback_or_raise(self, natural_language_query: str, literals: List[Literal], template_key: str,
+                           error: LLMUnavailableError) -> SQLResolution:
+        """While the LLM is unavailable, serve an expired cache entry for the question or its shape; else re-raise"""
+        cached = self.sql_cache.get(self.cache_key(natural_language_query), allow_stale=True)
+        if cached is not None:
+            resolution = SQLResolution(cached, {}, "stale_cache") if isinstance(cached, str) else \
+                SQLResolution(cached["sql"], cached["params"], "stale_cache")
+        else:
+            template = self.template_cache.get(template_key, allow_stale=True) if literals else None
+            if template is None:
+                raise error
+            resolution = SQLResolution(template, bind_params(template, literals), "stale_cache")
+        self.stale_served += 1
+        logger.warning(f"LLM unavailable ({error}); serving expired cached SQL for '{natural_language_query}'")
+        return resolution
+
+    def _finish_inflight(self, key: str, template_key: str, literals: List[Literal], future: asyncio.Future):
+        """Drop the in-flight entry and cache the SQL if the call succeeded"""
+        self._inflight.pop(key, None)
+        if not future.cancelled() and future.exception() is None:
+            self._store(key, template_key, literals, future.result())
+
+    async def resolve_sql_batch(self, questions: List[str]) -> List[Union[SQLResolution, Exception]]:
+        """
+        Resolve many questions at once, returning one SQLResolution (or the
+        exception) per input question. Duplicates share one resolution;
+        LLM misses are packed several to a Gemini call, and any question whose
+        answer cannot be split out of the packed reply gets its own call, with
+        at most max_concurrency of those running at a time.
+        """
+        unique: Dict[str, str] = {} # cache key -> first spelling of the question
+        for question in questions:
+            unique.setdefault(self.cache_key(question), question)
+
+        resolved: Dict[str, Union[SQLResolution, Exception]] = {}
+        misses = [] # (key, question, literals, template_key)
+        for key, question in unique.items():
+            shape, literals = extract_literals(question)
+            template_key = f"{self.schema_hash}:{shape}"
+            resolution = self._resolve_locally(question, literals, template_key)
+            if resolution is not None:
+                resolved[key] = resolution
+            elif key not in self._inflight: # Already being generated: join it below instead
+                misses.append((key, question, literals, template_key))
+
+        if self.batch_pack_size > 1 and len(misses) > 1:
+            groups = [misses[i:i + self.batch_pack_size] for i in range(0, len(misses), self.batch_pack_size)]
+            for packed in await asyncio.gather(*(self._resolve_packed(group) for group in groups)):
+                resolved.update(packed)
+
+        semaphore = asyncio.Semaphore(self.max_concurrency)
+        async def resolve_one(key: str, question: str):
+            async with semaphore:
+                try:
+                    resolved[key] = await self.resolve_sql_query(question)
+                except Exception as e:
+                    resolved[key] = e
+        await asyncio.gather(*(resolve_one(key, question) for key, question in unique.items() if key not in resolved))
+
+        return [resolved[self.cache_key(question)] for question in questions]
+
+    async def _resolve_packed(self, group: List[Tuple[str, str, List[Literal], str]]) -> Dict[str, SQLResolution]:
+        """One Gemini call for a group of questions; questions missing from the reply are left out"""
+        loop = asyncio.get_running_loop()
+        items = [(question, literals) for _, question, literals, _ in group]
+        try:
+            answers = await loop.run_in_executor(self._executor, self._generate_packed_sql, items)
+        except Exception as e:
+            logger.warning(f"Packed LLM call for {len(group)} questions failed, falling back to one call each: {e}")
+            answers = {}
+
+        resolved = {}
+        for index, (key, question, literals, template_key) in enumerate(group):
+            sql_query = answers.get(index)
+            if sql_query is None:
+                continue
+            self._store(key, template_key, literals, sql_query)
+            resolved[key] = SQLResolution(sql_query, bind_params(sql_query, literals), "llm")
+        self.packed_fallbacks += len(group) - len(resolved)
+        return resolved
+
+    def llm_stats(self) -> Dict[str, int]:
+        """Concurrency counters for the async LLM path"""
+        return {
+            "in_flight": len(self._inflight),
+            "max_concurrency": self.max_concurrency,
+            "max_pending": self.max_pending,
+            "coalesced": self.coalesced_count,
+            "rejected": self.rejected_count,
+            "llm_calls": self.llm_calls,
+            "llm_errors": self.llm_errors,
+            "prompt_tokens_total": self.prompt_tokens_total,
+            "completion_tokens_total": self.completion_tokens_total,
+            "packed_calls": self.packed_calls,
+            "packed_questions": self.packed_questions,
+            "packed_fallbacks": self.packed_fallbacks,
+            "stale_served": self.stale_served,
+        }
+
+    def _render_prompt(self, schema_desc: str, natural_language_query: str, include_examples: bool = True,
+                       literals: Optional[List[Literal]] = None,
+                       batch: Optional[List[Tuple[str, List[Literal]]]] = None) -> str:
+        """
+        Fill the prompt template with a schema description and the question,
+        or with several numbered questions when `batch` is given.
+        """
+        examples = "\n\n        ".join(f"Question: {q}\n        SQL Query: {sql}" for q, sql in EXAMPLE_QUERIES) if include_examples else "(omitted)"
+        task = f"Convert the following natural language question to a SINGLE, valid SQL query for {self.dialect}."
+        question_block = f"Natural Language Question: {natural_language_query}\n\n        SQL Query:"
+        placeholder_rule = ""
+        if literals:
+            placeholder_rule = ("12. Write a parameterized query: use these named placeholders instead of the literal "
+                                "values from the question, and never write the values themselves into the SQL:\n"
+                                + describe_placeholders(literals))
+        if batch:
+            task = (f"Convert EACH of the {len(batch)} numbered natural language questions below to its own SINGLE, "
+                    f"valid SQL query for {self.dialect}.")
+            placeholder_rule = ("12. Answer every question, in order. Start each answer with a line containing only "
+                                "'-- Q<number>' (e.g. '-- Q1'), followed by that question's SQL query. Where a question "
+                                "lists placeholders, write a parameterized query using them instead of the literal values.")
+            blocks = []
+            for number, (question, question_literals) in enumerate(batch, start=1):
+                block = f"Question {number}: {question}"
+                if question_literals:
+                    block += "\n        Placeholders:\n" + describe_placeholders(question_literals)
+                blocks.append(block)
+            question_block = "Natural Language Questions:\n\n        " + "\n\n        ".join(blocks) + "\n\n        SQL Queries:"
 
         # --- IMPROVED PROMPT ---
         prompt = f"""
-        You are an expert SQL query generator for an e-commerce database. Convert the following natural language question to a SINGLE, valid SQL query for SQLite.
+        You are an expert SQL query generator for an e-commerce database. {task}
 
         {schema_desc}
 
         Important Rules:
         1.  ONLY output the SQL query itself. No explanations, markdown, prefixes like '```sql', or extra text.
-        2.  Ensure the query is syntactically correct for SQLite.
+        2.  Ensure the query is syntactically correct for {self.dialect}.
         3.  Use the EXACT table and column names provided in the schema.
         4.  For calculations like RoAS (Return on Ad Spend) and CPC (Cost Per Click), use the following formulas and handle division by zero:
             *   RoAS = SUM(ad_sales) / NULLIF(SUM(ad_spend), 0)
@@ -50,52 +365,142 @@ class TextToSQLAgent:
         7.  For date ranges, use the 'date' column.
         8.  Limit results if explicitly requested (e.g., "top 5" -> LIMIT 5).
         9.  Aggregate functions like SUM, AVG should be used if totals/averages are asked.
-        10. Double-check your output. It MUST start with SELECT, INSERT, UPDATE, or DELETE.
+        10. {DIALECT_TYPE_NOTES.get(self.dialect, DIALECT_TYPE_NOTES['SQLite'])}
+        11. Double-check your output. It MUST be a single read-only query starting with SELECT (or WITH).
+        {placeholder_rule}
 
         Examples:
-        Question: What is my total sales?
-        SQL Query: SELECT SUM(total_sales) FROM total_sales;
+        {examples}
 
-        Question: Calculate the RoAS (Return on Ad Spend).
-        SQL Query: SELECT SUM(ad_sales) / NULLIF(SUM(ad_spend), 0) AS RoAS FROM ad_sales;
+        {question_block}
+        """
+        # --- END IMPROVED PROMPT ---
+        return prompt
 
-        Question: Which product had the highest CPC (Cost Per Click)?
-        SQL Query: SELECT item_id, SUM(ad_spend) / NULLIF(SUM(clicks), 0) AS CPC FROM ad_sales GROUP BY item_id ORDER BY CPC DESC LIMIT 1;
+    def build_prompt(self, natural_language_query: str, literals: Optional[List[Literal]] = None) -> str:
+        """
+        Build the LLM prompt with only the tables the question plausibly needs,
+        trimming columns and then the few-shot examples to fit the token budget.
+        """
+        tables = self.schema_index.select_tables(natural_language_query)
+        schema_desc = self._schema_description_for(tuple(tables))
+        prompt = self._render_prompt(schema_desc, natural_language_query, literals=literals)
+        prompt_tokens = count_tokens(prompt)
 
-        Natural Language Question: {natural_language_query}
+        if self.prompt_token_budget and prompt_tokens > self.prompt_token_budget:
+            columns = self.schema_index.select_columns(natural_language_query, tables)
+            schema_desc = describe_schema(columns)
+            prompt = self._render_prompt(schema_desc, natural_language_query, literals=literals)
+            prompt_tokens = count_tokens(prompt)
+        if self.prompt_token_budget and prompt_tokens > self.prompt_token_budget:
+            prompt = self._render_prompt(schema_desc, natural_language_query, include_examples=False, literals=literals)
+            prompt_tokens = count_tokens(prompt)
+            if prompt_tokens > self.prompt_token_budget:
+                logger.warning(f"Prompt for '{natural_language_query}' is {prompt_tokens} tokens, over the budget of {self.prompt_token_budget}")
 
-        SQL Query:
-        """
-        # --- END IMPROVED PROMPT ---
+        self.prompt_tokens_total += prompt_tokens
+        logger.info(f"Prompt for '{natural_language_query}': {prompt_tokens} tokens, tables={tables}")
+        return prompt
+
+    def _schema_description_for(self, tables: tuple) -> str:
+        """Schema text for a set of tables, computed once per table_info"""
+        schema_desc = self._schema_desc_cache.get(tables)
+        if schema_desc is None:
+            schema_desc = describe_schema(self.table_info, list(tables))
+            self._schema_desc_cache[tables] = schema_desc
+        return schema_desc
+
+    def _clean_sql(self, natural_language_query: str, raw_sql_query: str) -> str:
+        """Strip markdown fences from model output and check it starts with a SQL keyword"""
+        # --- IMPROVED CLEANUP ---
+        # Basic cleanup if model adds markdown or extra text
+        sql_query = raw_sql_query.strip()
+        if sql_query.lower().startswith("```sql"):
+            sql_query = sql_query[6:] # Remove ```sql
+        if sql_query.endswith("```"):
+            sql_query = sql_query[:-3] # Remove ```
+        # Remove any leading/trailing whitespace again
+        sql_query = sql_query.strip()
+
+        # --- CRITICAL: Validate it starts with a keyword ---
+        valid_start_keywords = ("select", "with") # The query guard only runs read-only queries
+        if not sql_query.lower().startswith(valid_start_keywords):
+             # Log the problematic query for debugging
+             logger.warning(f"LLM generated invalid SQL start for '{natural_language_query}': {raw_sql_query}")
+             # Raise an error or return a default/error query
+             raise ValueError(f"Invalid SQL query generated (doesn't start with SELECT/WITH): {sql_query[:50]}...")
+        # --- END IMPROVED CLEANUP ---
+        return sql_query
+
+    def _generate_sql_with_llm(self, natural_language_query: str, literals: Optional[List[Literal]] = None,
+                               timer: Optional[StageTimer] = None) -> str:
+        """Convert natural language to SQL query using Gemini (a :pN template when literals are given)"""
+        with _stage(timer, "prompt_build"):
+            prompt = self.build_prompt(natural_language_query, literals)
 
         try:
-            response = self.model.generate_content(prompt)
-            # Get the text content from the response object
-            raw_sql_query = response.text.strip() if response.text else ""
-
-            # --- IMPROVED CLEANUP ---
-            # Basic cleanup if model adds markdown or extra text
-            sql_query = raw_sql_query
-            if sql_query.lower().startswith("```sql"):
-                sql_query = sql_query[6:] # Remove ```sql
-            if sql_query.endswith("```"):
-                sql_query = sql_query[:-3] # Remove ```
-            # Remove any leading/trailing whitespace again
-            sql_query = sql_query.strip()
-
-            # --- CRITICAL: Validate it starts with a keyword ---
-            valid_start_keywords = ("select", "insert", "update", "delete", "with")
-            if not sql_query.lower().startswith(valid_start_keywords):
-                 # Log the problematic query for debugging
-                 logger.warning(f"LLM generated invalid SQL start for '{natural_language_query}': {raw_sql_query}")
-                 # Raise an error or return a default/error query
-                 raise ValueError(f"Invalid SQL query generated (doesn't start with SELECT/INSERT/UPDATE/DELETE): {sql_query[:50]}...")
-            # --- END IMPROVED CLEANUP ---
+            self.llm_calls += 1
+            with _stage(timer, "llm_call"):
+                raw_sql_query = self.llm_client.generate(prompt).strip()
+            self.completion_tokens_total += count_tokens(raw_sql_query)
+            sql_query = self._clean_sql(natural_language_query, raw_sql_query)
 
             logger.info(f"Generated SQL for '{natural_language_query}': {sql_query}")
             return sql_query
         except Exception as e:
+            self.llm_errors += 1
             logger.error(f"Error generating SQL for '{natural_language_query}': {str(e)}")
             # Re-raise the error so the API endpoint can handle it properly
             raise e
         
+
+    def build_batch_prompt(self, items: List[Tuple[str, List[Literal]]]) -> str:
+        """Prompt for several questions at once, over the union of the tables they need"""
+        tables = set()
+        for question, _ in items:
+            tables.update(self.schema_index.select_tables(question))
+        tables = tuple(t for t in self.table_info if t in tables)
+        schema_desc = self._schema_description_for(tables)
+        prompt = self._render_prompt(schema_desc, "", batch=items)
+        prompt_tokens = count_tokens(prompt)
+        if self.prompt_token_budget and prompt_tokens > self.prompt_token_budget * len(items):
+            prompt = self._render_prompt(schema_desc, "", include_examples=False, batch=items)
+            prompt_tokens = count_tokens(prompt)
+
+        self.prompt_tokens_total += prompt_tokens
+        logger.info(f"Packed prompt for {len(items)} questions: {prompt_tokens} tokens, tables={list(tables)}")
+        return prompt
+
+    def _generate_packed_sql(self, items: List[Tuple[str, List[Literal]]]) -> Dict[int, str]:
+        """
+        One Gemini call for several questions. Returns {index: sql} for every
+        answer that could be split out and validated; the rest are omitted.
+        """
+        prompt = self.build_batch_prompt(items)
+        self.llm_calls += 1
+        self.packed_calls += 1
+        self.packed_questions += len(items)
+        try:
+            raw_text = self.llm_client.generate(prompt).strip()
+        except Exception:
+            self.llm_errors += 1
+            raise
+        self.completion_tokens_total += count_tokens(raw_text)
+
+        markers = list(_BATCH_MARKER_RE.finditer(raw_text))
+        answers: Dict[int, str] = {}
+        for i, marker in enumerate(markers):
+            index = int(marker.group(1)) - 1
+            end = markers[i + 1].start() if i + 1 < len(markers) else len(raw_text)
+            if not 0 <= index < len(items) or index in answers:
+                logger.warning(f"Packed reply has an unexpected or repeated marker '{marker.group(0).strip()}', ignoring it")
+                continue
+            question = items[index][0]
+            try:
+                answers[index] = self._clean_sql(question, raw_text[marker.end():end])
+                logger.info(f"Generated SQL for '{question}' (packed): {answers[index]}")
+            except ValueError:
+                continue
+        if len(answers) < len(items):
+            logger.warning(f"Packed reply answered {len(answers)} of {len(items)} questions")
+        return answers
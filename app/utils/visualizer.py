@@ -1,29 +1,33 @@
 # app/utils/visualizer.py
-import matplotlib.pyplot as plt
-import matplotlib
-import plotly.express as px
-import plotly.graph_objects as go
-import plotly.io as pio
-import pandas as pd
 import io
 import base64
-from typing import List, Dict, Any, Tuple, Optional
+from typing import List, Dict, Any, Tuple, Optional, TYPE_CHECKING
 import logging
-# --- Import for serialization fix ---
-import numpy as np
-from collections.abc import Iterable
-# --- End Import for serialization fix ---
 
-# Use non-interactive backend for server-side generation
-matplotlib.use('Agg')
+# matplotlib, plotly, pandas and numpy are imported lazily: the default chart
+# path (build_chart_spec) needs none of them, and they dominate import time.
+if TYPE_CHECKING:
+    import matplotlib.pyplot as plt
+    import plotly.graph_objects as go
+    import pandas as pd
+
 logger = logging.getLogger(__name__)
 
+def _pyplot():
+    """Imports pyplot on first use, with the non-interactive backend for server-side generation."""
+    import matplotlib
+    matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
+    return plt
+
 # --- Helper function to make data JSON serializable (ADDED) ---
 def make_serializable(obj):
     """
     Recursively converts NumPy types and other non-serializable objects
     within a data structure (dict, list, etc.) to native Python types.
     """
+    import numpy as np
+    import pandas as pd
     if isinstance(obj, dict):
         return {key: make_serializable(value) for key, value in obj.items()}
     elif isinstance(obj, list):
@@ -55,8 +59,9 @@ def make_serializable(obj):
 
 # --- Matplotlib Helper Functions (for static images) ---
 # (These functions remain largely unchanged, kept for completeness/future use)
-def _create_matplotlib_fig(data: pd.DataFrame, chart_type: str, title: str) -> Optional[plt.Figure]:
+def _create_matplotlib_fig(data: "pd.DataFrame", chart_type: str, title: str) -> Optional["plt.Figure"]:
     """Creates a matplotlib figure based on data and chart type."""
+    plt = _pyplot()
     fig, ax = plt.subplots(figsize=(10, 6))
 
     try:
@@ -94,32 +99,41 @@ def _create_matplotlib_fig(data: pd.DataFrame, chart_type: str, title: str) -> O
         plt.close(fig)
         return None
 
+def _matplotlib_image(df: "pd.DataFrame", chart_type: str, title: str, image_format: str = "png") -> Optional[bytes]:
+    """Renders the matplotlib chart to PNG or SVG bytes (pyplot state: one render at a time per process)."""
+    fig = _create_matplotlib_fig(df, chart_type, title)
+    if fig is None:
+        return None
+    try:
+        buf = io.BytesIO()
+        fig.savefig(buf, format=image_format)
+        return buf.getvalue()
+    finally:
+        _pyplot().close(fig)
+
 def create_matplotlib_chart_base64(data: List[Dict[str, Any]], chart_type: str, title: str) -> Optional[str]:
     """Creates a chart using matplotlib and returns it as a base64 PNG string."""
     if not data:
         return None
+    import pandas as pd
     try:
         df = pd.DataFrame(data)
         if df.empty:
              return None
 
-        fig = _create_matplotlib_fig(df, chart_type, title)
-        if fig is None:
+        img_bytes = _matplotlib_image(df, chart_type, title)
+        if img_bytes is None:
             return None
-
-        buf = io.BytesIO()
-        fig.savefig(buf, format='png')
-        buf.seek(0)
-        img_base64 = base64.b64encode(buf.read()).decode('utf-8')
-        plt.close(fig)
-        return img_base64
+        return base64.b64encode(img_bytes).decode('utf-8')
     except Exception as e:
         logger.error(f"Error generating Matplotlib chart base64: {e}")
         return None
 
 # --- Plotly Helper Functions (for interactive or static images) ---
-def _create_plotly_fig(data: pd.DataFrame, chart_type: str, title: str) -> Optional[go.Figure]:
+def _create_plotly_fig(data: "pd.DataFrame", chart_type: str, title: str) -> Optional["go.Figure"]:
     """Creates a Plotly figure based on data and chart type."""
+    import pandas as pd
+    import plotly.express as px
     try:
         if chart_type == "bar" and len(data.columns) >= 2:
             x_col, y_col = data.columns[0], data.columns[1]
@@ -156,6 +170,7 @@ def create_plotly_chart_json(data: List[Dict[str, Any]], chart_type: str, title:
     """Creates a chart using Plotly and returns it as a JSON-serializable dict (for interactive)."""
     if not data:
         return None
+    import pandas as pd
     try:
         df = pd.DataFrame(data)
         if df.empty:
@@ -183,6 +198,8 @@ def create_plotly_chart_base64(data: List[Dict[str, Any]], chart_type: str, titl
     """Creates a chart using Plotly and returns it as a base64 PNG string."""
     if not data:
         return None
+    import pandas as pd
+    import plotly.io as pio
     try:
         df = pd.DataFrame(data)
         if df.empty:
@@ -199,23 +216,67 @@ def create_plotly_chart_base64(data: List[Dict[str, Any]], chart_type: str, titl
         logger.error(f"Error generating Plotly chart base64: {e}")
         return None
 
-# --- Main Visualization Logic ---
-def determine_chart_type_and_generate(question: str, results: List[Dict[str, Any]]) -> Tuple[Optional[Dict[str, Any]], Optional[str]]:
-    """
-    Determines the appropriate chart type based on the question and results,
-    and generates the chart data.
-    Returns: (chart_data_dict, chart_type_string)
-    chart_data_dict can be Plotly JSON or {'image': 'base64string'}
-    chart_type_string describes the type (e.g., 'bar', 'line', 'pie')
-    """
-    if not results:
-        return None, None
+# --- Static images (PNG/SVG), rendered by utils/chart_renderer.py's worker processes ---
+IMAGE_RENDERERS = ("matplotlib", "plotly")
 
-    question_lower = question.lower()
-    num_results = len(results)
-    num_columns = len(results[0]) if results else 0
+def render_chart_image(columns: List[str], rows: List[tuple], chart_type: str, title: str,
+                       image_format: str = "png", renderer: str = "matplotlib") -> Optional[bytes]:
+    """Renders query results as a PNG or SVG image with matplotlib or Plotly (kaleido); None if it cannot be charted."""
+    import pandas as pd
+    df = pd.DataFrame(rows, columns=list(columns))
+    if df.empty:
+        return None
+    if renderer == "plotly":
+        import plotly.io as pio
+        fig = _create_plotly_fig(df, chart_type, title)
+        return pio.to_image(fig, format=image_format) if fig is not None else None
+    return _matplotlib_image(df, chart_type, title, image_format)
 
-    # --- Determine Chart Type ---
+# --- Lightweight Plotly spec builder ---
+# Emits the minimal Plotly JSON for our chart types straight from column arrays:
+# no DataFrame, no figure object, no default template, no make_serializable walk.
+def _axis_title(text: str) -> Dict[str, Any]:
+    return {"title": {"text": text}}
+
+def build_chart_spec(columns: List[str], column_data: List[list], chart_type: str, title: str) -> Optional[Dict[str, Any]]:
+    """Builds a Plotly-compatible figure dict from column names and per-column value lists."""
+    if len(columns) < 2 or not column_data or not column_data[0]:
+        logger.warning(f"Unsupported chart type '{chart_type}' or insufficient data columns for chart spec.")
+        return None
+    x_col, y_col = columns[0], columns[1]
+    xs, ys = list(column_data[0]), list(column_data[1])
+    hovertemplate = f"{x_col}=%{{x}}<br>{y_col}=%{{y}}<extra></extra>"
+    layout = {"title": {"text": title}, "xaxis": _axis_title(x_col), "yaxis": _axis_title(y_col)}
+
+    if chart_type == "bar":
+        trace = {"type": "bar", "x": xs, "y": ys, "orientation": "v", "hovertemplate": hovertemplate}
+    elif chart_type == "line":
+        trace = {"type": "scatter", "mode": "lines+markers", "x": xs, "y": ys, "hovertemplate": hovertemplate}
+    elif chart_type == "scatter":
+        trace = {"type": "scatter", "mode": "markers", "x": xs, "y": ys, "hovertemplate": hovertemplate}
+        if len(columns) >= 3:
+            sizes = column_data[2]
+            numeric = [v for v in sizes if isinstance(v, (int, float)) and not isinstance(v, bool)]
+            if len(numeric) == len(sizes) and max(numeric, default=0) > 0:
+                max_size = max(numeric)
+                trace["marker"] = {"size": [v / max_size * 30 for v in numeric]}
+    elif chart_type == "pie":
+        pairs = [(label, value) for label, value in zip(xs, ys) if isinstance(value, (int, float)) and value > 0]
+        if not pairs:
+            logger.warning("No positive values for pie chart (spec).")
+            return None
+        trace = {"type": "pie", "labels": [p[0] for p in pairs], "values": [p[1] for p in pairs],
+                 "hovertemplate": f"{x_col}=%{{label}}<br>{y_col}=%{{value}}<extra></extra>"}
+        layout = {"title": {"text": title}}
+    else:
+        logger.warning(f"Unsupported chart type '{chart_type}' for chart spec.")
+        return None
+    return {"data": [trace], "layout": layout}
+
+# --- Main Visualization Logic ---
+def determine_chart_type(question: str, num_results: int, num_columns: int) -> Optional[str]:
+    """Picks a chart type from the question wording and the result shape."""
+    question_lower = question.lower()
     chart_type = None
     if "trend" in question_lower or "over time" in question_lower:
         chart_type = "line"
@@ -229,6 +290,47 @@ def determine_chart_type_and_generate(question: str, results: List[Dict[str, Any
     elif num_results == 1 and num_columns >= 2:
          chart_type = "bar"
     # Add more rules as needed...
+    return chart_type
+
+def generate_chart(question: str, columns: List[str], rows: List[tuple],
+                   chart_type: Optional[str] = None) -> Tuple[Optional[Dict[str, Any]], Optional[str]]:
+    """
+    Determines the chart type (unless given) and builds the chart spec
+    directly from the query's columns and row tuples.
+    Returns: (chart_data_dict, chart_type_string)
+    """
+    if not rows:
+        return None, None
+    chart_type = chart_type or determine_chart_type(question, len(rows), len(columns))
+    if not chart_type:
+        logger.info("Could not determine a suitable chart type for the results.")
+        return None, None
+
+    column_data = [list(values) for values in zip(*rows)]
+    chart_data = build_chart_spec(list(columns), column_data, chart_type, f"Visualization for: {question}")
+    if chart_data is None:
+        logger.info(f"Failed to generate chart data for type '{chart_type}'.")
+        return None, chart_type
+    logger.info(f"Generated chart data of type '{chart_type}' for question: {question}")
+    return chart_data, chart_type
+
+def determine_chart_type_and_generate(question: str, results: List[Dict[str, Any]]) -> Tuple[Optional[Dict[str, Any]], Optional[str]]:
+    """
+    Determines the appropriate chart type based on the question and results,
+    and generates the chart data with the full plotly.express figure.
+    Returns: (chart_data_dict, chart_type_string)
+    chart_data_dict can be Plotly JSON or {'image': 'base64string'}
+    chart_type_string describes the type (e.g., 'bar', 'line', 'pie')
+    Prefer generate_chart, which skips the figure build.
+    """
+    if not results:
+        return None, None
+
+    num_results = len(results)
+    num_columns = len(results[0]) if results else 0
+
+    # --- Determine Chart Type ---
+    chart_type = determine_chart_type(question, num_results, num_columns)
 
     if not chart_type:
         logger.info("Could not determine a suitable chart type for the results.")
@@ -0,0 +1,82 @@
+# benchmarks/bench_db_pool.py
+# Queries/sec of the old per-request ORM Session on a default engine vs the
+# tuned read-only connection pool (app.database.readonly_engine).
+#
+#   python -m benchmarks.bench_db_pool --queries 2000 --threads 4
+#
+# Uses the database at DATABASE_URL / DB_SNAPSHOT_PATH, so start the app (or
+# build a snapshot) once first. The result cache is bypassed on purpose.
+import argparse
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from sqlalchemy import create_engine, text
+from sqlalchemy.orm import sessionmaker
+
+from app.database import DATABASE_URL, readonly_engine
+from app.utils.text_to_sql import EXAMPLE_QUERIES
+
+QUERIES = [sql for _, sql in EXAMPLE_QUERIES] + [
+    "SELECT date, SUM(ad_sales) AS ad_sales FROM ad_sales GROUP BY date ORDER BY date;",
+    "SELECT * FROM ad_sales WHERE item_id = 3;",
+]
+
+
+def make_session_runner():
+    """Before: default engine, new ORM Session per query (what get_db did)"""
+    engine = create_engine(DATABASE_URL, connect_args={"check_same_thread": False})
+    session_factory = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+
+    def run(sql: str):
+        db = session_factory()
+        try:
+            return db.execute(text(sql)).fetchall()
+        finally:
+            db.close()
+    return run, engine
+
+
+def make_pool_runner():
+    """After: pooled read-only connection with the pragmas set at connect time"""
+    def run(sql: str):
+        with readonly_engine.connect() as conn:
+            return conn.execute(text(sql)).fetchall()
+    return run, readonly_engine
+
+
+def bench(run, queries: int, threads: int) -> float:
+    """Queries per second for `queries` executions spread over `threads` threads"""
+    workload = [QUERIES[i % len(QUERIES)] for i in range(queries)]
+    for sql in QUERIES: # Warm up connections and the page cache
+        run(sql)
+    start = time.perf_counter()
+    if threads == 1:
+        for sql in workload:
+            run(sql)
+    else:
+        with ThreadPoolExecutor(max_workers=threads) as pool:
+            list(pool.map(run, workload))
+    return queries / (time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the read-only SQLite connection pool")
+    parser.add_argument("--queries", type=int, default=2000)
+    parser.add_argument("--threads", type=int, default=1)
+    args = parser.parse_args()
+
+    print(f"{args.queries} queries over {args.threads} thread(s), database {DATABASE_URL}")
+    print(f"{'setup':<34}{'queries/s':>12}")
+    baseline = None
+    for name, factory in [("session per request (before)", make_session_runner),
+                          ("read-only pool (after)", make_pool_runner)]:
+        run, engine = factory()
+        qps = bench(run, args.queries, args.threads)
+        baseline = baseline or qps
+        print(f"{name:<34}{qps:>12.0f}   ({qps / baseline:.2f}x)")
+        if engine is not readonly_engine:
+            engine.dispose()
+
+
+if __name__ == "__main__":
+    main()
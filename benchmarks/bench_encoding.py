@@ -0,0 +1,71 @@
+# benchmarks/bench_encoding.py
+# Compares encode time and payload size of the /ask response formats.
+#
+#   python -m benchmarks.bench_encoding --rows 100000
+import argparse
+import random
+import time
+
+from app.schemas import QueryResult
+from app.utils.encoders import to_row_dicts, to_columnar, dumps_json, arrow_available, encode_arrow_ipc
+
+COLUMNS = ["date", "item_id", "ad_sales", "impressions", "ad_spend", "clicks", "units_sold"]
+
+
+def make_rows(n: int):
+    rng = random.Random(42)
+    return [
+        (f"2025-06-{rng.randint(1, 30):02d}", rng.randint(0, 500), round(rng.uniform(0, 500), 2),
+         rng.randint(0, 5000), round(rng.uniform(0, 50), 2), rng.randint(0, 50), rng.randint(0, 10))
+        for _ in range(n)
+    ]
+
+
+def encode_rows_validated(rows):
+    """Today's path: list of dicts, QueryResult validation, JSON serialization."""
+    result = QueryResult(question="q", sql_query="SELECT ...", results=to_row_dicts(COLUMNS, rows))
+    return result.model_dump_json().encode("utf-8")
+
+
+def encode_columnar(rows):
+    payload = {"question": "q", "sql_query": "SELECT ..."}
+    payload.update(to_columnar(COLUMNS, rows))
+    return dumps_json(payload)
+
+
+def encode_arrow(rows):
+    return encode_arrow_ipc(COLUMNS, rows, {"question": "q", "sql_query": "SELECT ..."})
+
+
+def bench(fn, rows, repeat: int):
+    best = float("inf")
+    payload = b""
+    for _ in range(repeat):
+        start = time.perf_counter()
+        payload = fn(rows)
+        best = min(best, time.perf_counter() - start)
+    return best, len(payload)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark /ask response encodings")
+    parser.add_argument("--rows", type=int, default=100_000)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    rows = make_rows(args.rows)
+    formats = [("rows (validated)", encode_rows_validated), ("columnar (fast json)", encode_columnar)]
+    if arrow_available():
+        formats.append(("arrow ipc", encode_arrow))
+
+    print(f"{args.rows} rows x {len(COLUMNS)} columns, best of {args.repeat}")
+    print(f"{'format':<24}{'encode ms':>12}{'payload KiB':>14}")
+    baseline = None
+    for name, fn in formats:
+        seconds, size = bench(fn, rows, args.repeat)
+        baseline = baseline or seconds
+        print(f"{name:<24}{seconds * 1000:>12.1f}{size / 1024:>14.1f}   ({baseline / seconds:.1f}x)")
+
+
+if __name__ == "__main__":
+    main()
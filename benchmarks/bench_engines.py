@@ -0,0 +1,103 @@
+# benchmarks/bench_engines.py
+# SQLite vs DuckDB (app/utils/analytics_engine.py) on the same synthetic data:
+# ingestion time, then the prompt's example query shapes and the recorded
+# queries, each run through the engine's guarded execute() with the result
+# cache off. Also checks that both engines return the same rows.
+#
+#   python -m benchmarks.bench_engines --rows 10000000 --repeat 3
+import argparse
+import logging
+import os
+import time
+
+from benchmarks.run_suite import prepare_data, summarize
+
+
+def configure_environment(args, database_path: str, duckdb_path: str):
+    """Before any app import: both engines' files, no result cache, a generous time limit"""
+    os.environ["DATABASE_URL"] = f"sqlite:///{database_path}"
+    os.environ.pop("DB_SNAPSHOT_PATH", None)
+    os.environ["DUCKDB_PATH"] = duckdb_path
+    os.environ["RESULT_CACHE_MAX_BYTES"] = "0"
+    os.environ["QUERY_TIMEOUT_SECONDS"] = str(args.timeout)
+    os.environ.setdefault("GOOGLE_API_KEY", "offline-benchmark") # Imported with the agent module, never used
+
+
+def _comparable(rows):
+    """Rows in a canonical order with floats rounded, so both engines' answers can be compared"""
+    return sorted(tuple(round(v, 4) if isinstance(v, float) else v for v in row) for row in rows)
+
+def time_queries(engine, queries, repeat: int):
+    """name -> (latencies, rows) for each query, after one warm-up run"""
+    results = {}
+    with engine.connect() as conn:
+        for name, sql in queries:
+            try:
+                _, rows, _ = engine.execute(conn, sql)
+                samples = []
+                for _ in range(repeat):
+                    start = time.perf_counter()
+                    _, rows, _ = engine.execute(conn, sql)
+                    samples.append(time.perf_counter() - start)
+                results[name] = (samples, rows)
+            except Exception as e:
+                print(f"  {engine.name}: '{name}' failed: {e}")
+                results[name] = None
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare the SQLite and DuckDB analytics engines on synthetic data")
+    parser.add_argument("--rows", type=int, default=10_000_000, help="Synthetic ad_sales rows")
+    parser.add_argument("--days", type=int, default=365)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--work-dir", default="benchmarks/.data", help="Generated CSVs and both engines' files")
+    parser.add_argument("--repeat", type=int, default=3, help="Timed runs per query and engine")
+    parser.add_argument("--timeout", type=float, default=300.0, help="QUERY_TIMEOUT_SECONDS for the run")
+    parser.add_argument("--queries", default=None, help="Recorded question/SQL pairs (JSON)")
+    args = parser.parse_args()
+
+    data_dir = prepare_data(args)
+    database_path = os.path.abspath(os.path.join(args.work_dir, f"bench_{args.rows}.db"))
+    duckdb_path = os.path.abspath(os.path.join(args.work_dir, f"bench_{args.rows}.duckdb"))
+    configure_environment(args, database_path, duckdb_path)
+    logging.basicConfig(level=logging.ERROR) # Per-query logs and truncation warnings would drown the table
+    from app.utils.analytics_engine import SQLiteEngine, DuckDBEngine
+    from app.utils.data_loader import initialize_database
+    from app.utils.text_to_sql import EXAMPLE_QUERIES
+    from benchmarks.replay_llm import load_recorded_queries, RECORDED_QUERIES_PATH
+
+    engines = [SQLiteEngine(), DuckDBEngine(duckdb_path)]
+    print("Ingestion (unchanged files are skipped, delete the files under --work-dir to reload) ...")
+    for engine, ingest in [(engines[0], lambda: initialize_database(data_dir, f"sqlite:///{database_path}").dispose()),
+                           (engines[1], lambda: engines[1].ingest(data_dir))]:
+        start = time.perf_counter()
+        ingest()
+        print(f"  {engine.name:<8}{time.perf_counter() - start:>10.1f}s")
+
+    queries = [(q, sql) for q, sql in EXAMPLE_QUERIES]
+    queries += [(q, sql) for q, sql in load_recorded_queries(args.queries or RECORDED_QUERIES_PATH)
+                if (q, sql) not in EXAMPLE_QUERIES]
+    timings = {engine.name: time_queries(engine, queries, args.repeat) for engine in engines}
+
+    print(f"\n{args.rows:,} ad_sales rows, {args.repeat} runs per query (p50 ms)")
+    print(f"{'query':<60}{'sqlite':>10}{'duckdb':>10}{'speedup':>9}  same rows")
+    totals = {engine.name: [] for engine in engines}
+    for name, _ in queries:
+        sqlite_run, duckdb_run = timings["sqlite"][name], timings["duckdb"][name]
+        if sqlite_run is None or duckdb_run is None:
+            print(f"{name[:58]:<60}{'failed':>10}")
+            continue
+        sqlite_p50, duckdb_p50 = summarize(sqlite_run[0])["p50_ms"], summarize(duckdb_run[0])["p50_ms"]
+        totals["sqlite"] += sqlite_run[0]
+        totals["duckdb"] += duckdb_run[0]
+        same = _comparable(sqlite_run[1]) == _comparable(duckdb_run[1])
+        print(f"{name[:58]:<60}{sqlite_p50:>10.1f}{duckdb_p50:>10.1f}{sqlite_p50 / duckdb_p50 if duckdb_p50 else 0:>8.1f}x  {'yes' if same else 'NO'}")
+    for engine_name, samples in totals.items():
+        summary = summarize(samples)
+        print(f"{engine_name:<8} all queries: {summary['throughput_per_s']:.2f} queries/s, "
+              f"p50 {summary['p50_ms']:.1f}ms, p95 {summary['p95_ms']:.1f}ms, max {summary['max_ms']:.1f}ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,86 @@
+# benchmarks/bench_llm_client.py
+# Tail latency and outage behaviour of the resilient LLM client against the
+# local fake LLM server (benchmarks/fake_llm_server.py), started in-process:
+#   1. slow tail: a plain client (no hedging, no retries) vs the hedged client
+#   2. outage: every call fails; shows how quickly the circuit breaker fails fast
+#
+#   python -m benchmarks.bench_llm_client --calls 400 --threads 8 --slow-rate 0.05 --slow-ms 3000
+import argparse
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from app.utils.llm_client import LLMClient, HTTPBackend, CircuitBreaker
+from benchmarks.fake_llm_server import start_server
+from benchmarks.replay_llm import ReplayModel, load_recorded_queries
+from benchmarks.run_suite import summarize
+
+
+def run_calls(client: LLMClient, prompts, threads: int):
+    """(latencies of successful calls, latencies of failed calls, wall seconds)"""
+    ok, failed = [], []
+
+    def call(prompt: str):
+        start = time.perf_counter()
+        try:
+            client.generate(prompt)
+            ok.append(time.perf_counter() - start)
+        except Exception:
+            failed.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=threads) as pool:
+        list(pool.map(call, prompts))
+    return ok, failed, time.perf_counter() - start
+
+
+def print_row(name: str, ok, failed, wall: float):
+    summary = summarize(ok, wall)
+    print(f"{name:<28}{len(ok):>6}{len(failed):>8}{summary['throughput_per_s']:>10.1f}"
+          f"{summary['p50_ms']:>10.0f}{summary['p95_ms']:>10.0f}{summary['p99_ms']:>10.0f}{summary['max_ms']:>10.0f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark hedging and the circuit breaker against a fake LLM")
+    parser.add_argument("--calls", type=int, default=400)
+    parser.add_argument("--threads", type=int, default=8)
+    parser.add_argument("--latency-ms", type=float, default=100.0)
+    parser.add_argument("--jitter-ms", type=float, default=50.0)
+    parser.add_argument("--slow-rate", type=float, default=0.05, help="Share of calls in the slow tail")
+    parser.add_argument("--slow-ms", type=float, default=3000.0)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.ERROR) # Per-attempt warnings would drown the table
+
+    pairs = load_recorded_queries()
+    model = ReplayModel(pairs, latency_ms=args.latency_ms, jitter_ms=args.jitter_ms,
+                        slow_rate=args.slow_rate, slow_ms=args.slow_ms)
+    server = start_server(model)
+    url = f"http://127.0.0.1:{server.server_address[1]}/generate"
+    prompts = [f"Natural Language Question: {pairs[i % len(pairs)][0]}\n\nSQL Query:" for i in range(args.calls)]
+
+    print(f"{args.calls} calls over {args.threads} threads; {args.slow_rate:.0%} of calls take {args.slow_ms:.0f}ms")
+    print(f"{'client':<28}{'ok':>6}{'failed':>8}{'calls/s':>10}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'max ms':>10}")
+    plain = LLMClient(HTTPBackend(url), deadline_seconds=60, attempt_timeout=60, max_retries=0, hedge=False)
+    print_row("plain (before)", *run_calls(plain, prompts, args.threads))
+    hedged = LLMClient(HTTPBackend(url), hedge_initial_delay=4 * args.latency_ms / 1000)
+    print_row("hedged + retries (after)", *run_calls(hedged, prompts, args.threads))
+    stats = hedged.stats()
+    print(f"hedges sent {stats['hedges']}, won {stats['hedge_wins']}, hedge delay {stats['hedge_delay_seconds']}s, "
+          f"retries {stats['retries']}; backend calls {model.calls} for {2 * args.calls} client calls")
+
+    # Outage: every call fails with 503
+    model.error_rate, model.slow_rate = 1.0, 0.0
+    outage_prompts = prompts[:min(len(prompts), 100)]
+    for name, breaker in [("no breaker", CircuitBreaker(failure_threshold=10 ** 9)),
+                          ("circuit breaker", CircuitBreaker(failure_threshold=5, reset_seconds=30))]:
+        client = LLMClient(HTTPBackend(url), max_retries=2, backoff_base=0.05, hedge=False, breaker=breaker)
+        _, failed, wall = run_calls(client, outage_prompts, args.threads)
+        failure = summarize(failed, wall)
+        print(f"outage, {name:<16} {len(failed)} failed calls in {wall:.2f}s, "
+              f"p50 {failure['p50_ms']:.0f}ms p99 {failure['p99_ms']:.0f}ms, "
+              f"short-circuited {client.stats()['short_circuited']}")
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
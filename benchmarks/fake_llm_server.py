@@ -0,0 +1,96 @@
+# benchmarks/fake_llm_server.py
+# Local HTTP stand-in for the LLM, for testing the resilient client
+# (app/utils/llm_client.py) against slow and failing responses:
+#
+#   POST /generate  {"prompt": "..."}  -> {"text": "<recorded SQL>"} or HTTP 503
+#   POST /control   {"error_rate": 1.0, "slow_rate": 0.1, ...}  -> changes behaviour live
+#   GET  /stats
+#
+#   python -m benchmarks.fake_llm_server --port 8765 --latency-ms 300 --slow-rate 0.05 --slow-ms 5000
+#   LLM_BACKEND=http LLM_HTTP_URL=http://127.0.0.1:8765/generate python run.py
+import argparse
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from benchmarks.replay_llm import ReplayModel, load_recorded_queries
+
+# Behaviour settings that /control may change
+CONTROL_FIELDS = ("latency_ms", "jitter_ms", "error_rate", "slow_rate", "slow_ms")
+
+
+def make_handler(model: ReplayModel):
+    class Handler(BaseHTTPRequestHandler):
+        def _send(self, status: int, payload: dict):
+            body = json.dumps(payload).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            try:
+                self.wfile.write(body)
+            except (BrokenPipeError, ConnectionResetError): # The client gave up (deadline or lost hedge)
+                pass
+
+        def _read_json(self) -> dict:
+            length = int(self.headers.get("Content-Length") or 0)
+            return json.loads(self.rfile.read(length) or b"{}")
+
+        def do_POST(self):
+            if self.path == "/generate":
+                try:
+                    text = model.generate_content(self._read_json().get("prompt", "")).text
+                except RuntimeError as e:
+                    self._send(503, {"error": str(e)})
+                    return
+                self._send(200, {"text": text})
+            elif self.path == "/control":
+                changes = {k: float(v) for k, v in self._read_json().items() if k in CONTROL_FIELDS}
+                for field, value in changes.items():
+                    setattr(model, field, value)
+                self._send(200, {field: getattr(model, field) for field in CONTROL_FIELDS})
+            else:
+                self._send(404, {"error": "not found"})
+
+        def do_GET(self):
+            if self.path == "/stats":
+                self._send(200, {**model.stats(), **{field: getattr(model, field) for field in CONTROL_FIELDS}})
+            else:
+                self._send(404, {"error": "not found"})
+
+        def log_message(self, format, *args): # Quiet: one line per request would swamp benchmark output
+            pass
+    return Handler
+
+
+def start_server(model: ReplayModel, host: str = "127.0.0.1", port: int = 0) -> ThreadingHTTPServer:
+    """Serve in a daemon thread; port 0 picks a free port (see server.server_address)"""
+    server = ThreadingHTTPServer((host, port), make_handler(model))
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Fake LLM HTTP server replaying recorded question/SQL pairs")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency-ms", type=float, default=300.0)
+    parser.add_argument("--jitter-ms", type=float, default=100.0)
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Share of calls answered with HTTP 503")
+    parser.add_argument("--slow-rate", type=float, default=0.0, help="Share of calls that take --slow-ms")
+    parser.add_argument("--slow-ms", type=float, default=10000.0)
+    args = parser.parse_args()
+
+    model = ReplayModel(load_recorded_queries(), latency_ms=args.latency_ms, jitter_ms=args.jitter_ms,
+                        error_rate=args.error_rate, slow_rate=args.slow_rate, slow_ms=args.slow_ms)
+    server = ThreadingHTTPServer((args.host, args.port), make_handler(model))
+    print(f"Fake LLM listening on http://{args.host}:{args.port}/generate")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,82 @@
+# benchmarks/replay_llm.py
+# Stand-in for the Gemini model behind TextToSQLAgent: answers prompts from
+# recorded question -> SQL pairs after an injected latency, so /ask can be
+# load-tested offline. Only the model is replaced; prompt building, rules,
+# caches, single-flight and packing in the agent still run as in production.
+import json
+import os
+import random
+import re
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+
+from app.utils.query_cache import normalize_question
+
+RECORDED_QUERIES_PATH = os.path.join(os.path.dirname(__file__), "recorded_queries.json")
+# Answer for questions that were never recorded (counted in `misses`)
+FALLBACK_SQL = "SELECT COUNT(*) FROM ad_sales;"
+
+_SINGLE_RE = re.compile(r"Natural Language Question: (.*)$", re.MULTILINE)
+_PACKED_RE = re.compile(r"^\s*Question (\d+): (.*)$", re.MULTILINE)
+
+
+def load_recorded_queries(path: str = RECORDED_QUERIES_PATH) -> List[Tuple[str, str]]:
+    with open(path, encoding="utf-8") as f:
+        return [(entry["question"], entry["sql"]) for entry in json.load(f)]
+
+
+class ReplayResponse:
+    """Just the part of a Gemini response the agent reads"""
+
+    def __init__(self, text: str):
+        self.text = text
+
+
+class ReplayModel:
+    """
+    generate_content() with recorded answers. Latency is latency_ms plus a
+    uniform jitter of up to jitter_ms, and slow_rate of the calls take slow_ms
+    instead (the tail); error_rate makes that share of calls fail.
+    """
+
+    def __init__(self, pairs: List[Tuple[str, str]], latency_ms: float = 800.0, jitter_ms: float = 200.0,
+                 error_rate: float = 0.0, slow_rate: float = 0.0, slow_ms: float = 10000.0, seed: Optional[int] = 42):
+        self.answers: Dict[str, str] = {normalize_question(q): sql for q, sql in pairs}
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.error_rate = error_rate
+        self.slow_rate = slow_rate
+        self.slow_ms = slow_ms
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self.calls = 0
+        self.misses = 0
+
+    def _answer(self, question: str) -> str:
+        sql = self.answers.get(normalize_question(question))
+        if sql is None:
+            with self._lock:
+                self.misses += 1
+            return FALLBACK_SQL
+        return sql
+
+    def generate_content(self, prompt: str) -> ReplayResponse:
+        with self._lock:
+            self.calls += 1
+            delay = (self.latency_ms + self._rng.uniform(0, self.jitter_ms)) / 1000
+            if self._rng.random() < self.slow_rate:
+                delay = self.slow_ms / 1000
+            fail = self._rng.random() < self.error_rate
+        time.sleep(delay)
+        if fail:
+            raise RuntimeError("Injected LLM failure")
+
+        packed = _PACKED_RE.findall(prompt)
+        if packed: # Several questions in one prompt: answer with "-- Q<n>" markers
+            return ReplayResponse("\n".join(f"-- Q{number}\n{self._answer(question)}" for number, question in packed))
+        match = _SINGLE_RE.search(prompt)
+        return ReplayResponse(self._answer(match.group(1).strip() if match else ""))
+
+    def stats(self) -> Dict[str, int]:
+        return {"calls": self.calls, "misses": self.misses}
@@ -0,0 +1,299 @@
+# benchmarks/run_suite.py
+# Offline end-to-end benchmark: synthetic data at scale, Gemini replaced by
+# the replaying stand-in (benchmarks/replay_llm.py). Reports throughput and
+# p50/p95/p99 for ingestion, /ask end-to-end, SQL execution and chart
+# generation, and writes them to a JSON file that later runs compare against.
+#
+#   python -m benchmarks.run_suite --rows 1000000 --requests 500 --concurrency 8 \
+#       --output benchmarks/results/1m.json
+#   python -m benchmarks.run_suite --rows 1000000 --compare benchmarks/results/1m.json
+#   python -m benchmarks.run_suite --compare old.json new.json   # no run, just the diff
+#
+# The app reads its settings at import time, so the environment is prepared
+# before any app module is imported (see configure_environment).
+import argparse
+import asyncio
+import json
+import logging
+import os
+import platform
+import random
+import sqlite3
+import subprocess
+import sys
+import time
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+from benchmarks.synth_data import generate
+
+PERCENTILES = (50, 95, 99)
+# Compared between runs: (metric, True if higher is better)
+COMPARED_METRICS = [("throughput_per_s", True), ("p50_ms", False), ("p95_ms", False), ("p99_ms", False)]
+
+
+# --- Statistics ---
+def percentile(sorted_values: Sequence[float], pct: float) -> float:
+    """Nearest-rank percentile of an already sorted list"""
+    if not sorted_values:
+        return 0.0
+    rank = max(1, -(-len(sorted_values) * pct // 100))
+    return sorted_values[int(rank) - 1]
+
+def summarize(latencies: List[float], wall_seconds: Optional[float] = None, units: Optional[int] = None) -> Dict[str, Any]:
+    """
+    Latency percentiles (ms) of the samples, and throughput: `units` (default:
+    one per sample) per second of `wall_seconds` (default: sum of the samples).
+    """
+    values = sorted(latencies)
+    wall = wall_seconds if wall_seconds is not None else sum(values)
+    summary = {"count": len(values), "throughput_per_s": round((units or len(values)) / wall, 2) if wall else 0.0,
+               "mean_ms": round(sum(values) / len(values) * 1000, 3) if values else 0.0}
+    for pct in PERCENTILES:
+        summary[f"p{pct}_ms"] = round(percentile(values, pct) * 1000, 3)
+    summary["max_ms"] = round(values[-1] * 1000, 3) if values else 0.0
+    return summary
+
+
+# --- Setup ---
+def prepare_data(args) -> str:
+    """Synthetic CSVs for --rows, reused when an earlier run generated the same ones"""
+    data_dir = os.path.join(args.work_dir, f"rows_{args.rows}_seed_{args.seed}")
+    manifest_path = os.path.join(data_dir, "manifest.json")
+    if os.path.exists(manifest_path):
+        with open(manifest_path, encoding="utf-8") as f:
+            manifest = json.load(f)
+        if manifest.get("days") == args.days:
+            print(f"Reusing synthetic data in {data_dir}")
+            return data_dir
+    print(f"Generating {args.rows:,} ad_sales rows into {data_dir} ...")
+    generate(data_dir, args.rows, days=args.days, seed=args.seed)
+    return data_dir
+
+def configure_environment(args, database_path: str):
+    os.environ["DATABASE_URL"] = f"sqlite:///{database_path}"
+    os.environ.pop("DB_SNAPSHOT_PATH", None)
+    os.environ.setdefault("GOOGLE_API_KEY", "offline-benchmark") # The stand-in model never uses it
+    if args.no_rules:
+        os.environ["RULE_FAST_PATH"] = "0"
+    if args.no_cache: # Every request goes through the stand-in LLM and SQLite
+        os.environ.update({"SQL_CACHE_SIZE": "0", "SQL_TEMPLATE_CACHE_SIZE": "0", "RESULT_CACHE_MAX_BYTES": "0"})
+        os.environ.pop("SQL_CACHE_PATH", None)
+
+
+# --- Stages ---
+def bench_ingestion(data_dir: str, database_path: str, repeat: int) -> Dict[str, Any]:
+    """Full load of the three CSVs into a fresh database, `repeat` times"""
+    from sqlalchemy import create_engine
+    from app.utils.data_loader import initialize_database
+
+    runs = []
+    for _ in range(repeat):
+        for suffix in ("", "-wal", "-shm"):
+            if os.path.exists(database_path + suffix):
+                os.remove(database_path + suffix)
+        start = time.perf_counter()
+        initialize_database(data_dir, f"sqlite:///{database_path}").dispose()
+        runs.append(time.perf_counter() - start)
+
+    engine = create_engine(f"sqlite:///{database_path}")
+    with engine.connect() as conn:
+        row_counts = {table: conn.exec_driver_sql(f'SELECT COUNT(*) FROM "{table}"').scalar()
+                      for table in ("ad_sales", "total_sales", "eligibility")}
+    engine.dispose()
+    # Throughput in rows/s over all runs
+    summary = summarize(runs, units=sum(row_counts.values()) * len(runs))
+    summary.update({"rows": row_counts, "database_bytes": os.path.getsize(database_path)})
+    return summary
+
+def bench_sql(pairs, repeat: int) -> Tuple[Dict[str, Any], Dict[str, Tuple[List[str], List[tuple]]]]:
+    """
+    Guarded execution of every recorded query on the read-only pool, result
+    cache cleared each time. Also returns each query's (columns, rows).
+    """
+    from app.database import readonly_engine
+    from app.utils.query_executor import execute_query
+    from app.utils.result_cache import result_cache
+
+    latencies, per_query, outputs = [], {}, {}
+    with readonly_engine.connect() as conn:
+        for question, sql in pairs:
+            samples = []
+            execute_query(conn, sql) # Warm-up: page cache and connection state
+            for _ in range(repeat):
+                result_cache.clear()
+                start = time.perf_counter()
+                columns, rows, _ = execute_query(conn, sql)
+                samples.append(time.perf_counter() - start)
+            latencies += samples
+            per_query[question] = {"rows": len(rows), **summarize(samples)}
+            outputs[question] = (columns, rows)
+    return {**summarize(latencies), "queries": per_query}, outputs
+
+def bench_charts(outputs, repeat: int) -> Dict[str, Any]:
+    """generate_chart over each recorded query's real result; throughput in charts/s"""
+    from app.utils.visualizer import generate_chart
+
+    latencies, by_type = [], {}
+    for question, (columns, rows) in outputs.items():
+        generate_chart(question, columns, rows) # Warm-up (first use of each chart type)
+        for _ in range(repeat):
+            start = time.perf_counter()
+            _, chart_type = generate_chart(question, columns, rows)
+            elapsed = time.perf_counter() - start
+            latencies.append(elapsed)
+            by_type.setdefault(chart_type or "none", []).append(elapsed)
+    return {**summarize(latencies), "by_chart_type": {name: summarize(samples) for name, samples in by_type.items()}}
+
+async def bench_ask(pairs, args) -> Dict[str, Any]:
+    """
+    /ask through the full ASGI app (middleware, agent, guard, encoding) with
+    the stand-in model, `concurrency` requests in flight at a time.
+    """
+    import httpx
+    from app import main
+    from app.database import readonly_engine
+    from app.utils.data_loader import get_table_info
+    from app.utils.text_to_sql import TextToSQLAgent
+    from benchmarks.replay_llm import ReplayModel
+
+    # What startup_event does, minus ingestion (it would load ./data into the benchmark database)
+    main.table_info = get_table_info(readonly_engine)
+    main.text_to_sql_agent = TextToSQLAgent(main.table_info)
+    model = ReplayModel(pairs, latency_ms=args.llm_latency_ms, jitter_ms=args.llm_jitter_ms,
+                        error_rate=args.llm_error_rate, slow_rate=args.llm_slow_rate, slow_ms=args.llm_slow_ms,
+                        seed=args.seed)
+    main.text_to_sql_agent.model = model
+
+    rng = random.Random(args.seed)
+    workload = [pairs[i % len(pairs)][0] for i in range(args.requests)]
+    rng.shuffle(workload)
+    semaphore = asyncio.Semaphore(args.concurrency)
+    latencies, statuses, sources, stages = [], {}, {}, {}
+
+    async def ask(client, question: str):
+        async with semaphore:
+            start = time.perf_counter()
+            response = await client.post("/ask", json={"question": question, "response_format": args.response_format})
+            latencies.append(time.perf_counter() - start)
+        statuses[str(response.status_code)] = statuses.get(str(response.status_code), 0) + 1
+        if response.status_code == 200:
+            body = response.json()
+            sources[body["sql_source"]] = sources.get(body["sql_source"], 0) + 1
+            for stage, seconds in body.get("timings", {}).items():
+                stages.setdefault(stage, []).append(seconds)
+
+    transport = httpx.ASGITransport(app=main.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://benchmark", timeout=None) as client:
+        start = time.perf_counter()
+        await asyncio.gather(*(ask(client, question) for question in workload))
+        wall = time.perf_counter() - start
+
+    return {**summarize(latencies, wall), "status_codes": statuses, "sql_sources": sources,
+            "llm": model.stats(), "stages": {name: summarize(samples) for name, samples in stages.items()}}
+
+
+# --- Results ---
+def git_revision() -> Optional[str]:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def print_summary(results: Dict[str, Any]):
+    print(f"\n{'stage':<16}{'count':>8}{'per sec':>12}{'p50 ms':>11}{'p95 ms':>11}{'p99 ms':>11}")
+    for stage, summary in results["stages"].items():
+        print(f"{stage:<16}{summary['count']:>8}{summary['throughput_per_s']:>12.1f}"
+              f"{summary['p50_ms']:>11.2f}{summary['p95_ms']:>11.2f}{summary['p99_ms']:>11.2f}")
+
+def compare(old: Dict[str, Any], new: Dict[str, Any]):
+    """Side-by-side of the headline metrics of two result files"""
+    print(f"\ncomparing {old['meta'].get('git_revision')} ({old['meta']['timestamp']}) "
+          f"-> {new['meta'].get('git_revision')} ({new['meta']['timestamp']})")
+    for key in ("rows", "requests", "concurrency", "llm_latency_ms", "no_cache", "no_rules"):
+        if old["meta"]["args"].get(key) != new["meta"]["args"].get(key):
+            print(f"  warning: runs differ in {key}: {old['meta']['args'].get(key)} vs {new['meta']['args'].get(key)}")
+    print(f"{'stage':<16}{'metric':<18}{'old':>12}{'new':>12}{'change':>10}")
+    for stage, summary in new["stages"].items():
+        previous = old["stages"].get(stage)
+        if not previous:
+            continue
+        for metric, higher_is_better in COMPARED_METRICS:
+            before, after = previous[metric], summary[metric]
+            change = (after - before) / before * 100 if before else 0.0
+            better = change > 0 if higher_is_better else change < 0
+            marker = "" if abs(change) < 5 else (" +" if better else " -") # Within 5% is treated as noise
+            print(f"{stage:<16}{metric:<18}{before:>12.2f}{after:>12.2f}{change:>9.1f}%{marker}")
+
+def load_results(path: str) -> Dict[str, Any]:
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline benchmark suite with synthetic data and a stand-in LLM")
+    parser.add_argument("--rows", type=int, default=1_000_000, help="Synthetic ad_sales rows")
+    parser.add_argument("--days", type=int, default=365)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--work-dir", default="benchmarks/.data", help="Generated CSVs and the benchmark database")
+    parser.add_argument("--ingest-repeat", type=int, default=1)
+    parser.add_argument("--requests", type=int, default=200, help="/ask requests, cycling over the recorded questions")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--response-format", default="rows", choices=["rows", "columnar"])
+    parser.add_argument("--llm-latency-ms", type=float, default=800.0, help="Injected stand-in LLM latency")
+    parser.add_argument("--llm-jitter-ms", type=float, default=200.0, help="Extra uniform random latency, up to this")
+    parser.add_argument("--llm-error-rate", type=float, default=0.0, help="Share of stand-in LLM calls that fail")
+    parser.add_argument("--llm-slow-rate", type=float, default=0.0, help="Share of stand-in LLM calls in the slow tail")
+    parser.add_argument("--llm-slow-ms", type=float, default=10000.0, help="Latency of the slow tail")
+    parser.add_argument("--no-cache", action="store_true", help="Disable the SQL, template and result caches")
+    parser.add_argument("--no-rules", action="store_true", help="Disable the rule fast path")
+    parser.add_argument("--repeat", type=int, default=5, help="Runs per recorded query for SQL and chart timing")
+    parser.add_argument("--queries", default=None, help="Recorded question/SQL pairs (JSON)")
+    parser.add_argument("--output", default=None, help="Results file (default: benchmarks/results/<timestamp>.json)")
+    parser.add_argument("--verbose", action="store_true", help="Show the app's INFO logs")
+    parser.add_argument("--compare", nargs="+", metavar="RESULTS",
+                        help="Earlier results to compare this run against; with two files, compare them without running")
+    args = parser.parse_args()
+
+    if args.compare and len(args.compare) == 2:
+        compare(load_results(args.compare[0]), load_results(args.compare[1]))
+        return
+
+    data_dir = prepare_data(args)
+    database_path = os.path.abspath(os.path.join(args.work_dir, f"bench_{args.rows}.db"))
+    configure_environment(args, database_path)
+    # Before any app import, so app.main's basicConfig does not turn on per-request INFO logs
+    logging.basicConfig(level=logging.INFO if args.verbose else logging.WARNING)
+    from benchmarks.replay_llm import load_recorded_queries, RECORDED_QUERIES_PATH
+    pairs = load_recorded_queries(args.queries or RECORDED_QUERIES_PATH)
+
+    results = {"meta": {
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"), "git_revision": git_revision(), "args": vars(args),
+        "python": sys.version.split()[0], "sqlite": sqlite3.sqlite_version, "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+    }, "stages": {}}
+
+    print("Ingestion ...")
+    results["stages"]["ingestion"] = bench_ingestion(data_dir, database_path, args.ingest_repeat)
+    print("SQL execution ...")
+    results["stages"]["sql_execution"], outputs = bench_sql(pairs, args.repeat)
+    print("Chart generation ...")
+    results["stages"]["chart"] = bench_charts(outputs, args.repeat)
+    print(f"/ask: {args.requests} requests, concurrency {args.concurrency} ...")
+    results["stages"]["ask"] = asyncio.run(bench_ask(pairs, args))
+
+    output = args.output or os.path.join("benchmarks", "results", f"{time.strftime('%Y%m%d-%H%M%S')}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(results, f, indent=2)
+
+    print_summary(results)
+    ask = results["stages"]["ask"]
+    print(f"\n/ask status codes {ask['status_codes']}, SQL sources {ask['sql_sources']}, stand-in LLM {ask['llm']}")
+    print(f"Results written to {output}")
+    if args.compare:
+        compare(load_results(args.compare[0]), results)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,166 @@
+# benchmarks/synth_data.py
+# Writes ad_sales.csv, total_sales.csv and eligibility.csv in the layout of
+# data/, scaled to any size (1M-100M ad_sales rows), day by day so memory
+# stays flat:
+#   - one ad_sales row per active item per day; item activity and traffic
+#     follow a long-tailed (Zipf-like) popularity, with a weekend bump
+#   - clicks, spend, units and sales derived from impressions, so CTR, CPC
+#     and RoAS stay in realistic ranges; most rows sell nothing
+#   - total_sales only for item-days with orders (ads plus organic)
+#   - one eligibility sweep per day over a sample of items; ineligibility is
+#     sticky per item and carries one of the real messages
+#
+#   python -m benchmarks.synth_data --rows 10000000 --out benchmarks/.data/10m
+import argparse
+import json
+import os
+import time
+from typing import Tuple
+
+import numpy as np
+import pandas as pd
+
+MEAN_ACTIVITY = 0.4 # Average share of the catalog with an ad_sales row on a given day
+POPULARITY_EXPONENT = 0.6 # Zipf exponent of item popularity
+ELIGIBILITY_MESSAGES = [
+    "This product's cost to Amazon does not allow us to meet customers’ pricing expectations. Consider reducing "
+    "the cost. It may take a few weeks for your product to become eligible to advertise after you reduce the cost.",
+    "This product is either missing important information or contains incorrect information. Review in your "
+    "product inventory.",
+]
+MESSAGE_WEIGHTS = [0.9, 0.1]
+
+
+def activity_by_item(n_items: int, mean_activity: float) -> np.ndarray:
+    """Daily probability of an item having ad activity: Zipf-like, scaled to the wanted mean"""
+    raw = np.arange(1, n_items + 1, dtype=np.float64) ** -POPULARITY_EXPONENT
+    scale = mean_activity * n_items / raw.sum()
+    for _ in range(50): # Clipping at 1 removes mass from the head; push it back into the tail
+        p = np.clip(raw * scale, 0.005, 1.0)
+        scale *= mean_activity * n_items / p.sum()
+    return p
+
+
+class CatalogSimulator:
+    """Per-item traits fixed for the whole run, plus the eligibility state that evolves daily"""
+
+    def __init__(self, n_items: int, rng: np.random.Generator, mean_activity: float = MEAN_ACTIVITY):
+        self.rng = rng
+        self.n_items = n_items
+        # Popularity rank is shuffled over item ids, like a real catalog
+        self.item_ids = rng.permutation(n_items)
+        self.activity = activity_by_item(n_items, mean_activity)
+        self.price = np.round(rng.lognormal(np.log(30), 0.8, n_items), 2) + 0.99
+        self.ctr = rng.beta(2, 250, n_items)
+        self.cpc = rng.lognormal(np.log(0.9), 0.5, n_items)
+        self.conversion = rng.beta(2, 25, n_items)
+        self.ineligible = rng.random(n_items) < 0.12
+        self.message = rng.choice(len(ELIGIBILITY_MESSAGES), n_items, p=MESSAGE_WEIGHTS)
+
+    def ad_sales(self, day: pd.Timestamp, limit: int) -> Tuple[pd.DataFrame, np.ndarray, np.ndarray]:
+        """The day's rows, plus the catalog positions and ad units that total_sales builds on"""
+        rng = self.rng
+        idx = np.flatnonzero(rng.random(self.n_items) < self.activity)[:limit]
+        weekend = 1.15 if day.dayofweek >= 5 else 1.0
+        impressions = rng.lognormal(np.log(200 + 3000 * self.activity[idx] * weekend), 0.7).astype(np.int64)
+        clicks = rng.binomial(impressions, self.ctr[idx])
+        ad_spend = np.round(clicks * self.cpc[idx] * rng.lognormal(0, 0.2, len(idx)), 2)
+        units_sold = rng.binomial(clicks, self.conversion[idx])
+        return pd.DataFrame({
+            "date": day.strftime("%Y-%m-%d"),
+            "item_id": self.item_ids[idx],
+            "ad_sales": np.round(units_sold * self.price[idx], 2),
+            "impressions": impressions,
+            "ad_spend": ad_spend,
+            "clicks": clicks,
+            "units_sold": units_sold,
+        }), idx, units_sold
+
+    def total_sales(self, day: pd.Timestamp, idx: np.ndarray, ad_units: np.ndarray) -> pd.DataFrame:
+        units = ad_units + self.rng.poisson(0.15 + 0.6 * self.activity[idx])
+        sold = units > 0
+        return pd.DataFrame({
+            "date": day.strftime("%Y-%m-%d"),
+            "item_id": self.item_ids[idx][sold],
+            "total_sales": np.round(units[sold] * self.price[idx][sold], 2),
+            "total_units_ordered": units[sold],
+        })
+
+    def eligibility_sweep(self, day: pd.Timestamp, check_rate: float) -> pd.DataFrame:
+        rng = self.rng
+        # Status drifts between sweeps: items lose eligibility rarely and recover slowly
+        flip = rng.random(self.n_items)
+        self.ineligible = np.where(self.ineligible, flip > 0.08, flip < 0.01)
+        checked = np.flatnonzero(rng.random(self.n_items) < check_rate)
+        seconds = int(rng.integers(0, 24 * 3600))
+        # Same unpadded-hour format as data/eligibility.csv ("2025-06-04 8:50:07")
+        stamp = f"{day.strftime('%Y-%m-%d')} {seconds // 3600}:{seconds // 60 % 60:02d}:{seconds % 60:02d}"
+        ineligible = self.ineligible[checked]
+        messages = np.array(ELIGIBILITY_MESSAGES, dtype=object)[self.message[checked]]
+        return pd.DataFrame({
+            "eligibility_datetime_utc": stamp,
+            "item_id": self.item_ids[checked],
+            "eligibility": np.where(ineligible, "FALSE", "TRUE"),
+            "message": np.where(ineligible, messages, ""),
+        })
+
+
+def generate(out_dir: str, rows: int, days: int = 365, start: str = "2024-06-16", items: int = 0,
+             eligibility_rate: float = MEAN_ACTIVITY, seed: int = 42) -> dict:
+    """
+    Write the three CSVs to out_dir with about `rows` ad_sales rows.
+    Returns a manifest with the row counts, also saved as manifest.json.
+    """
+    rng = np.random.default_rng(seed)
+    per_day = -(-rows // days)
+    n_items = items or max(10, int(per_day / MEAN_ACTIVITY))
+    if per_day > n_items:
+        raise ValueError(f"{rows} rows over {days} days needs more than {n_items} items (one row per item per day)")
+    catalog = CatalogSimulator(n_items, rng, mean_activity=min(1.0, per_day / n_items))
+
+    os.makedirs(out_dir, exist_ok=True)
+    files = {name: open(os.path.join(out_dir, f"{name}.csv"), "w", encoding="utf-8", newline="")
+             for name in ("ad_sales", "total_sales", "eligibility")}
+    counts = dict.fromkeys(files, 0)
+    start_time = time.perf_counter()
+    try:
+        for day in pd.date_range(start, periods=days, freq="D"):
+            remaining = rows - counts["ad_sales"]
+            if remaining <= 0:
+                break
+            ad, idx, ad_units = catalog.ad_sales(day, remaining)
+            for name, frame in (("ad_sales", ad), ("total_sales", catalog.total_sales(day, idx, ad_units)),
+                                ("eligibility", catalog.eligibility_sweep(day, eligibility_rate))):
+                frame.to_csv(files[name], header=counts[name] == 0, index=False)
+                counts[name] += len(frame)
+    finally:
+        for f in files.values():
+            f.close()
+
+    manifest = {"rows": rows, "days": days, "start": start, "items": n_items, "eligibility_rate": eligibility_rate,
+                "seed": seed, "row_counts": counts, "seconds": round(time.perf_counter() - start_time, 2)}
+    with open(os.path.join(out_dir, "manifest.json"), "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=2)
+    return manifest
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate scaled synthetic ad_sales/total_sales/eligibility CSVs")
+    parser.add_argument("--rows", type=int, default=1_000_000, help="ad_sales rows (the other tables scale with it)")
+    parser.add_argument("--days", type=int, default=365)
+    parser.add_argument("--start", default="2024-06-16", help="First date (the default run ends on 2025-06-15)")
+    parser.add_argument("--items", type=int, default=0, help="Catalog size (default: derived from rows and days)")
+    parser.add_argument("--eligibility-rate", type=float, default=MEAN_ACTIVITY,
+                        help="Share of the catalog checked in each daily eligibility sweep")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--out", default="benchmarks/.data/synthetic")
+    args = parser.parse_args()
+
+    manifest = generate(args.out, args.rows, args.days, args.start, args.items, args.eligibility_rate, args.seed)
+    print(f"{manifest['items']} items over {args.days} days in {manifest['seconds']:.1f}s -> {args.out}")
+    for name, count in manifest["row_counts"].items():
+        print(f"{name:<14}{count:>14,} rows")
+
+
+if __name__ == "__main__":
+    main()
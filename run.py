@@ -1,8 +1,34 @@
+import argparse
 import uvicorn
 import os
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run the E-commerce AI Agent API")
+    parser.add_argument("--prod", action="store_true",
+                        help="Several worker processes, no reload; one leader ingests the CSVs")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1,
+                        help="Worker processes in --prod mode (default: number of CPU cores)")
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=8000)
+    args = parser.parse_args()
+
     # Ensure the app directory exists for the database
     os.makedirs("app", exist_ok=True)
 
-    uvicorn.run("app.main:app", host="0.0.0.0", port=8000, reload=True)
\ No newline at end of file
+    if args.prod:
+        # Workers inherit this and elect a single ingest leader at startup (app/ingest_leader.py)
+        os.environ["INGEST_LEADER_ELECTION"] = "1"
+        from app.database import get_database_path
+        from app.ingest_leader import clear_ready_marker, leader_election_enabled
+        from app.utils.analytics_engine import ANALYTICS_ENGINE, DUCKDB_PATH
+        if ANALYTICS_ENGINE == "duckdb":
+            # DuckDB allows one writer per file: only an elected leader may ingest
+            if args.workers > 1 and not leader_election_enabled():
+                parser.error("ANALYTICS_ENGINE=duckdb with several workers needs fcntl for leader election; use --workers 1")
+            clear_ready_marker(DUCKDB_PATH)
+        database_path = get_database_path()
+        if database_path:
+            clear_ready_marker(database_path)
+        uvicorn.run("app.main:app", host=args.host, port=args.port, workers=args.workers, log_level="info")
+    else:
+        uvicorn.run("app.main:app", host=args.host, port=args.port, reload=True)
@@ -0,0 +1,19 @@
+# tests/conftest.py
+import os
+import shutil
+
+import pytest
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "data")
+
+
+@pytest.fixture(scope="session")
+def loaded_engine(tmp_path_factory):
+    """SQLite database loaded from the sample CSVs, with rollups and snapshots"""
+    from app.utils.data_loader import initialize_database
+    folder = tmp_path_factory.mktemp("data")
+    for name in ("ad_sales.csv", "total_sales.csv", "eligibility.csv"):
+        shutil.copy(os.path.join(DATA_DIR, name), folder / name)
+    engine = initialize_database(str(folder), f"sqlite:///{folder / 'ecommerce.db'}")
+    yield engine
+    engine.dispose()
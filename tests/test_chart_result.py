@@ -0,0 +1,49 @@
+# tests/test_chart_result.py
+import asyncio
+
+import pytest
+from fastapi import HTTPException
+
+import app.main as main
+from app.utils.result_cache import result_cache
+from app.utils.rollup_router import RoutedQuery
+
+ASKED_SQL = "SELECT item_id FROM total_sales ORDER BY total_sales DESC LIMIT 5"
+
+
+class _Agent:
+    """Resolves every question to one fixed SQL"""
+
+    def __init__(self, sql_query):
+        self.sql_query = sql_query
+
+    async def resolve_sql_query(self, question, timer=None):
+        return self.sql_query, {}, "llm"
+
+
+@pytest.fixture
+def rerun(monkeypatch):
+    """Re-run a chart's question with the given SQL, on a result cache that no longer holds it"""
+    def execute(sql_query, sql_params, timer):
+        return (["item_id"], [(21,)], False), RoutedQuery(sql_query, "total_sales")
+
+    monkeypatch.setattr(main, "_execute_routed", execute)
+    monkeypatch.setattr(result_cache, "get", lambda key: None)
+
+    def run(sql_query, result_id):
+        monkeypatch.setattr(main, "text_to_sql_agent", _Agent(sql_query))
+        return asyncio.run(main._chart_result(result_id, "top 5 products"))
+    return run
+
+
+def test_rerun_with_the_same_sql_serves_the_chart(rerun):
+    # Another worker's data version, same SQL: still this result
+    result_id = "other-worker:" + result_cache.make_key(ASKED_SQL).split(":", 1)[1]
+    assert rerun(ASKED_SQL, result_id) == (["item_id"], [(21,)])
+
+
+def test_rerun_with_different_sql_is_a_conflict(rerun):
+    result_id = result_cache.make_key(ASKED_SQL)
+    with pytest.raises(HTTPException) as excinfo:
+        rerun(ASKED_SQL.replace("DESC", "ASC"), result_id)
+    assert excinfo.value.status_code == 409
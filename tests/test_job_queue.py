@@ -0,0 +1,118 @@
+# tests/test_job_queue.py
+import asyncio
+
+import pytest
+
+from app.utils.job_queue import JobQueue, JobQueueFullError
+
+
+def _run(coroutine):
+    return asyncio.run(coroutine)
+
+
+def test_interactive_jobs_run_before_batch_jobs():
+    async def scenario():
+        order = []
+        release = asyncio.Event()
+
+        async def runner(job):
+            order.append(job.question)
+            if job.question == "blocker":
+                await release.wait()
+            return {"question": job.question}
+
+        queue = JobQueue(workers=1, max_per_client=0)
+        queue.start(runner)
+        blocker = queue.submit("blocker", "interactive", "a")
+        await asyncio.sleep(0.01)
+        batch = queue.submit("batch", "batch", "a")
+        interactive = queue.submit("interactive", "interactive", "a")
+        assert queue.queue_position(interactive) == 0 and queue.queue_position(batch) == 1
+        release.set()
+        while not batch.finished:
+            await batch.wait_for_change(1)
+        await queue.stop()
+        return order, blocker.status, interactive.status, batch.status
+
+    order, *statuses = _run(scenario())
+    assert order == ["blocker", "interactive", "batch"]
+    assert statuses == ["succeeded"] * 3
+
+
+def test_per_client_limit_lets_other_clients_through():
+    async def scenario():
+        release = asyncio.Event()
+
+        async def runner(job):
+            await release.wait()
+            return {}
+
+        queue = JobQueue(workers=3, max_per_client=1)
+        queue.start(runner)
+        first = queue.submit("q1", "interactive", "busy")
+        second = queue.submit("q2", "interactive", "busy")
+        other = queue.submit("q3", "interactive", "quiet")
+        await asyncio.sleep(0.02)
+        statuses = (first.status, second.status, other.status)
+        release.set()
+        await queue.stop()
+        return statuses
+
+    assert _run(scenario()) == ("running", "queued", "running")
+
+
+def test_cancel_queued_and_running_jobs():
+    async def scenario():
+        async def runner(job):
+            await asyncio.sleep(10)
+            return {}
+
+        queue = JobQueue(workers=1)
+        queue.start(runner)
+        running = queue.submit("slow", "interactive", "a")
+        queued = queue.submit("waiting", "interactive", "b")
+        await asyncio.sleep(0.01)
+        queue.cancel(queued.job_id)
+        queue.cancel(running.job_id)
+        await running.wait_for_change(1)
+        stats = queue.stats()
+        await queue.stop()
+        return running.status, queued.status, stats["finished"]["cancelled"]
+
+    assert _run(scenario()) == ("cancelled", "cancelled", 2)
+
+
+def test_failed_runner_records_the_error():
+    async def scenario():
+        async def runner(job):
+            raise RuntimeError("Query rejected: nope")
+
+        queue = JobQueue(workers=1)
+        queue.start(runner)
+        job = queue.submit("bad", "interactive", "a")
+        while not job.finished:
+            await job.wait_for_change(1)
+        await queue.stop()
+        return job.status, job.error
+
+    assert _run(scenario()) == ("failed", "Query rejected: nope")
+
+
+def test_queue_bound():
+    async def scenario():
+        async def runner(job):
+            await asyncio.sleep(10)
+
+        queue = JobQueue(workers=1, max_queued=1)
+        queue.start(runner)
+        queue.submit("q1", "interactive", "a")
+        await asyncio.sleep(0.01) # q1 is running, the queue is empty again
+        queue.submit("q2", "interactive", "a")
+        try:
+            with pytest.raises(JobQueueFullError):
+                queue.submit("q3", "interactive", "a")
+            return queue.stats()["rejected"]
+        finally:
+            await queue.stop()
+
+    assert _run(scenario()) == 1
@@ -0,0 +1,71 @@
+# tests/test_llm_client.py
+import time
+
+import pytest
+
+from app.utils.llm_client import CircuitBreaker, LLMBackendError, LLMClient, LLMUnavailableError
+
+
+class _Backend:
+    name = "test"
+
+    def __init__(self, answers):
+        self.answers = list(answers)
+        self.calls = 0
+
+    def generate(self, prompt, timeout):
+        self.calls += 1
+        answer = self.answers.pop(0) if self.answers else "SELECT 1"
+        if isinstance(answer, Exception):
+            raise answer
+        return answer
+
+
+def _client(backend, **kwargs):
+    options = dict(deadline_seconds=5, attempt_timeout=2, backoff_base=0.001, backoff_max=0.001, hedge=False)
+    options.update(kwargs)
+    return LLMClient(backend, **options)
+
+
+def test_retries_a_transient_failure():
+    backend = _Backend([LLMBackendError("HTTP 503"), "SELECT 2"])
+    client = _client(backend, max_retries=2)
+    assert client.generate("prompt") == "SELECT 2"
+    assert (backend.calls, client.stats()["retries"]) == (2, 1)
+
+
+def test_does_not_retry_a_bad_request_or_count_it_against_the_backend():
+    backend = _Backend([LLMBackendError("HTTP 400", retryable=False)])
+    client = _client(backend, max_retries=2)
+    with pytest.raises(LLMBackendError):
+        client.generate("prompt")
+    assert backend.calls == 1
+    assert client.breaker.consecutive_failures == 0
+
+
+def test_breaker_opens_fails_fast_and_closes_after_a_successful_probe():
+    breaker = CircuitBreaker(failure_threshold=2, reset_seconds=0.1)
+    backend = _Backend([LLMBackendError("HTTP 503")] * 2)
+    client = _client(backend, max_retries=1, breaker=breaker)
+    with pytest.raises(LLMUnavailableError):
+        client.generate("prompt")
+    assert breaker.state == "open" and breaker.is_open()
+
+    with pytest.raises(LLMUnavailableError, match="circuit open"):
+        client.generate("prompt")
+    assert backend.calls == 2 # Refused without calling the backend
+    assert client.stats()["short_circuited"] == 1
+
+    time.sleep(0.15)
+    assert client.generate("prompt") == "SELECT 1" # The half-open probe succeeds
+    assert breaker.state == "closed"
+
+
+def test_failed_probe_reopens_the_circuit():
+    breaker = CircuitBreaker(failure_threshold=1, reset_seconds=0.05)
+    breaker.record_failure()
+    time.sleep(0.06)
+    assert breaker.allow() # The single probe
+    assert not breaker.allow() # Others wait for its outcome
+    breaker.record_failure()
+    assert breaker.state == "open" and breaker.opened_count == 2
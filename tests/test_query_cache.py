@@ -0,0 +1,51 @@
+# tests/test_query_cache.py
+import pytest
+
+from app.utils.query_cache import QueryCache, normalize_question
+
+
+@pytest.mark.parametrize("a, b", [
+    ("What is my total sales?", "what is my total sales"),
+    ("Calculate the RoAS (Return on Ad Spend).", "calculate the roas return on ad spend"),
+    ("Items with sales>100?", "items with sales > 100"),
+])
+def test_trivial_differences_share_a_key(a, b):
+    assert normalize_question(a) == normalize_question(b)
+
+
+@pytest.mark.parametrize("a, b", [
+    ("items with sales > 100", "items with sales < 100"),
+    ("items with sales >= 100", "items with sales > 100"),
+    ("items with sales != 100", "items with sales = 100"),
+    ("items with a change of -5", "items with a change of 5"),
+])
+def test_operators_and_signs_stay_in_the_key(a, b):
+    assert normalize_question(a) != normalize_question(b)
+
+
+def test_dates_and_decimals_are_kept():
+    assert normalize_question("RoAS above 1.5 on 2025-06-01.") == "roas above 1.5 on 2025-06-01"
+
+
+def test_lru_eviction_and_stats():
+    cache = QueryCache(max_size=2)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    assert cache.get("a") == 1
+    cache.set("c", 3) # Evicts "b", the least recently used
+    assert cache.get("b") is None
+    assert cache.get("c") == 3
+    stats = cache.stats()
+    assert (stats["size"], stats["hits"], stats["misses"], stats["evictions"]) == (2, 2, 1, 1)
+
+
+def test_persistence_is_written_behind(tmp_path):
+    path = str(tmp_path / "sql_cache.json")
+    cache = QueryCache(persist_path=path, save_interval_seconds=60)
+    for i in range(50):
+        cache.set(f"q{i}", f"SELECT {i}")
+    assert cache.saves == 0 # Nothing written per set()
+    cache.flush()
+    assert cache.saves == 1
+    reloaded = QueryCache(persist_path=path)
+    assert reloaded.get("q49") == "SELECT 49"
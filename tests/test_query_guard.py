@@ -0,0 +1,93 @@
+# tests/test_query_guard.py
+import time
+
+import pytest
+
+from app.utils.query_executor import execute_query, iter_query_batches
+from app.utils.query_guard import QueryGuard, QueryRejectedError, QueryTimeoutError, TimeBudget, query_guard
+from app.utils.result_cache import result_cache
+
+RUNAWAY_SQL = "WITH RECURSIVE r(x) AS (SELECT 1 UNION ALL SELECT x + 1 FROM r) SELECT COUNT(*) FROM r"
+
+
+@pytest.fixture
+def conn(loaded_engine):
+    with loaded_engine.connect() as conn:
+        yield conn
+
+
+@pytest.mark.parametrize("sql, reason", [
+    ("SELECT 1; DROP TABLE ad_sales", "multiple_statements"),
+    ("DELETE FROM ad_sales", "not_select"),
+    ("PRAGMA table_info(ad_sales)", "not_select"),
+    ("WITH x AS (SELECT 1) INSERT INTO ad_sales SELECT * FROM x", "not_select"),
+    ("SELECT * FROM ad_sales /* ; */ ; ATTACH 'x.db' AS x", "multiple_statements"),
+])
+def test_statement_check_rejects(sql, reason):
+    guard = QueryGuard()
+    with pytest.raises(QueryRejectedError):
+        guard.check_statement(sql)
+    assert guard.rejected_by_reason == {reason: 1}
+
+
+def test_keywords_inside_literals_and_comments_are_allowed():
+    guard = QueryGuard()
+    sql, _ = guard.check_statement("SELECT 'drop; delete' AS note -- update\nFROM ad_sales;")
+    assert sql.endswith("FROM ad_sales")
+    assert guard.rejected == 0
+
+
+def test_unindexed_join_over_the_limit_is_rejected(conn):
+    guard = QueryGuard(max_join_rows=1000)
+    with pytest.raises(QueryRejectedError, match="joins without an index"):
+        guard.prepare(conn, "SELECT COUNT(*) FROM ad_sales a, total_sales t WHERE a.clicks > t.total_units_ordered")
+    assert guard.rejected_by_reason == {"expensive_join": 1}
+
+
+def test_indexed_join_is_allowed(conn):
+    guard = QueryGuard(max_join_rows=1000)
+    guard.prepare(conn, "SELECT COUNT(*) FROM ad_sales a JOIN total_sales t ON a.item_id = t.item_id AND a.date = t.date")
+    assert guard.rejected == 0
+
+
+def test_row_limit_is_added_only_without_a_top_level_limit():
+    guard = QueryGuard(max_rows=100)
+    assert guard.add_row_limit("SELECT * FROM ad_sales", "select * from ad_sales").endswith("LIMIT 101")
+    assert guard.add_row_limit("SELECT * FROM ad_sales LIMIT 5", "select * from ad_sales limit 5").endswith("LIMIT 5")
+    sub = "select * from (select * from ad_sales limit 5)"
+    assert guard.add_row_limit(sub, sub).endswith("LIMIT 101")
+
+
+def test_results_past_the_row_cap_are_truncated(conn, monkeypatch):
+    monkeypatch.setattr(query_guard, "max_rows", 5)
+    result_cache.clear()
+    output = execute_query(conn, "SELECT item_id FROM ad_sales ORDER BY item_id")
+    assert len(output.rows) == 5 and output.truncated
+    assert not execute_query(conn, "SELECT item_id FROM ad_sales ORDER BY item_id LIMIT 3").truncated
+
+
+def test_runaway_query_is_aborted_at_the_time_limit(conn, monkeypatch):
+    monkeypatch.setattr(query_guard, "timeout_seconds", 0.3)
+    aborted = query_guard.aborted
+    with pytest.raises(QueryTimeoutError):
+        execute_query(conn, RUNAWAY_SQL)
+    assert query_guard.aborted == aborted + 1
+    assert conn.exec_driver_sql("SELECT 1").scalar() == 1 # The connection is still usable
+
+
+def test_stream_time_limit_ignores_time_spent_by_the_reader(conn, monkeypatch):
+    monkeypatch.setattr(query_guard, "timeout_seconds", 0.3)
+    batches = iter_query_batches(conn, "SELECT * FROM ad_sales", 50)
+    for _ in range(3): # 0.45s with the batches held by a slow reader, well under 0.3s fetching
+        next(batches)
+        time.sleep(0.15)
+    batches.close()
+
+
+def test_time_budget_only_runs_while_resumed():
+    budget = TimeBudget(0.05)
+    with budget.paused():
+        time.sleep(0.1)
+    assert not budget.expired()
+    time.sleep(0.1)
+    assert budget.expired()
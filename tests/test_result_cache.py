@@ -0,0 +1,41 @@
+# tests/test_result_cache.py
+from app.utils.result_cache import ResultCache, canonicalize_sql, get_data_version, bump_data_version
+
+
+def test_canonical_sql_folds_case_and_whitespace_but_not_literals():
+    assert canonicalize_sql("select  SUM(x)\nFROM t ;") == canonicalize_sql("SELECT sum( x ) from t")
+    assert canonicalize_sql("SELECT * FROM t WHERE m = 'Ok'") != canonicalize_sql("SELECT * FROM t WHERE m = 'ok'")
+
+
+def test_folding_spaces_never_creates_a_comment_marker():
+    # "5 - -1" is 6; "5--1" is 5 followed by a comment
+    assert canonicalize_sql("SELECT 5 - -1") != canonicalize_sql("SELECT 5--1")
+    assert ResultCache.make_key("SELECT 5 - -1") != ResultCache.make_key("SELECT 5--1")
+    assert canonicalize_sql("SELECT 5 - -1") == canonicalize_sql("select 5 - - 1")
+    assert canonicalize_sql("SELECT a / *b") != canonicalize_sql("SELECT a /*b")
+
+
+def test_key_depends_on_params_and_data_version():
+    sql = "SELECT * FROM ad_sales WHERE item_id = :p0"
+    assert ResultCache.make_key(sql, params={"p0": 1}) != ResultCache.make_key(sql, params={"p0": 2})
+    before = ResultCache.make_key(sql, params={"p0": 1})
+    bump_data_version()
+    assert ResultCache.make_key(sql, params={"p0": 1}) != before
+    assert ResultCache.make_key(sql, data_version=get_data_version() - 1, params={"p0": 1}) == before
+
+
+def test_byte_bound_evicts_least_recently_used():
+    rows = [(i, "x" * 50) for i in range(20)]
+    cache = ResultCache(max_bytes=1)
+    assert not cache.set("too-big", ["a", "b"], rows)
+    cache = ResultCache(max_bytes=10**9)
+    cache.set("a", ["a", "b"], rows)
+    size = cache.total_bytes
+    cache = ResultCache(max_bytes=2 * size)
+    cache.set("a", ["a", "b"], rows)
+    cache.set("b", ["a", "b"], rows)
+    assert cache.get("a") is not None # "b" is now the least recently used
+    cache.set("c", ["a", "b"], rows)
+    assert cache.get("b") is None
+    assert cache.get("a") is not None and cache.get("c") is not None
+    assert cache.stats()["evictions"] == 1
@@ -0,0 +1,61 @@
+# tests/test_rollup_router.py
+import math
+
+import pytest
+
+from app.utils.rollup_router import RollupRouter
+
+
+def _same_rows(a, b):
+    if len(a) != len(b):
+        return False
+    for row_a, row_b in zip(sorted(a, key=repr), sorted(b, key=repr)):
+        for x, y in zip(row_a, row_b):
+            if isinstance(x, float) or isinstance(y, float):
+                if x is None or y is None or not math.isclose(x, y, rel_tol=1e-9, abs_tol=1e-6):
+                    return False
+            elif x != y:
+                return False
+    return True
+
+
+@pytest.fixture
+def conn(loaded_engine):
+    with loaded_engine.connect() as conn:
+        yield conn
+
+
+@pytest.mark.parametrize("sql", [
+    "SELECT SUM(ad_sales) FROM ad_sales",
+    "SELECT item_id, SUM(ad_sales) AS s FROM ad_sales GROUP BY item_id ORDER BY s DESC LIMIT 5",
+    "SELECT date, SUM(total_sales), COUNT(*) FROM total_sales GROUP BY date",
+    "SELECT strftime('%Y-%m', date) AS m, SUM(clicks) FROM ad_sales GROUP BY m",
+    "SELECT SUM(ad_sales) FROM ad_sales WHERE date >= '2025-06-05'",
+    "SELECT item_id, SUM(ad_sales) / NULLIF(SUM(ad_spend), 0) AS RoAS FROM ad_sales GROUP BY item_id ORDER BY RoAS ASC NULLS LAST LIMIT 3",
+    'SELECT SUM(ad_sales) AS "Total Ad Sales" FROM ad_sales',
+])
+def test_routed_queries_match_the_base_table(conn, sql):
+    routed = RollupRouter(enabled=True).route(conn, sql)
+    assert routed.served_by.startswith("_rollup_")
+    assert _same_rows(conn.exec_driver_sql(routed.sql_query).fetchall(), conn.exec_driver_sql(sql).fetchall())
+
+
+@pytest.mark.parametrize("sql", [
+    'SELECT "item_id", SUM(ad_sales) FROM ad_sales GROUP BY "item_id"',
+    "SELECT SUM(ad_sales) FROM ad_sales WHERE \"date\" >= '2025-06-05'",
+    "SELECT SUM(ad_sales) FROM ad_sales WHERE ad_sales.\"item_id\" = 3",
+    "SELECT AVG(ad_sales) FROM ad_sales",
+    "SELECT item_id, ad_sales FROM ad_sales WHERE clicks > 50",
+    "SELECT COUNT(DISTINCT item_id) FROM ad_sales",
+])
+def test_queries_it_cannot_prove_exact_are_left_alone(conn, sql):
+    routed = RollupRouter(enabled=True).route(conn, sql)
+    assert routed.sql_query == sql
+    assert routed.served_by == "ad_sales"
+
+
+def test_quoted_result_alias_in_order_by_still_routes(conn):
+    sql = 'SELECT item_id, SUM(ad_sales) AS "Sales" FROM ad_sales GROUP BY item_id ORDER BY "Sales" DESC LIMIT 3'
+    routed = RollupRouter(enabled=True).route(conn, sql)
+    assert routed.served_by.startswith("_rollup_")
+    assert [r[0] for r in conn.exec_driver_sql(routed.sql_query)] == [r[0] for r in conn.exec_driver_sql(sql)]
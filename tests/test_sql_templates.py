@@ -0,0 +1,75 @@
+# tests/test_sql_templates.py
+import asyncio
+
+import pytest
+
+from app.utils.sql_templates import extract_literals, is_reusable_template, bind_params
+
+TABLE_INFO = {
+    "ad_sales": [("date", "DATE"), ("item_id", "INTEGER"), ("ad_sales", "REAL"), ("clicks", "INTEGER")],
+    "total_sales": [("date", "DATE"), ("item_id", "INTEGER"), ("total_sales", "REAL")],
+}
+
+
+def test_questions_with_different_literals_share_a_shape():
+    shape_a, literals_a = extract_literals("Items with more than 50 clicks on 2025-06-03 in June")
+    shape_b, literals_b = extract_literals("items with more than 7 clicks on 2025-06-09 in july?")
+    assert shape_a == shape_b == "items with more than {number} clicks on {date} in {month}"
+    assert [lit.value for lit in literals_a] == [50, "2025-06-03", "06"]
+    assert [lit.value for lit in literals_b] == [7, "2025-06-09", "07"]
+
+
+def test_month_names_are_literals_only_in_a_date_context():
+    assert extract_literals("Which products may need more ad spend?") == ("which products may need more ad spend", [])
+    assert extract_literals("Which items march ahead on RoAS?") == ("which items march ahead on roas", [])
+    shape, literals = extract_literals("Clicks since March and on 3 May 2025")
+    assert shape == "clicks since {month} and on {number} {month} {year}"
+    assert [lit.value for lit in literals] == ["03", 3, "05", "2025"]
+
+
+def test_comma_grouped_numbers_are_one_literal():
+    shape, literals = extract_literals("sales above 1,000")
+    assert shape == "sales above {number}"
+    assert [(lit.text, lit.value) for lit in literals] == [("1,000", 1000)]
+
+
+def test_template_must_use_exactly_the_requested_placeholders():
+    _, literals = extract_literals("items with more than 50 clicks on 2025-06-03")
+    assert is_reusable_template("SELECT item_id FROM ad_sales WHERE clicks > :p0 AND date = :p1", literals)
+    assert not is_reusable_template("SELECT item_id FROM ad_sales WHERE clicks > 50 AND date = :p1", literals)
+    assert bind_params("SELECT 1 WHERE :p1 = date", literals) == {"p1": "2025-06-03"}
+
+
+class _TemplateModel:
+    """Answers every question with one parameterized template and counts its calls"""
+
+    def __init__(self):
+        self.calls = 0
+
+    def generate_content(self, prompt):
+        self.calls += 1
+        return type("Response", (), {"text": "SELECT item_id FROM ad_sales WHERE clicks > :p0 AND date = :p1;"})()
+
+
+@pytest.fixture
+def agent(monkeypatch):
+    monkeypatch.setenv("GOOGLE_API_KEY", "test")
+    monkeypatch.setenv("RULE_FAST_PATH", "0")
+    from app.utils.text_to_sql import TextToSQLAgent
+    agent = TextToSQLAgent(TABLE_INFO)
+    agent.model = _TemplateModel()
+    return agent
+
+
+def test_cache_then_template_then_llm(agent):
+    async def resolve(question):
+        return await agent.resolve_sql_query(question)
+
+    first = asyncio.run(resolve("Items with more than 50 clicks on 2025-06-03"))
+    again = asyncio.run(resolve("items with more than 50 clicks on 2025-06-03?"))
+    other = asyncio.run(resolve("items with more than 8 clicks on 2025-06-09"))
+    assert (first.source, again.source, other.source) == ("llm", "cache", "template")
+    assert other.params == {"p0": 8, "p1": "2025-06-09"}
+    assert agent.model.calls == 1
+    # Operators are part of the shape: "less than" style questions do not reuse it
+    assert extract_literals("items with clicks < 8")[0] != extract_literals("items with clicks > 8")[0]